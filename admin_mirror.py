@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from typing import List, NamedTuple, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.types import InputMediaPhoto, InputMediaVideo
+
+from send_scheduler import LANE_ADMIN, send_lane
+
+logger = logging.getLogger(__name__)
+
+# Типы, которые можно объединять в альбом
+ALBUM_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+}
+MAX_ALBUM_SIZE = 10
+
+
+class MirrorItem(NamedTuple):
+    user_id: int
+    file_id: str
+    content_type: str
+    caption: str
+
+
+class AlbumMirrorItem(NamedTuple):
+    user_id: int
+    media: List[Tuple[str, str]]  # [(content_type, file_id)]
+    caption: str
+
+
+class AdminMirror:
+    """Фоновое зеркалирование медиа администратору.
+
+    Обработчики только кладут элемент в ограниченную очередь и сразу
+    продолжают пересылку собеседнику. Воркер забирает элементы пачками и
+    отправляет фото и видео альбомами через ``send_media_group``. Если очередь
+    заполнена, элемент отбрасывается и учитывается в ``dropped``.
+    """
+
+    def __init__(self, bot: Bot, admin_id: int, max_queue: int = 1000, batch_window: float = 1.0) -> None:
+        self.bot = bot
+        self.admin_id = admin_id
+        self.batch_window = batch_window
+        self._queue: asyncio.Queue[Union[MirrorItem, AlbumMirrorItem]] = asyncio.Queue(maxsize=max_queue)
+        self._worker: Optional[asyncio.Task] = None
+        self.mirrored = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return self._queue.qsize()
+
+    def submit(self, user_id: int, file_id: str, content_type: str, caption: str) -> bool:
+        """Постановка медиа в очередь зеркалирования без ожидания"""
+        return self._put(MirrorItem(user_id, file_id, content_type, caption))
+
+    def submit_album(self, user_id: int, media: List[Tuple[str, str]], caption: str) -> bool:
+        """Постановка альбома пользователя: администратор получит его одним сообщением"""
+        media = [(content_type, file_id) for content_type, file_id in media if content_type in ALBUM_MEDIA]
+        if not media:
+            return False
+        return self._put(AlbumMirrorItem(user_id, media[:MAX_ALBUM_SIZE], caption))
+
+    def _put(self, item: Union[MirrorItem, AlbumMirrorItem]) -> bool:
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning("Очередь зеркалирования переполнена, отброшено медиа: %d", self.dropped)
+            return False
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            try:
+                with send_lane(LANE_ADMIN):
+                    await self._send_batch(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failed += len(batch)
+                logger.error("Ошибка пересылки медиа администратору: %s", e, exc_info=True)
+
+    async def _collect(self) -> List[Union[MirrorItem, AlbumMirrorItem]]:
+        """Ожидание первого элемента и добор пачки в пределах окна"""
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        while len(batch) < MAX_ALBUM_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            # asyncio.timeout, а не wait_for: wait_for в Python 3.11 теряет отмену,
+            # если элемент пришёл одновременно с ней, и stop() ждёт воркер вечно
+            try:
+                async with asyncio.timeout(timeout):
+                    batch.append(await self._queue.get())
+            except TimeoutError:
+                break
+        return batch
+
+    async def _send_batch(self, batch: List[Union[MirrorItem, AlbumMirrorItem]]) -> None:
+        for item in batch:
+            if isinstance(item, AlbumMirrorItem):
+                await self._send_album(item)
+        batch = [item for item in batch if isinstance(item, MirrorItem)]
+
+        album = [item for item in batch if item.content_type in ALBUM_MEDIA]
+        if len(album) > 1:
+            await self.bot.send_media_group(
+                self.admin_id,
+                [ALBUM_MEDIA[item.content_type](media=item.file_id, caption=item.caption) for item in album]
+            )
+            self.mirrored += len(album)
+        else:
+            album = []
+
+        for item in batch:
+            if album and item.content_type in ALBUM_MEDIA:
+                continue
+            await self._send_single(item)
+            self.mirrored += 1
+
+    async def _send_album(self, item: AlbumMirrorItem) -> None:
+        media = [
+            ALBUM_MEDIA[content_type](media=file_id, caption=item.caption if i == 0 else None)
+            for i, (content_type, file_id) in enumerate(item.media)
+        ]
+        if len(media) == 1:
+            content_type, file_id = item.media[0]
+            await self._send_single(MirrorItem(item.user_id, file_id, content_type, item.caption))
+        else:
+            await self.bot.send_media_group(self.admin_id, media)
+        self.mirrored += len(media)
+
+    async def _send_single(self, item: MirrorItem) -> None:
+        if item.content_type == "photo":
+            await self.bot.send_photo(self.admin_id, item.file_id, caption=item.caption)
+        elif item.content_type == "video":
+            await self.bot.send_video(self.admin_id, item.file_id, caption=item.caption)
+        elif item.content_type == "voice":
+            await self.bot.send_voice(self.admin_id, item.file_id, caption=item.caption)
+        elif item.content_type == "video_note":
+            await self.bot.send_video_note(self.admin_id, item.file_id)
+            await self.bot.send_message(self.admin_id, item.caption)
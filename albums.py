@@ -0,0 +1,103 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+# В альбоме Telegram не больше 10 элементов
+MAX_ALBUM_SIZE = 10
+
+AlbumKey = Tuple[int, str]
+AlbumHandler = Callable[[List[Message]], Awaitable[None]]
+
+
+class AlbumCoalescer:
+    """Сборка сообщений одного альбома (media_group_id) в одну пачку.
+
+    Telegram присылает альбом отдельными обновлениями. Сообщения копятся,
+    пока в течение ``window`` секунд не придёт новое сообщение того же
+    альбома (или пока их не станет 10), после чего весь альбом передаётся
+    в ``on_album`` одним списком.
+
+    Альбомы одного чата отправляются по очереди. ``drain`` отправляет
+    накопленные альбомы чата и ждёт их доставки: его вызывают перед
+    обработкой следующего сообщения того же пользователя, чтобы альбом
+    не обогнал сообщение, отправленное после него. Альбомы индексируются
+    по чату, поэтому ``drain`` не просматривает альбомы других чатов.
+    """
+
+    def __init__(self, on_album: AlbumHandler, window: float = 0.5) -> None:
+        self.on_album = on_album
+        self.window = window
+        self._albums: Dict[AlbumKey, List[Message]] = {}
+        self._timers: Dict[AlbumKey, asyncio.TimerHandle] = {}
+        self._by_chat: Dict[int, Dict[str, None]] = {}  # {chat_id: альбомы в порядке начала}
+        self._tasks: Dict[int, asyncio.Task] = {}  # {chat_id: доставка последнего альбома}
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    def add(self, message: Message) -> None:
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = []
+            self._by_chat.setdefault(key[0], {})[key[1]] = None
+        album.append(message)
+
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if len(album) >= MAX_ALBUM_SIZE:
+            self._flush(key)
+        else:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+    def _flush(self, key: AlbumKey) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        album = self._albums.pop(key, None)
+        if not album:
+            return
+        chat_id, group = key
+        pending = self._by_chat[chat_id]
+        del pending[group]
+        if not pending:
+            del self._by_chat[chat_id]
+        album.sort(key=lambda message: message.message_id)
+        self.coalesced += len(album) - 1
+        task = asyncio.create_task(self._deliver(album, self._tasks.get(chat_id)))
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda done: self._forget(chat_id, done))
+
+    def _forget(self, chat_id: int, task: asyncio.Task) -> None:
+        if self._tasks.get(chat_id) is task:
+            del self._tasks[chat_id]
+
+    async def _deliver(self, album: List[Message], previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            # Предыдущий альбом того же чата уходит первым
+            await asyncio.gather(previous, return_exceptions=True)
+        try:
+            await self.on_album(album)
+        except Exception as e:
+            logger.error("Ошибка пересылки альбома: %s", e, exc_info=True)
+
+    async def drain(self, chat_id: int) -> None:
+        """Немедленная отправка альбомов чата и ожидание их доставки"""
+        for group in list(self._by_chat.get(chat_id, ())):
+            self._flush((chat_id, group))
+        task = self._tasks.get(chat_id)
+        if task is not None:
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def close(self) -> None:
+        """Немедленная отправка всех накопленных альбомов"""
+        for key in list(self._albums):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
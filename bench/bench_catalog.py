@@ -0,0 +1,82 @@
+"""Микробенчмарк каталога ответов: подготовка одного пересылаемого сообщения.
+
+Сравнивается путь ``forward_message`` до запроса в сеть: создание клавиатуры
+меню, метода ``SendMessage`` и сборка формы запроса сессией. Прежде
+клавиатура строилась ``ReplyKeyboardBuilder`` и сериализовалась на каждое
+сообщение, теперь берётся готовой из ``ResponseCatalog`` вместе с JSON::
+
+    python -m bench.bench_catalog
+    python -m bench.bench_catalog --messages 20000 --repeat 5
+"""
+import argparse
+import asyncio
+import time
+from typing import Callable
+
+from aiogram import Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+from aiogram.utils.keyboard import ReplyKeyboardBuilder
+
+from catalog import CatalogSession, ResponseCatalog
+
+TEXT = "👤: Привет! Как дела? Что делаешь сегодня вечером?"
+
+
+def get_menu_keyboard() -> ReplyKeyboardMarkup:
+    """Клавиатура меню, как её строил bot.py до каталога"""
+    builder = ReplyKeyboardBuilder()
+    builder.add(KeyboardButton(text="📱 Меню"))
+    return builder.as_markup(resize_keyboard=True)
+
+
+def per_message_us(relay: Callable[[int], None], messages: int, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for chat_id in range(messages):
+            relay(chat_id)
+        best = min(best, time.perf_counter() - started)
+    return best / messages * 1e6
+
+
+async def main(args: argparse.Namespace) -> None:
+    catalog = ResponseCatalog()
+    menu = catalog.locale().keyboards.menu
+    plain = AiohttpSession()
+    cached = CatalogSession(catalog)
+    bot = Bot("123:bench", session=plain, default=DefaultBotProperties(parse_mode="HTML"))
+
+    def before(chat_id: int) -> None:
+        plain.build_form_data(bot, SendMessage(chat_id=chat_id, text=TEXT, reply_markup=get_menu_keyboard()))
+
+    def catalog_only(chat_id: int) -> None:
+        plain.build_form_data(bot, SendMessage(chat_id=chat_id, text=TEXT, reply_markup=menu))
+
+    def after(chat_id: int) -> None:
+        cached.build_form_data(bot, SendMessage(chat_id=chat_id, text=TEXT, reply_markup=menu))
+
+    results = [
+        ("клавиатура на каждое сообщение", per_message_us(before, args.messages, args.repeat)),
+        ("клавиатура из каталога", per_message_us(catalog_only, args.messages, args.repeat)),
+        ("каталог и готовый JSON", per_message_us(after, args.messages, args.repeat)),
+    ]
+    baseline = results[0][1]
+    print(f"{'вариант':<34} {'мкс/сообщение':>14} {'ускорение':>10}")
+    for name, value in results:
+        print(f"{name:<34} {value:>14.2f} {baseline / value:>9.2f}x")
+    await plain.close()
+    await cached.close()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=10000, help="сообщений в замере")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов, берётся лучший")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,99 @@
+"""Микробенчмарк модерации: стоимость проверки сообщения в зависимости от числа правил.
+
+Для каждого размера набора правил (слова и домены поровну) сравнивается
+одно общее выражение ``Moderator`` с наивной проверкой отдельным
+регулярным выражением на каждое правило::
+
+    python -m bench.bench_moderation
+    python -m bench.bench_moderation --rules 10 100 1000 10000 --messages 2000
+"""
+import argparse
+import random
+import re
+import string
+import time
+from typing import List, Tuple
+
+from moderation import RULE_DOMAIN, RULE_MENTION, RULE_URL, RULE_WORD, Moderator
+
+WORDS = (
+    "привет как дела что делаешь сегодня погода хорошая люблю музыку кино книги "
+    "hello how are you doing today nice to meet you where are you from"
+).split()
+
+
+def random_word(rng: random.Random, alphabet: str, length: int) -> str:
+    return "".join(rng.choice(alphabet) for _ in range(length))
+
+
+def make_rules(count: int, rng: random.Random) -> List[Tuple[str, str]]:
+    """``count`` правил: половина слов, половина доменов, плюс ссылки и упоминания"""
+    letters = "абвгдеёжзийклмнопрстуфхцчшщъыьэюя"
+    rules = [(RULE_URL, "*"), (RULE_MENTION, "*")]
+    for index in range(count):
+        if index % 2:
+            rules.append((RULE_DOMAIN, f"{random_word(rng, string.ascii_lowercase, rng.randint(4, 10))}.com"))
+        else:
+            rules.append((RULE_WORD, random_word(rng, letters, rng.randint(4, 10))))
+    return rules
+
+
+def make_messages(count: int, rng: random.Random) -> List[str]:
+    """Обычные сообщения чата из 5–30 слов, нарушений почти нет"""
+    return [" ".join(rng.choice(WORDS) for _ in range(rng.randint(5, 30))) for _ in range(count)]
+
+
+def naive_patterns(rules: List[Tuple[str, str]]) -> List[re.Pattern]:
+    patterns = []
+    for kind, value in rules:
+        if kind in (RULE_WORD, RULE_DOMAIN):
+            patterns.append(re.compile(rf"\b{re.escape(value)}\b", re.IGNORECASE))
+        elif kind == RULE_URL:
+            patterns.append(re.compile(r"https?://\S+"))
+        else:
+            patterns.append(re.compile(r"@\w{4,32}"))
+    return patterns
+
+
+def per_message_us(check, messages: List[str], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for message in messages:
+            check(message)
+        best = min(best, time.perf_counter() - started)
+    return best / len(messages) * 1e6
+
+
+def main(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    messages = make_messages(args.messages, rng)
+    print(f"{'правил':>8} {'сборка, мс':>12} {'общее, мкс':>12} {'наивно, мкс':>12}")
+    for count in args.rules:
+        rules = make_rules(count, rng)
+        moderator = Moderator()
+        started = time.perf_counter()
+        moderator.load_rules(rules)
+        build_ms = (time.perf_counter() - started) * 1000
+        combined = per_message_us(moderator.check, messages, args.repeat)
+
+        if count <= args.naive_limit:
+            patterns = naive_patterns(rules)
+            naive = f"{per_message_us(lambda text: any(p.search(text) for p in patterns), messages, args.repeat):12.2f}"
+        else:
+            naive = f"{'—':>12}"
+        print(f"{count:>8} {build_ms:>12.1f} {combined:>12.2f} {naive}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 100, 1000, 10000], help="размеры наборов правил")
+    parser.add_argument("--messages", type=int, default=1000, help="сообщений в выборке")
+    parser.add_argument("--repeat", type=int, default=3, help="повторов, берётся лучший")
+    parser.add_argument("--naive-limit", type=int, default=1000, help="наибольший набор для наивной проверки")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
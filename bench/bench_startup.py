@@ -0,0 +1,147 @@
+"""Бенчмарк холодного старта: импорт bot.py и время до первого ответа.
+
+Бот запускается отдельным процессом в режиме polling против FakeBotAPI,
+как после пробуждения сервиса: состояние лежит в SQLite, а в getUpdates
+ждёт одно сообщение /start. Замеряется импорт модуля bot и время от
+запуска процесса до ответа на это сообщение. Состояние восстанавливается
+по записям и из снимка, который хранилище сохраняет при выключении::
+
+    python -m bench.bench_startup
+    python -m bench.bench_startup --users 100000 --runs 5
+"""
+import argparse
+import asyncio
+import os
+import signal
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from bench.fake_api import FakeBotAPI
+from storage import NS_USERS, SQLiteStateStore
+
+ROOT = Path(__file__).resolve().parent.parent
+TOKEN = "123456:BENCHMARK-TOKEN"
+CHAT_ID = 10 ** 9
+
+# Код дочернего процесса: время импорта в stdout, затем обычный запуск polling
+CHILD = (
+    "import time\n"
+    "started = time.perf_counter()\n"
+    "import bot\n"
+    "print(time.perf_counter() - started, flush=True)\n"
+    "import asyncio\n"
+    "asyncio.run(bot.polling_main())\n"
+)
+
+
+def start_update(update_id: int) -> Dict[str, Any]:
+    user = {"id": CHAT_ID, "is_bot": False, "first_name": "Bench"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": CHAT_ID, "type": "private"},
+            "from": user,
+            "text": "/start",
+        },
+    }
+
+
+async def prefill(path: Path, users: int) -> None:
+    """База состояния с ``users`` пользователями и снимком, как после выключения"""
+    store = SQLiteStateStore(str(path), max_pending=users + 1)
+    for user_id in range(1, users + 1):
+        store.put(NS_USERS, user_id, {"username": f"user{user_id}", "first_name": "Пользователь", "last_name": None})
+    await store.close()
+
+
+async def run_once(api: FakeBotAPI, env: Dict[str, str], workdir: str, update_id: int) -> Tuple[float, float, float]:
+    """Импорт, время до первого ответа и выключение одного запуска, сек"""
+    replied = asyncio.Event()
+
+    def on_request(method: str, payload: Dict[str, Any], received_at: float) -> None:
+        if method == "sendMessage" and str(payload.get("chat_id")) == str(CHAT_ID):
+            replied.set()
+
+    api.listeners.append(on_request)
+    api.push_update(start_update(update_id))
+    spawned = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "-c", CHILD, env=env, cwd=workdir,
+        stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        import_s = float((await asyncio.wait_for(process.stdout.readline(), 60)).decode())
+        await asyncio.wait_for(replied.wait(), 60)
+        first_reply = time.perf_counter() - spawned
+        stopping = time.perf_counter()
+        process.send_signal(signal.SIGTERM)
+        await asyncio.wait_for(process.wait(), 60)
+        return import_s, first_reply, time.perf_counter() - stopping
+    finally:
+        api.listeners.remove(on_request)
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+
+
+async def interpreter_start(env: Dict[str, str], workdir: str) -> float:
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, "-c", "pass", env=env, cwd=workdir)
+    await process.wait()
+    return time.perf_counter() - started
+
+
+async def main(args: argparse.Namespace) -> None:
+    api = FakeBotAPI()
+    await api.start()
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = Path(workdir) / "state.db"
+        await prefill(db_path, args.users)
+        env = {
+            key: value for key, value in os.environ.items()
+            if key in ("PATH", "HOME", "LANG", "LC_ALL", "SYSTEMROOT")
+        }
+        env.update({
+            "PYTHONPATH": str(ROOT),
+            "TELEGRAM_BOT_TOKEN": TOKEN,
+            "TELEGRAM_API_URL": api.base_url,
+            "STATE_STORE_URL": f"sqlite:///{db_path}",
+            "MODERATION_RULES": str(ROOT / "moderation_rules.txt"),
+            "LOG_FILE": "",
+            "LOG_LEVEL": "WARNING",
+        })
+
+        baseline = min([await interpreter_start(env, workdir) for _ in range(3)])
+        print(f"Запуск интерпретатора: {baseline:.3f} с, пользователей в состоянии: {args.users}")
+        print(f"{'состояние':<12} {'импорт, с':>10} {'первый ответ, с':>16} {'после импорта, с':>17} {'выключение, с':>14}")
+        update_id = 1
+        for mode in ("записи", "снимок"):
+            results: List[Tuple[float, float, float]] = []
+            for _ in range(args.runs):
+                if mode == "записи":
+                    with sqlite3.connect(db_path) as db:
+                        db.execute("DELETE FROM state_snapshot")
+                results.append(await run_once(api, env, workdir, update_id))
+                update_id += 1
+            import_s, first_reply, shutdown = (statistics.median(column) for column in zip(*results))
+            after_import = statistics.median(reply - imported for imported, reply, _ in results)
+            print(f"{mode:<12} {import_s:>10.3f} {first_reply:>16.3f} {after_import:>17.3f} {shutdown:>14.3f}")
+    await api.stop()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50000, help="пользователей в сохранённом состоянии")
+    parser.add_argument("--runs", type=int, default=3, help="запусков на вариант, берётся медиана")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
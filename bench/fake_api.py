@@ -0,0 +1,163 @@
+"""Локальная замена Telegram Bot API для нагрузочных тестов.
+
+Сервер принимает запросы вида ``/bot<token>/<method>``, записывает их и
+возвращает правдоподобный ответ. Можно добавить задержку ответа и долю
+ответов 429 с ``retry_after``, а чаты из ``blocked`` отвечают 403, как
+заблокировавшие бота пользователи. Обновления из ``push_update`` отдаются
+через getUpdates с долгим опросом, как в режиме polling.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from aiohttp import web
+
+# Методы, которые возвращают отправленное сообщение
+MESSAGE_METHODS = {
+    "sendMessage", "sendPhoto", "sendVideo", "sendVoice", "sendVideoNote", "sendAudio",
+    "sendDocument", "sendAnimation", "sendSticker",
+}
+
+RequestListener = Callable[[str, Dict[str, Any], float], None]
+
+
+def _chat_id(payload: Dict[str, Any]) -> Optional[int]:
+    try:
+        return int(payload["chat_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class FakeBotAPI:
+    """Сервер, имитирующий Bot API"""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        retry_after: int = 1,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.calls: Counter = Counter()
+        self.throttled = 0
+        self.blocked: Set[int] = set()
+        self.blocked_calls = 0
+        self.listeners: List[RequestListener] = []
+        self._message_ids = itertools.count(1)
+        self._updates: List[Dict[str, Any]] = []
+        self._updates_ready = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push_update(self, update: Dict[str, Any]) -> None:
+        """Обновление для следующего getUpdates"""
+        self._updates.append(update)
+        self._updates_ready.set()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        payload = await self._read_payload(request)
+        received_at = time.perf_counter()
+        self.calls[method] += 1
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(request, payload)})
+
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if self.error_rate and method in MESSAGE_METHODS and random.random() < self.error_rate:
+            self.throttled += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+
+        if self.blocked and _chat_id(payload) in self.blocked:
+            self.blocked_calls += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 403,
+                "description": "Forbidden: bot was blocked by the user",
+            }, status=403)
+
+        for listener in self.listeners:
+            listener(method, payload, received_at)
+        return web.json_response({"ok": True, "result": self._result(method, payload)})
+
+    @staticmethod
+    async def _read_payload(request: web.Request) -> Dict[str, Any]:
+        if request.content_type == "application/json":
+            return await request.json()
+        payload: Dict[str, Any] = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            payload[key] = value
+        return payload
+
+    async def _get_updates(self, request: web.Request, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if not self._updates:
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), float(payload.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        if request.transport is None or request.transport.is_closing():
+            # Клиент ушёл, не дождавшись ответа: обновления достанутся следующему запросу
+            return []
+        updates, self._updates = self._updates, []
+        self._updates_ready.clear()
+        return updates
+
+    def _message(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = int(payload.get("chat_id", 0))
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": payload.get("text", ""),
+        }
+
+    def _result(self, method: str, payload: Dict[str, Any]) -> Any:
+        if method in MESSAGE_METHODS:
+            return self._message(payload)
+        if method == "sendMediaGroup":
+            return [self._message(payload) for _ in payload.get("media", [])]
+        if method == "copyMessage":
+            return {"message_id": next(self._message_ids)}
+        if method == "getMe":
+            return {"id": 123456, "is_bot": True, "first_name": "Bench", "username": "BenchBot"}
+        return True
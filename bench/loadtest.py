@@ -0,0 +1,416 @@
+"""Нагрузочный тест бота без выхода в сеть.
+
+Поднимает ``FakeBotAPI``, направляет на него ``Bot`` через ``TELEGRAM_API_URL``
+и прогоняет синтетические потоки обновлений через диспетчер:
+
+* ``find_storm`` — одновременный /find от всех пользователей;
+* ``chatty_pairs`` — пары обмениваются текстом;
+* ``media_burst`` — пары обмениваются фото;
+* ``album_burst`` — пары обмениваются альбомами из 5 фото;
+* ``next_churn`` — пары многократно меняют собеседника через /next.
+
+Результаты (обновлений/с, задержки пересылки и поиска p50/p99, память на
+сессию) печатаются и сохраняются в ``bench/results``, чтобы сравнивать прогоны::
+
+    python -m bench.loadtest --users 2000 --messages 5
+    python -m bench.loadtest --compare bench/results/20261017-120000.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import re
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from bench.fake_api import FakeBotAPI
+
+RESULTS_DIR = Path(__file__).parent / "results"
+TOKEN = "123456:BENCHMARK-TOKEN"
+MATCH_TEXT = "Собеседник найден"
+RELAY_TOKEN = re.compile(r"msg-\d+")
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Harness:
+    """Подача обновлений в диспетчер и сопоставление исходящих запросов"""
+
+    def __init__(self, api: FakeBotAPI, bot_module: Any, concurrency: int) -> None:
+        self.api = api
+        self.bot_module = bot_module
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.expected: Dict[Any, Tuple[float, Tuple[Any, ...]]] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.delivered = asyncio.Event()
+        api.listeners.append(self._on_request)
+
+    def _on_request(self, method: str, payload: Dict[str, Any], received_at: float) -> None:
+        for key in self._keys(method, payload):
+            entry = self.expected.pop(key, None)
+            if entry is not None:
+                sent_at, aliases = entry
+                for alias in aliases:
+                    self.expected.pop(alias, None)
+                self.latencies[key[0]].append(received_at - sent_at)
+        if not self.expected:
+            self.delivered.set()
+
+    @staticmethod
+    def _keys(method: str, payload: Dict[str, Any]) -> Iterable[Any]:
+        text = str(payload.get("text") or "")
+        if MATCH_TEXT in text:
+            yield "match", int(payload["chat_id"])
+        for token in RELAY_TOKEN.findall(text):
+            yield "relay", token
+        for field in ("photo", "video", "voice", "video_note", "document", "animation", "audio", "sticker"):
+            if isinstance(payload.get(field), str):
+                yield "relay", payload[field]
+        if method == "copyMessage":
+            yield "relay", f"{payload.get('from_chat_id')}:{payload.get('message_id')}"
+        for media in payload.get("media") or ():
+            if isinstance(media, dict):
+                yield "relay", media.get("media")
+
+    def expect(self, *keys: Any) -> None:
+        """Ожидание исходящего запроса, который совпадёт с любым из ключей"""
+        entry = (time.perf_counter(), keys)
+        for key in keys:
+            self.expected[key] = entry
+        self.delivered.clear()
+
+    def _user(self, user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, **content: Any) -> Dict[str, Any]:
+        message_id = next(self.message_ids)
+        return {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                **content,
+            },
+        }
+
+    def callback(self, user_id: int, data: str) -> Dict[str, Any]:
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.message_ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+            },
+        }
+
+    async def feed(self, update: Dict[str, Any]) -> None:
+        async with self.semaphore:
+            await self.bot_module.dp.feed_raw_update(self.bot_module.bot, update)
+
+    async def run(self, updates: List[Dict[str, Any]], before: Optional[Callable] = None) -> float:
+        """Подача обновлений и ожидание доставки. Возвращает обновлений в секунду"""
+        started = time.perf_counter()
+
+        async def feed_one(update: Dict[str, Any]) -> None:
+            if before is not None:
+                before(update)
+            await self.feed(update)
+
+        await asyncio.gather(*(feed_one(update) for update in updates))
+        elapsed = time.perf_counter() - started
+        try:
+            await asyncio.wait_for(self.delivered.wait(), timeout=30)
+        except asyncio.TimeoutError:
+            logging.warning("Не доставлено %d сообщений", len(self.expected))
+            self.expected.clear()
+        return len(updates) / elapsed if elapsed else 0.0
+
+    def take_latencies(self, kind: str) -> Dict[str, float]:
+        values = self.latencies.pop(kind, [])
+        return {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+
+
+class Scenarios:
+    def __init__(self, harness: Harness, users: int, messages: int) -> None:
+        self.h = harness
+        self.users = users
+        self.messages = messages
+        self.id_base = 10_000_000
+
+    def _ids(self) -> List[int]:
+        """Новый диапазон пользователей для каждого сценария"""
+        self.id_base += 1_000_000
+        return list(range(self.id_base, self.id_base + self.users))
+
+    def _pairs(self, user_ids: List[int]) -> List[int]:
+        sessions = self.h.bot_module.chat_sessions
+        return [uid for uid in user_ids if sessions.cached_partner(uid) is not None]
+
+    async def _match(self, user_ids: List[int], timed: bool) -> float:
+        updates = [self.h.message(uid, text="/find") for uid in user_ids]
+
+        def before(update: Dict[str, Any]) -> None:
+            if timed:
+                self.h.expect(("match", update["message"]["from"]["id"]))
+
+        return await self.h.run(updates, before)
+
+    async def find_storm(self) -> Dict[str, Any]:
+        user_ids = self._ids()
+        rate = await self._match(user_ids, timed=True)
+        return {"updates_per_s": rate, "matchmaking": self.h.take_latencies("match"),
+                "paired": len(self._pairs(user_ids))}
+
+    async def chatty_pairs(self) -> Dict[str, Any]:
+        user_ids = self._ids()
+        await self._match(user_ids, timed=False)
+        senders = self._pairs(user_ids)
+        counter = itertools.count()
+        updates = [
+            self.h.message(uid, text=f"hello msg-{next(counter)}")
+            for _ in range(self.messages) for uid in senders
+        ]
+
+        def before(update: Dict[str, Any]) -> None:
+            self.h.expect(("relay", RELAY_TOKEN.search(update["message"]["text"]).group()))
+
+        rate = await self.h.run(updates, before)
+        return {"updates_per_s": rate, "relay": self.h.take_latencies("relay")}
+
+    async def media_burst(self) -> Dict[str, Any]:
+        user_ids = self._ids()
+        await self._match(user_ids, timed=False)
+        senders = self._pairs(user_ids)
+        counter = itertools.count()
+        updates = []
+        for _ in range(self.messages):
+            for uid in senders:
+                file_id = f"photo-{next(counter)}"
+                updates.append(self.h.message(uid, photo=[
+                    {"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}
+                ]))
+
+        def before(update: Dict[str, Any]) -> None:
+            message = update["message"]
+            # Фото может быть переслано как sendPhoto, copyMessage или альбомом
+            self.h.expect(
+                ("relay", message["photo"][-1]["file_id"]),
+                ("relay", f"{message['chat']['id']}:{message['message_id']}")
+            )
+
+        rate = await self.h.run(updates, before)
+        return {"updates_per_s": rate, "relay": self.h.take_latencies("relay")}
+
+    async def album_burst(self) -> Dict[str, Any]:
+        user_ids = self._ids()
+        await self._match(user_ids, timed=False)
+        senders = self._pairs(user_ids)
+        counter = itertools.count()
+        updates = []
+        for album in range(self.messages):
+            for uid in senders:
+                for _ in range(5):
+                    file_id = f"album-{next(counter)}"
+                    updates.append(self.h.message(uid, media_group_id=f"{uid}-{album}", photo=[
+                        {"file_id": file_id, "file_unique_id": file_id, "width": 800, "height": 600}
+                    ]))
+
+        def before(update: Dict[str, Any]) -> None:
+            self.h.expect(("relay", update["message"]["photo"][-1]["file_id"]))
+
+        calls_before = sum(self.h.api.calls.values())
+        rate = await self.h.run(updates, before)
+        return {"updates_per_s": rate, "relay": self.h.take_latencies("relay"),
+                "api_calls_per_update": (sum(self.h.api.calls.values()) - calls_before) / len(updates)}
+
+    async def next_churn(self) -> Dict[str, Any]:
+        user_ids = self._ids()
+        await self._match(user_ids, timed=False)
+        senders = self._pairs(user_ids)[::2]
+        updates = []
+        for _ in range(self.messages):
+            updates.extend(self.h.message(uid, text="/next") for uid in senders)
+            updates.extend(self.h.callback(uid, "confirm_next_yes") for uid in senders)
+        started = time.perf_counter()
+        for update in updates:
+            await self.h.feed(update)
+        elapsed = time.perf_counter() - started
+        sessions = self.h.bot_module.chat_sessions
+        broken = 0
+        for uid in await sessions.active_user_ids():
+            partner_id = await sessions.partner_of(uid)
+            if partner_id is None or await sessions.partner_of(partner_id) != uid:
+                broken += 1
+        return {"updates_per_s": len(updates) / elapsed if elapsed else 0.0,
+                "paired": len(self._pairs(user_ids)), "inconsistent_pairs": broken}
+
+    async def blocked_partners(self) -> Dict[str, Any]:
+        """Половина собеседников заблокировала бота: запросы к ним и оставшиеся чаты"""
+        user_ids = self._ids()
+        await self._match(user_ids, timed=False)
+        sessions = self.h.bot_module.chat_sessions
+        senders = []
+        for uid in self._pairs(user_ids):
+            partner_id = sessions.cached_partner(uid)
+            if uid not in self.h.api.blocked and partner_id not in self.h.api.blocked:
+                self.h.api.blocked.add(partner_id)
+                senders.append(uid)
+        calls_before = self.h.api.blocked_calls
+        counter = itertools.count()
+        for _ in range(self.messages):
+            await asyncio.gather(*(
+                self.h.feed(self.h.message(uid, text=f"hello msg-{next(counter)}")) for uid in senders
+            ))
+        stale = 0
+        for uid in self.h.api.blocked:
+            if await sessions.partner_of(uid) is not None:
+                stale += 1
+        self.h.api.blocked.clear()
+        return {"blocked_users": len(senders),
+                "api_calls_per_blocked_user": (self.h.api.blocked_calls - calls_before) / max(1, len(senders)),
+                "stale_pairs": stale}
+
+    async def flood_abuser(self) -> Dict[str, Any]:
+        """Один пользователь шлёт сотни сообщений подряд: сколько из них дошло до API"""
+        flood = self.h.bot_module.flood_control
+        limits = flood.text_rate, flood.text_burst
+        flood.text_rate, flood.text_burst = 1.0, 5.0
+        abuser, partner = self._ids()[:2]
+        await self._match([abuser, partner], timed=False)
+        dropped_before = flood.dropped["text"] + flood.dropped_muted
+        calls_before = sum(self.h.api.calls.values())
+        updates = [self.h.message(abuser, text=f"spam msg-{n}") for n in range(self.users)]
+        started = time.perf_counter()
+        try:
+            await asyncio.gather(*(self.h.feed(update) for update in updates))
+        finally:
+            flood.text_rate, flood.text_burst = limits
+        elapsed = time.perf_counter() - started
+        return {"updates_per_s": len(updates) / elapsed if elapsed else 0.0,
+                "api_calls": sum(self.h.api.calls.values()) - calls_before,
+                "dropped": flood.dropped["text"] + flood.dropped_muted - dropped_before}
+
+    async def session_memory(self) -> Dict[str, Any]:
+        user_ids = self._ids()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        await self._match(user_ids, timed=False)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+        sessions = max(1, len(self._pairs(user_ids)))
+        return {"bytes_per_user_in_session": allocated / sessions, "users_in_session": sessions}
+
+
+SCENARIOS = (
+    "find_storm", "chatty_pairs", "media_burst", "album_burst", "next_churn", "blocked_partners",
+    "flood_abuser", "session_memory",
+)
+
+
+def compare(current: Dict[str, Any], previous: Dict[str, Any], prefix: str = "") -> None:
+    """Печать изменений числовых метрик относительно прошлого прогона"""
+    for key, value in current.items():
+        old = previous.get(key)
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and isinstance(old, dict):
+            compare(value, old, f"{name}.")
+        elif isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+            print(f"  {name:45} {old:12.2f} -> {value:12.2f} ({(value - old) / old:+.1%})")
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    api = FakeBotAPI(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate)
+    await api.start()
+
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "TELEGRAM_API_URL": api.base_url,
+        "STATE_STORE_URL": "memory://",
+        "SESSION_BACKEND_URL": args.session_backend,
+        "SEND_GLOBAL_RATE": str(args.global_rate),
+        "SEND_CHAT_RATE": str(args.chat_rate),
+        "SEND_CHAT_BURST": str(args.chat_rate),
+        "SEND_QUEUE_LIMIT": str(10 ** 6),
+        "FLOOD_TEXT_RATE": str(args.flood_rate),
+        "FLOOD_TEXT_BURST": str(args.flood_rate),
+        "FLOOD_MEDIA_RATE": str(args.flood_rate),
+        "FLOOD_MEDIA_BURST": str(args.flood_rate),
+    })
+    import bot as bot_module
+    logging.getLogger().setLevel(logging.WARNING)
+
+    await bot_module.dp.emit_startup(bot=bot_module.bot, dispatcher=bot_module.dp)
+    harness = Harness(api, bot_module, args.concurrency)
+    scenarios = Scenarios(harness, args.users, args.messages)
+    results: Dict[str, Any] = {
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    try:
+        for name in args.scenarios:
+            results[name] = await getattr(scenarios, name)()
+            print(f"{name}: {json.dumps(results[name], ensure_ascii=False)}")
+    finally:
+        results["http_pool"] = bot_module.session.pool_stats()
+        # Как при SIGTERM: без этого выключение считается перезапуском polling и воркеры не останавливаются
+        bot_module.shutdown_requested.set()
+        await bot_module.dp.emit_shutdown(bot=bot_module.bot, dispatcher=bot_module.dp)
+        await bot_module.bot.session.close()
+        await api.stop()
+    results["api_calls"] = dict(api.calls)
+    results["api_throttled"] = api.throttled
+    return results
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="пользователей в сценарии (чётное число)")
+    parser.add_argument("--messages", type=int, default=3, help="сообщений или смен собеседника на пользователя")
+    parser.add_argument("--concurrency", type=int, default=500, help="одновременно обрабатываемых обновлений")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа API, сек")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--global-rate", type=float, default=1e6, help="глобальный лимит планировщика, сообщений/с")
+    parser.add_argument("--chat-rate", type=float, default=1e6, help="лимит на чат, сообщений/с")
+    parser.add_argument("--flood-rate", type=float, default=1e6,
+                        help="входящий лимит на пользователя (текст и медиа), обновлений/с")
+    parser.add_argument("--session-backend", default="local://",
+                        help="бэкенд чатов, например sqlite:///bench-sessions.db")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument("--output", type=Path, help="файл результатов (по умолчанию bench/results/<время>.json)")
+    parser.add_argument("--compare", type=Path, help="сравнить с сохранённым прогоном")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = asyncio.run(main(args))
+
+    output = args.output or RESULTS_DIR / f"{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"Результаты сохранены в {output}")
+
+    if args.compare:
+        print(f"Сравнение с {args.compare}:")
+        compare(results, json.loads(args.compare.read_text(encoding="utf-8")))
@@ -1,230 +1,649 @@
 import logging
-from flask import Flask
-from threading import Thread
 from aiogram import Bot, Dispatcher, F
 from aiogram.filters import Command
+from aiogram.enums import ContentType
 from aiogram.types import (
     Message,
-    KeyboardButton,
-    ReplyKeyboardMarkup,
-    InlineKeyboardButton,
     CallbackQuery,
-    PhotoSize,
-    Voice,
-    VideoNote,
-    Video
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo
 )
-from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
 from aiogram.client.default import DefaultBotProperties
-from aiogram.webhook.aiohttp_server import SimpleRequestHandler
-from aiogram.utils.executor import start_webhook
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from dotenv import load_dotenv
 import os
 import asyncio
-import re
 import signal
-import uuid
-from typing import Dict, List, Set, Optional
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler("bot.log", encoding='utf-8')
-    ]
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Set, Optional
+
+from admin_mirror import AdminMirror
+from albums import AlbumCoalescer
+from broadcast import BroadcastEngine, BroadcastJob
+from catalog import DEFAULT_LOCALE, ResponseCatalog
+from delivery import CircuitBreaker, DeliveryGuard, RecipientUnavailable, is_dead_chat_error
+from duo_registry import DuoLinkRegistry
+from flood import KINDS, FloodControl
+from http_session import create_api_session, parse_method_timeouts
+from log_pipeline import LazyUserInfo, LogSampler, setup_logging
+from matchmaking import ANY_PARTNER, TIERS, SearchRequest, parse_search_request
+from metrics import ApiMetricsMiddleware, EventLoopLagMonitor, HandlerMetricsMiddleware, MetricsRegistry
+from moderation import RULE_DOMAIN, RULE_MENTION, RULE_TLD, RULE_URL, RULE_WORD, Moderator
+from polling import MAX_BATCH, UpdateBatchLimit, poll_until_stopped
+from reaper import ActivityReaper
+from sequencing import UserSequencer
+from send_scheduler import LANE_BULK, LANE_RELAY, LANES, SendQueueFull, SendScheduler, send_lane
+from session_backend import create_session_backend
+from storage import NS_BROADCAST, NS_DEAD, NS_DUO, NS_USERS, NS_VIP, create_state_store
+from user_cache import UserCache
+from vip import VipRegistry
+
+# Переменные окружения из .env нужны до чтения настроек
+load_dotenv()
+
+# Настройка логирования: форматирование и запись на диск в отдельном потоке
+setup_logging(
+    level=os.getenv("LOG_LEVEL", "INFO"),
+    log_file=os.getenv("LOG_FILE", "bot.log") or None,
+    max_bytes=int(os.getenv("LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    backup_count=int(os.getenv("LOG_BACKUP_COUNT", 5)),
+    use_queue=os.getenv("LOG_ASYNC", "true").lower() == "true"
 )
 logger = logging.getLogger(__name__)
 
+# Доля пересылаемых сообщений, которые попадают в лог
+relay_log_sampled = LogSampler(float(os.getenv("RELAY_LOG_SAMPLE_RATE", 1.0)))
+
 # Конфигурация
 ADMIN_ID = 7618960051  # ID администратора
 VIP_PRICE = "299 руб./мес"  # Стоимость VIP статуса
+VIP_LIST_LIMIT = 50  # Подписок в ответе /vip_list
+VIP_MAX_DAYS = 3650  # Наибольший срок в /vip_grant и /vip_extend
 BOT_USERNAME = "AnonimChatByXBot"  # Юзернейм бота без @
 WEBHOOK_PATH = '/webhook'
 WEBHOOK_URL = f"https://{os.getenv('RENDER_EXTERNAL_HOSTNAME', '')}{WEBHOOK_PATH}"
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Проверка заголовка X-Telegram-Bot-Api-Secret-Token
 
-# Инициализация Flask
-flask_app = Flask(__name__)
+# Хранилища данных
+user_data_cache = UserCache(
+    max_size=int(os.getenv("USER_CACHE_SIZE", 100000)),
+    is_pinned=lambda user_id: chat_sessions.is_engaged(user_id) or user_id in vip_users
+)  # {user_id: UserRecord}, вытеснение LRU только из памяти
+
+# Хранилище состояния с отложенной записью: VIP, чаты, очередь и ссылки переживают перезапуск
+state_store = create_state_store(flush_interval=float(os.getenv("STATE_FLUSH_INTERVAL", 0.5)))
+
+# Чаты и очередь поиска с приоритетом VIP: в памяти процесса (local://) или общие
+# для нескольких воркеров (sqlite:///sessions.db, redis://host:6379/0)
+chat_sessions = create_session_backend(
+    state_store,
+    vip_burst=int(os.getenv("VIP_QUEUE_BURST", 3)),
+    max_regular_wait=float(os.getenv("MAX_REGULAR_WAIT", 30)),
+    widen_after=float(os.getenv("SEARCH_WIDEN_AFTER", 20)),
+    recent_size=int(os.getenv("RECENT_PARTNERS", 5)),
+    on_match=lambda user_id, partner_id: announce_match(user_id, partner_id),
+    cache_ttl=float(os.getenv("SESSION_CACHE_TTL", 30))
+)
 
-@flask_app.route('/')
-def health_check():
-    return "Bot is running", 200
+# VIP подписки со сроком действия: выдаёт и продлевает администратор.
+# С общим бэкендом чатов подписки видны всем воркерам
+vip_users = VipRegistry(
+    state_store,
+    NS_VIP,
+    default_days=float(os.getenv("VIP_DEFAULT_DAYS", 30)),
+    sweep_interval=float(os.getenv("VIP_SWEEP_INTERVAL", 60)),
+    on_expire=lambda user_id: notify_vip_expired(user_id),
+    backend=chat_sessions
+)
 
-# Хранилища данных
-vip_users: Set[int] = set()
-active_users: Dict[int, Dict[str, Optional[int | str]]] = {}  # {user_id: {"partner_id": int, "username": str}}
-waiting_users: List[int] = []  # Очередь ожидания
-user_data_cache: Dict[int, Dict[str, Optional[str]]] = {}  # {user_id: {"username": str, "first_name": str}}
-duo_links: Dict[str, int] = {}  # {link_id: creator_id}
+# Duo ссылки со сроком жизни и лимитом на создателя
+duo_links = DuoLinkRegistry(
+    state_store,
+    NS_DUO,
+    ttl=float(os.getenv("DUO_LINK_TTL", 24 * 3600)),
+    max_per_creator=int(os.getenv("DUO_LINKS_PER_USER", 3))
+)
 
-# Регулярное выражение для обнаружения ссылок
-URL_PATTERN = re.compile(r'https?://\S+')
+# Модерация текста и подписей по правилам из файла, перечитываемого на лету
+moderator = Moderator(
+    os.getenv("MODERATION_RULES", "moderation_rules.txt"),
+    reload_interval=float(os.getenv("MODERATION_RELOAD_INTERVAL", 5))
+)
 
 # Загрузка токена
-load_dotenv()
 API_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 
 if not API_TOKEN:
     logger.error("Токен бота не найден! Проверьте файл .env")
     raise ValueError("Токен бота не найден! Проверьте файл .env")
 
-bot = Bot(token=API_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
-dp = Dispatcher()
-
-
-# Клавиатуры
-def get_menu_keyboard() -> ReplyKeyboardMarkup:
-    """Клавиатура с кнопкой меню"""
-    builder = ReplyKeyboardBuilder()
-    builder.add(KeyboardButton(text="📱 Меню"))
-    return builder.as_markup(resize_keyboard=True)
-
+# Тексты и клавиатуры строятся один раз, JSON клавиатур готовит сессия
+responses = ResponseCatalog()
+ui = responses.locale(os.getenv("BOT_LOCALE", DEFAULT_LOCALE))
+
+# Одна сессия Bot API на всё время работы: пул соединений с keep-alive и кэшем DNS.
+# TELEGRAM_API_URL — свой сервер Bot API (локальный telegram-bot-api или тестовая замена)
+session = create_api_session(
+    responses,
+    api_url=os.getenv("TELEGRAM_API_URL"),
+    fast_json=os.getenv("FAST_JSON", "true").lower() == "true",
+    limit=int(os.getenv("API_POOL_LIMIT", 100)),
+    keepalive_timeout=float(os.getenv("API_KEEPALIVE_TIMEOUT", 30)),
+    dns_ttl=int(os.getenv("API_DNS_TTL", 300)),
+    timeout=float(os.getenv("API_TIMEOUT", 60)),
+    method_timeouts=parse_method_timeouts(os.getenv("API_METHOD_TIMEOUTS", ""))
+)
 
-def get_main_keyboard() -> ReplyKeyboardMarkup:
-    """Основная клавиатура"""
-    builder = ReplyKeyboardBuilder()
-    builder.add(KeyboardButton(text="/find"))
-    builder.add(KeyboardButton(text="/stop"))
-    builder.add(KeyboardButton(text="/next"))
-    builder.add(KeyboardButton(text="/vip"))
-    builder.add(KeyboardButton(text="/duo"))
-    builder.adjust(2, 2)
-    return builder.as_markup(resize_keyboard=True)
+bot = Bot(token=API_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+dp = Dispatcher()
 
+# Выставляется сигналом завершения (в режиме webhook — сразу): только тогда
+# выключение завершает чаты, а перезапуск polling после ошибки их сохраняет
+shutdown_requested = asyncio.Event()
+
+# Состояние восстановлено и воркеры запущены. Перезапуск polling после ошибки
+# снова вызывает обработчики запуска и выключения, но не должен повторять их работу
+background_started = asyncio.Event()
+
+# Некритичная настройка после запуска (регистрация webhook): не задерживает первые обновления
+deferred_setup: Set[asyncio.Task] = set()
+
+# Запросы к заблокировавшим бота не отправляются, сетевые сбои размыкают предохранитель
+delivery_guard = DeliveryGuard(
+    state_store,
+    NS_DEAD,
+    breaker=CircuitBreaker(
+        threshold=int(os.getenv("BREAKER_THRESHOLD", 5)),
+        backoff=float(os.getenv("BREAKER_BACKOFF", 1)),
+        max_backoff=float(os.getenv("BREAKER_MAX_BACKOFF", 60))
+    ),
+    on_dead=lambda user_id: purge_user(user_id)
+)
+bot.session.middleware(delivery_guard)
+
+# Все исходящие запросы проходят через планировщик с учётом лимитов Telegram
+send_scheduler = SendScheduler(
+    global_rate=float(os.getenv("SEND_GLOBAL_RATE", 30)),
+    chat_rate=float(os.getenv("SEND_CHAT_RATE", 1)),
+    chat_burst=float(os.getenv("SEND_CHAT_BURST", 3)),
+    max_queue=int(os.getenv("SEND_QUEUE_LIMIT", 5000))
+)
+bot.session.middleware(send_scheduler)
+
+# Зеркалирование медиа администратору в фоне, вне пути пересылки
+admin_mirror = AdminMirror(
+    bot,
+    ADMIN_ID,
+    max_queue=int(os.getenv("ADMIN_MIRROR_QUEUE", 1000)),
+    batch_window=float(os.getenv("ADMIN_MIRROR_WINDOW", 1.0))
+)
 
-def get_vip_keyboard() -> ReplyKeyboardMarkup:
-    """VIP клавиатура"""
-    return get_main_keyboard()  # Используем ту же клавиатуру
+# Сборка альбомов (media_group_id) перед пересылкой
+album_coalescer = AlbumCoalescer(
+    lambda album: handle_album(album),
+    window=float(os.getenv("ALBUM_WINDOW", 0.5))
+)
 
+# Рассылки администратора и уведомления при остановке
+broadcaster = BroadcastEngine(
+    lambda user_id, text: send_bulk(user_id, text),
+    state_store,
+    NS_BROADCAST,
+    concurrency=int(os.getenv("BROADCAST_CONCURRENCY", 20)),
+    progress_interval=float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 10)),
+    on_progress=lambda job: report_broadcast(job)
+)
 
-def get_confirm_keyboard(action: str) -> InlineKeyboardBuilder:
-    """Клавиатура подтверждения"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(text="✅ Да", callback_data=f"confirm_{action}_yes"),
-        InlineKeyboardButton(text="❌ Нет", callback_data=f"confirm_{action}_no")
-    )
-    return builder.as_markup()
+# Метрики для /metrics
+metrics = MetricsRegistry()
+handler_latency = metrics.histogram(
+    "bot_handler_duration_seconds", "Время работы обработчика", ("handler",))
+api_latency = metrics.histogram(
+    "bot_api_request_duration_seconds", "Время запроса к Bot API", ("method",))
+api_errors = metrics.counter(
+    "bot_api_errors", "Ошибки запросов к Bot API", ("method", "error"))
+loop_lag_monitor = EventLoopLagMonitor(
+    metrics.histogram("bot_event_loop_lag_seconds", "Опоздание цикла событий"))
+metrics.gauge(
+    "bot_queue_depth", "Пользователей в очереди поиска",
+    lambda: {(tier,): chat_sessions.queue_depth(tier) for tier in TIERS}, ("tier",))
+metrics.gauge("bot_active_pairs", "Активных чатов", chat_sessions.pair_count)
+if chat_sessions.shared:
+    metrics.gauge(
+        "bot_partner_cache_hit_rate", "Доля поисков собеседника из локального кэша",
+        lambda: chat_sessions.cache.hit_rate)
+else:
+    metrics.gauge("bot_search_buckets", "Корзин поиска по интересам и языкам", chat_sessions.queue.bucket_count)
+metrics.gauge("bot_duo_links", "Выданных Duo ссылок", lambda: len(duo_links))
+metrics.gauge("bot_vip_users", "Действующих VIP подписок", lambda: len(vip_users))
+metrics.callback_counter("bot_vip_expired", "Истекло VIP подписок", lambda: vip_users.expired)
+metrics.callback_counter("bot_duo_links_expired", "Истёкших Duo ссылок", lambda: duo_links.expired)
+metrics.gauge("bot_user_cache_size", "Пользователей в кэше", lambda: len(user_data_cache))
+metrics.gauge("bot_user_cache_hit_rate", "Доля попаданий в кэш пользователей", lambda: user_data_cache.hit_rate)
+metrics.callback_counter("bot_user_cache_evictions", "Вытеснено из кэша пользователей", lambda: user_data_cache.evictions)
+metrics.gauge("bot_user_cache_bytes", "Оценка памяти кэша пользователей", user_data_cache.footprint)
+metrics.gauge(
+    "bot_send_queue_depth", "Запросов в очереди планировщика",
+    lambda: {(str(lane),): send_scheduler.queue_depth(lane) for lane in LANES}, ("lane",))
+metrics.callback_counter("bot_send_rejected", "Запросов отброшено планировщиком", lambda: send_scheduler.rejected)
+metrics.callback_counter("bot_send_retried", "Повторов после RetryAfter", lambda: send_scheduler.retried)
+metrics.gauge("bot_albums_pending", "Альбомов в сборке", lambda: len(album_coalescer))
+metrics.callback_counter("bot_albums_coalesced", "Запросов сэкономлено сборкой альбомов", lambda: album_coalescer.coalesced)
+moderation_rejected = metrics.counter(
+    "bot_moderation_rejected", "Сообщений отклонено модерацией", ("rule",))
+metrics.gauge("bot_moderation_rules", "Правил модерации", lambda: moderator.rule_count)
+metrics.gauge("bot_broadcasts", "Незавершённых рассылок", lambda: len(broadcaster))
+metrics.gauge("bot_dead_recipients", "Пользователей, заблокировавших бота", lambda: len(delivery_guard))
+metrics.callback_counter("bot_dead_recipient_skips", "Запросов к недоступным, не отправленных в API", lambda: delivery_guard.skipped)
+metrics.gauge("bot_breaker_open", "Предохранитель Bot API разомкнут", lambda: int(delivery_guard.breaker.is_open))
+metrics.callback_counter("bot_breaker_rejected", "Запросов отклонено разомкнутым предохранителем", lambda: delivery_guard.breaker.rejected)
+metrics.gauge("bot_admin_mirror_queue", "Медиа в очереди администратору", lambda: len(admin_mirror))
+metrics.callback_counter("bot_admin_mirror_dropped", "Медиа отброшено при переполнении", lambda: admin_mirror.dropped)
+metrics.callback_counter("bot_admin_mirror_failed", "Медиа, которые не удалось переслать", lambda: admin_mirror.failed)
+metrics.gauge(
+    "bot_http_pool", "Соединения с Bot API: в работе и запросы в ожидании",
+    lambda: {(state,): session.pool_stats()[state] for state in ("in_use", "waiting")}, ("state",))
+metrics.callback_counter(
+    "bot_http_connections", "Соединений с Bot API открыто и переиспользовано",
+    lambda: {("created",): session.created, ("reused",): session.reused}, ("kind",))
+
+# Флуд отбрасывается первым, до блокировок, логов и запросов к API
+flood_control = FloodControl(
+    text_rate=float(os.getenv("FLOOD_TEXT_RATE", 1)),
+    text_burst=float(os.getenv("FLOOD_TEXT_BURST", 5)),
+    media_rate=float(os.getenv("FLOOD_MEDIA_RATE", 0.2)),
+    media_burst=float(os.getenv("FLOOD_MEDIA_BURST", 5)),
+    mute_after=int(os.getenv("FLOOD_MUTE_AFTER", 10)),
+    mute_base=float(os.getenv("FLOOD_MUTE_BASE", 30)),
+    mute_max=float(os.getenv("FLOOD_MUTE_MAX", 3600)),
+    exempt={ADMIN_ID},
+    on_mute=lambda user_id, seconds: notify_flood_mute(user_id, seconds)
+)
+dp.update.outer_middleware(flood_control)
+metrics.callback_counter(
+    "bot_flood_dropped", "Входящих обновлений отброшено за флуд",
+    lambda: {**{(kind,): flood_control.dropped[kind] for kind in KINDS}, ("muted",): flood_control.dropped_muted},
+    ("kind",))
+metrics.callback_counter("bot_flood_mutes", "Выдано мутов за флуд", lambda: flood_control.mutes)
+metrics.gauge("bot_flood_users", "Пользователей под контролем флуда", lambda: len(flood_control))
+
+# Обновления одного пользователя обрабатываются по порядку, разных — параллельно
+user_sequencer = UserSequencer()
+dp.update.outer_middleware(user_sequencer)
+metrics.gauge("bot_sequencer_users", "Пользователей с обновлениями в обработке", lambda: len(user_sequencer))
+metrics.callback_counter("bot_sequencer_waits", "Обновлений, ждавших предыдущее того же пользователя", lambda: user_sequencer.waited)
+
+# Снятие с поиска и завершение чатов пользователей, переставших отвечать
+activity_reaper = ActivityReaper(
+    chat_sessions,
+    queue_timeout=float(os.getenv("QUEUE_TIMEOUT", 600)),
+    idle_timeout=float(os.getenv("IDLE_CHAT_TIMEOUT", 1800)),
+    interval=float(os.getenv("REAPER_INTERVAL", 10)),
+    on_queue_timeout=lambda user_id: notify_queue_timeout(user_id),
+    on_idle_chat=lambda user_id, partner_id: notify_idle_chat(user_id, partner_id)
+)
+dp.update.outer_middleware(activity_reaper)
+metrics.gauge("bot_reaper_tracked", "Пользователей под наблюдением очистки", lambda: len(activity_reaper))
+metrics.callback_counter(
+    "bot_reaper_reclaimed", "Освобождено очисткой неактивных",
+    lambda: {("waiting",): activity_reaper.reclaimed_waiting, ("session",): activity_reaper.reclaimed_sessions},
+    ("kind",))
+
+
+
+@dp.update.outer_middleware()
+async def revive_recipient(
+    handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+    event: Any,
+    data: Dict[str, Any],
+) -> Any:
+    """Пользователь, заблокировавший бота, снова доступен, как только пишет ему"""
+    user = data.get("event_from_user")
+    if user is not None and user.id in delivery_guard:
+        delivery_guard.revive(user.id)
+    return await handler(event, data)
+
+
+@dp.message.middleware()
+async def relay_albums_first(
+    handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+    event: Message,
+    data: Dict[str, Any],
+) -> Any:
+    """Собираемый альбом пользователя пересылается раньше его следующего сообщения.
+
+    Альбом отправляется из задачи AlbumCoalescer, вне блокировки UserSequencer.
+    Этот middleware работает внутри неё, поэтому порядок для собеседника
+    сохраняется: сначала альбом, затем то, что пользователь отправил после.
+    """
+    if not event.media_group_id:
+        await album_coalescer.drain(event.chat.id)
+    return await handler(event, data)
+
+
+dp.message.middleware(HandlerMetricsMiddleware(handler_latency))
+dp.callback_query.middleware(HandlerMetricsMiddleware(handler_latency))
+bot.session.middleware(ApiMetricsMiddleware(api_latency, api_errors))
 
 
 async def save_user_info(user) -> None:
-    """Сохранение информации о пользователе"""
-    user_data_cache[user.id] = {
-        "username": user.username,
-        "first_name": user.first_name,
-        "last_name": user.last_name
-    }
+    """Сохранение информации о пользователе.
+
+    Кэш заполняется из хранилища при запуске, поэтому промах означает нового
+    (или давно вытесненного) пользователя: запись просто добавляется в
+    очередь записи, без чтения хранилища на каждом сообщении.
+    """
+    if user_data_cache.update(user.id, user.username, user.first_name, user.last_name):
+        state_store.put(NS_USERS, user.id, user_data_cache.peek(user.id).as_dict())
+
+
+async def match_user(user_id: int, request: SearchRequest = ANY_PARTNER) -> Optional[int]:
+    """Подбор собеседника из очереди или постановка в очередь, если подходящих нет"""
+    record = user_data_cache.get(user_id)
+    if record is not None:
+        # Запоминаем параметры, чтобы /next искал так же
+        record.search = request
+    return await chat_sessions.match(user_id, vip=user_id in vip_users, request=request)
+
+
+def last_search(user_id: int) -> SearchRequest:
+    """Параметры последнего поиска пользователя"""
+    record = user_data_cache.get(user_id)
+    return record.search if record is not None and record.search is not None else ANY_PARTNER
+
+
+async def is_chatting(user_id: int) -> bool:
+    """Находится ли пользователь в чате"""
+    return await chat_sessions.partner_of(user_id) is not None
+
+
+async def restore_state() -> None:
+    """Восстановление состояния из хранилища одним чтением"""
+    state = await state_store.load()
+    for uid, expires_at in state.get(NS_VIP, {}).items():
+        vip_users.restore(uid, expires_at)
+    chat_sessions.restore(state)
+    for link_id, value in state.get(NS_DUO, {}).items():
+        duo_links.restore(link_id, value)
+    for uid, detected_at in state.get(NS_DEAD, {}).items():
+        delivery_guard.restore(uid, detected_at)
+    broadcaster.restore(state.get(NS_BROADCAST, {}))
+    # Пользователи загружаются последними, чтобы участники чатов и очереди не были вытеснены
+    for uid, info in state.get(NS_USERS, {}).items():
+        user_data_cache.update(int(uid), info.get("username"), info.get("first_name"), info.get("last_name"))
+    logger.info(
+        "Состояние восстановлено: чатов %s, в очереди %s, VIP %s, ссылок %s",
+        chat_sessions.pair_count(), chat_sessions.queue_depth(), len(vip_users), len(duo_links)
+    )
 
 
 def get_user_log_info(user_id: int) -> str:
-    """Форматирование информации о пользователе для логов"""
-    user = user_data_cache.get(user_id, {})
-    username = f"@{user.get('username')}" if user.get("username") else "без username"
-    first_name = user.get("first_name", "неизвестно")
-    last_name = f" {user.get('last_name')}" if user.get("last_name") else ""
+    """Форматирование информации о пользователе для логов: чтение не влияет на LRU и hit_rate"""
+    user = user_data_cache.peek(user_id)
+    if user is None:
+        return f"{user_id} (неизвестно без username)"
+    username = f"@{user.username}" if user.username else "без username"
+    first_name = user.first_name or "неизвестно"
+    last_name = f" {user.last_name}" if user.last_name else ""
     return f"{user_id} ({first_name}{last_name} {username})"
 
 
-async def forward_to_admin(user_id: int, file_id: str, content_type: str) -> None:
-    """Пересылка медиафайла администратору"""
-    try:
-        user_info = user_data_cache.get(user_id, {})
-        username = user_info.get("username", "неизвестно")
-        caption = f"Медиа от {get_user_log_info(user_id)}"
-
-        send_methods = {
-            "photo": bot.send_photo,
-            "voice": bot.send_voice,
-            "video": bot.send_video,
-            "video_note": bot.send_video_note
-        }
-
-        if content_type in send_methods:
-            await send_methods[content_type](
-                chat_id=ADMIN_ID,
-                **{content_type: file_id},
-                caption=caption if content_type != "video_note" else None
-            )
-            if content_type == "video_note":
-                await bot.send_message(ADMIN_ID, caption)
+def user_log(user_id: int) -> LazyUserInfo:
+    """Информация о пользователе для логов, вычисляемая только для записей, прошедших по уровню"""
+    return LazyUserInfo(user_id, get_user_log_info)
 
-        logger.info(f"Медиа {content_type} от {get_user_log_info(user_id)} переслано администратору")
-    except Exception as e:
-        logger.error(f"Ошибка пересылки медиа администратору: {e}", exc_info=True)
+
+def forward_to_admin(user_id: int, file_id: str, content_type: str) -> None:
+    """Постановка медиафайла в очередь пересылки администратору"""
+    caption = f"Медиа от {get_user_log_info(user_id)}"
+    if admin_mirror.submit(user_id, file_id, content_type, caption):
+        logger.info("Медиа %s от %s поставлено в очередь администратору", content_type, user_log(user_id))
 
 
 async def stop_chat(user_id: int, initiator: bool = True) -> Optional[int]:
     """Завершение чата"""
-    if user_id not in active_users:
+    # Удаляем информацию о чате
+    partner_id = await chat_sessions.unpair(user_id)
+    if partner_id is None:
         return None
 
-    partner_info = active_users[user_id]
-    partner_id = partner_info["partner_id"]
+    logger.info("Чат между %s и %s завершен", user_log(user_id), user_log(partner_id))
 
-    # Удаляем информацию о чате
-    del active_users[user_id]
-    if partner_id in active_users:
-        del active_users[partner_id]
+    await send_notices({
+        user_id: ui["chat_left"] if initiator else ui["partner_left"],
+        partner_id: ui["partner_left_find"]
+    })
+    return partner_id
 
-    logger.info(f"Чат между {get_user_log_info(user_id)} и {get_user_log_info(partner_id)} завершен")
 
-    messages = {
-        user_id: "❌ Чат завершён. Ищем нового собеседника..." if initiator else "❌ Собеседник покинул чат",
-        partner_id: "❌ Собеседник покинул чат. Используйте /find для нового поиска."
-    }
+async def purge_user(user_id: int) -> None:
+    """Удаление заблокировавшего бота пользователя из чата, очереди и Duo ссылок"""
+    partner_id = await chat_sessions.unpair(user_id)
+    await chat_sessions.cancel_search(user_id)
+    for link_id in duo_links.revoke_creator(user_id):
+        await chat_sessions.drop_link(link_id)
+    logger.info("Пользователь %s заблокировал бота и удалён из чатов и поиска", user_log(user_id))
+    if partner_id is not None:
+        logger.info("Чат между %s и %s завершен", user_log(user_id), user_log(partner_id))
+        await send_notices({partner_id: ui["partner_left_find"]})
 
-    for uid, text in messages.items():
-        await bot.send_message(uid, text, reply_markup=get_menu_keyboard())
 
-    return partner_id
+async def send_notices(messages: Dict[int, str]) -> None:
+    """Служебные сообщения нескольким пользователям. Ошибка одной отправки не прерывает остальные"""
+    results = await asyncio.gather(
+        *(bot.send_message(uid, text, reply_markup=ui.keyboards.menu) for uid, text in messages.items()),
+        return_exceptions=True
+    )
+    for uid, result in zip(messages, results):
+        if isinstance(result, Exception) and not isinstance(result, RecipientUnavailable):
+            logger.warning("Не удалось отправить уведомление %s: %s", user_log(uid), result)
 
 
-async def find_partner_logic(user_id: int) -> bool:
-    """Логика поиска собеседника"""
-    for i, partner_id in enumerate(waiting_users):
-        if partner_id != user_id:
-            waiting_users.pop(i)
-            active_users.update({
-                user_id: {"partner_id": partner_id, "username": user_data_cache.get(user_id, {}).get("username")},
-                partner_id: {"partner_id": user_id, "username": user_data_cache.get(partner_id, {}).get("username")}
-            })
+async def notify_pair(user_id: int, partner_id: int, text: str) -> None:
+    """Уведомление обоих собеседников о создании чата"""
+    await send_notices({user_id: text, partner_id: text})
 
-            logger.info(f"Создан чат между {get_user_log_info(user_id)} и {get_user_log_info(partner_id)}")
 
-            message = "✅ Собеседник найден! Общайтесь анонимно.\nДля открытия меню нажмите '📱 Меню'"
-            await asyncio.gather(
-                bot.send_message(user_id, message, reply_markup=get_menu_keyboard()),
-                bot.send_message(partner_id, message, reply_markup=get_menu_keyboard())
-            )
-            return True
-    return False
+async def announce_match(user_id: int, partner_id: int) -> None:
+    """Сообщение о найденном собеседнике"""
+    logger.info("Создан чат между %s и %s", user_log(user_id), user_log(partner_id))
+    await notify_pair(user_id, partner_id, ui["match_found"])
+
+
+async def find_partner_logic(user_id: int, request: SearchRequest = ANY_PARTNER) -> bool:
+    """Логика поиска собеседника: пара создаётся сразу или пользователь встаёт в очередь"""
+    partner_id = await match_user(user_id, request)
+    if partner_id is None:
+        return False
+    await announce_match(user_id, partner_id)
+    return True
+
+
+async def notify_queue_timeout(user_id: int) -> None:
+    """Уведомление о снятии с поиска по таймауту"""
+    logger.info("Пользователь %s снят с поиска по таймауту", user_log(user_id))
+    await bot.send_message(
+        user_id,
+        ui.format("queue_timeout", minutes=int(activity_reaper.queue_timeout // 60)),
+        reply_markup=ui.keyboards.menu
+    )
+
+
+async def notify_vip_expired(user_id: int) -> None:
+    """Уведомление об окончании VIP подписки"""
+    logger.info("VIP подписка %s истекла", user_log(user_id))
+    await send_notices({user_id: ui["vip_expired"]})
+
+
+async def notify_flood_mute(user_id: int, seconds: float) -> None:
+    """Уведомление о муте за флуд: одно на каждый мут"""
+    await send_notices({user_id: ui.format("flood_mute", seconds=int(seconds))})
+
+
+async def notify_idle_chat(user_id: int, partner_id: int) -> None:
+    """Уведомление о завершении неактивного чата"""
+    logger.info("Чат между %s и %s завершён из-за неактивности", user_log(user_id), user_log(partner_id))
+    await send_notices({user_id: ui["idle_chat"], partner_id: ui["idle_chat"]})
 
 
-async def forward_message(sender_id: int, receiver_id: int, content: str, content_type: str) -> bool:
+async def send_bulk(user_id: int, text: str) -> None:
+    """Отправка сообщения рассылки в полосе с низшим приоритетом"""
+    with send_lane(LANE_BULK):
+        await bot.send_message(user_id, text, reply_markup=ui.keyboards.menu)
+
+
+async def report_broadcast(job: BroadcastJob) -> None:
+    """Обновление сообщения администратора о ходе рассылки"""
+    chat_id = job.meta.get("chat_id")
+    if chat_id is None:
+        return
+    text = f"{'✅ Рассылка завершена' if job.done else '📣 Рассылка идёт'}: {job.summary()}"
+    if text == job.meta.get("reported"):
+        return
+    job.meta["reported"] = text
+    await bot.edit_message_text(text, chat_id=chat_id, message_id=job.meta["message_id"])
+
+
+def moderate(user_id: int, text: Optional[str]) -> Optional[str]:
+    """Проверка текста или подписи. Возвращает ответ пользователю, если сообщение отклонено"""
+    violation = moderator.check(text)
+    if violation is None:
+        return None
+    moderation_rejected.labels(violation.kind).inc()
+    logger.warning(
+        "Сообщение от %s отклонено модерацией (%s): %s", user_log(user_id), violation.kind, violation.fragment
+    )
+    return MODERATION_NOTICES[violation.kind]
+
+
+def format_until(timestamp: float) -> str:
+    """Дата окончания подписки для сообщений"""
+    return time.strftime("%d.%m.%Y %H:%M", time.localtime(timestamp))
+
+
+def search_notice(request: SearchRequest) -> str:
+    """Ответ пользователю, поставленному в очередь"""
+    tags = ([request.lang] if request.lang else []) + sorted(request.interests)
+    if request.vip_only:
+        tags.append(ui["vip_only_tag"])
+    if not tags:
+        return ui["searching"]
+    return ui.format("searching_tags", tags=", ".join(tags))
+
+
+# Ответы на сообщения, отклонённые модерацией
+MODERATION_NOTICES = {
+    RULE_URL: ui["moderation_link"],
+    RULE_DOMAIN: ui["moderation_link"],
+    RULE_TLD: ui["moderation_link"],
+    RULE_MENTION: ui["moderation_mention"],
+    RULE_WORD: ui["moderation_word"],
+}
+
+
+class RelayRule(NamedTuple):
+    """Правило пересылки одного типа содержимого"""
+    caption: Optional[str]  # Подпись для собеседника (None — оставить подпись отправителя)
+    vip_notice: Optional[str]  # Ответ не-VIP пользователю, если тип доступен только VIP
+    mirror: bool  # Пересылать ли копию администратору
+
+
+# Префикс пересылаемого текста
+RELAY_PREFIX = ui["relay_prefix"]
+
+# Таблица пересылки: строится один раз при импорте
+RELAY_RULES: Dict[str, RelayRule] = {
+    ContentType.TEXT: RelayRule(None, None, False),
+    ContentType.PHOTO: RelayRule(ui["caption_photo"], None, True),
+    ContentType.VOICE: RelayRule(ui["caption_voice"], None, True),
+    ContentType.VIDEO: RelayRule(ui["caption_video"], ui["vip_only_video"], True),
+    ContentType.VIDEO_NOTE: RelayRule(None, ui["vip_only_video_note"], True),
+    ContentType.STICKER: RelayRule(None, None, False),
+    ContentType.ANIMATION: RelayRule(None, None, False),
+    ContentType.DOCUMENT: RelayRule(None, None, False),
+    ContentType.AUDIO: RelayRule(None, None, False),
+}
+MEDIA_CONTENT_TYPES = frozenset(RELAY_RULES) - {ContentType.TEXT}
+
+# Типы, которые Telegram объединяет в альбомы
+ALBUM_INPUT_MEDIA = {
+    ContentType.PHOTO: InputMediaPhoto,
+    ContentType.VIDEO: InputMediaVideo,
+    ContentType.DOCUMENT: InputMediaDocument,
+    ContentType.AUDIO: InputMediaAudio,
+}
+
+
+def get_file_id(message: Message) -> str:
+    """file_id медиа из сообщения (для фото — самого большого размера)"""
+    content = getattr(message, message.content_type)
+    return content[-1].file_id if isinstance(content, list) else content.file_id
+
+
+async def forward_message(sender_id: int, receiver_id: int, message: Message) -> bool:
     """Универсальная функция пересылки сообщений"""
+    content_type = message.content_type
     try:
-        send_methods = {
-            "text": (bot.send_message, {"text": f"👤: {content}"}),
-            "photo": (bot.send_photo, {"photo": content, "caption": "📷 Фото от собеседника"}),
-            "voice": (bot.send_voice, {"voice": content, "caption": "🎤 Голосовое от собеседника"}),
-            "video_note": (bot.send_video_note, {"video_note": content}),
-            "video": (bot.send_video, {"video": content, "caption": "🎥 Видео от собеседника"})
-        }
-
-        if content_type in send_methods:
-            method, params = send_methods[content_type]
-            await method(receiver_id, reply_markup=get_menu_keyboard(), **params)
-
-        logger.info(
-            f"{content_type.capitalize()} от {get_user_log_info(sender_id)} отправлено {get_user_log_info(receiver_id)}")
+        with send_lane(LANE_RELAY):
+            if content_type == ContentType.TEXT:
+                # html_text экранирует текст и сохраняет форматирование отправителя
+                await bot.send_message(receiver_id, RELAY_PREFIX + message.html_text, reply_markup=ui.keyboards.menu)
+            else:
+                # copy_message пересылает любой тип одним запросом, без повторной загрузки файла
+                await bot.copy_message(
+                    receiver_id,
+                    sender_id,
+                    message.message_id,
+                    caption=RELAY_RULES[content_type].caption,
+                    reply_markup=ui.keyboards.menu
+                )
+
+        if relay_log_sampled():
+            logger.info("%s от %s отправлено %s", content_type.capitalize(), user_log(sender_id), user_log(receiver_id))
         return True
     except Exception as e:
-        logger.error(f"Ошибка отправки {content_type}: {e}", exc_info=True)
-        await stop_chat(sender_id, initiator=False)
+        await handle_relay_error(sender_id, content_type, e)
         return False
 
 
+async def forward_album(sender_id: int, receiver_id: int, album: List[Message]) -> bool:
+    """Пересылка альбома собеседнику одним send_media_group"""
+    media = []
+    for message in album:
+        # Подпись отправителя экранируется, как текст в forward_message: действует HTML по умолчанию
+        caption = RELAY_RULES[message.content_type].caption or message.html_text or None
+        media.append(ALBUM_INPUT_MEDIA[message.content_type](media=get_file_id(message), caption=caption))
+    try:
+        with send_lane(LANE_RELAY):
+            await bot.send_media_group(receiver_id, media)
+        if relay_log_sampled():
+            logger.info("Альбом из %s от %s отправлен %s", len(media), user_log(sender_id), user_log(receiver_id))
+        return True
+    except Exception as e:
+        await handle_relay_error(sender_id, "album", e)
+        return False
+
+
+async def handle_relay_error(sender_id: int, content_type: str, error: Exception) -> None:
+    """Реакция на ошибку пересылки собеседнику.
+
+    Чат завершается только если собеседник заблокировал бота (это делает
+    purge_user). Перегрузка, сбой сети или отклонённое сообщение не означают,
+    что собеседник недоступен.
+    """
+    if is_dead_chat_error(error):
+        logger.info("Сообщение %s от %s не доставлено: собеседник недоступен", content_type, user_log(sender_id))
+    elif isinstance(error, (TelegramRetryAfter, SendQueueFull, TelegramNetworkError, TelegramServerError)):
+        logger.warning("Сообщение %s от %s не доставлено: %s", content_type, user_log(sender_id), error)
+    elif isinstance(error, TelegramBadRequest):
+        logger.warning("Сообщение %s от %s отклонено: %s", content_type, user_log(sender_id), error)
+        await send_notices({sender_id: ui["relay_rejected"]})
+    else:
+        logger.error("Ошибка отправки %s: %s", content_type, error, exc_info=error)
+
+
 # Обработчики команд
 @dp.message(Command("start"))
 async def handle_start(message: Message) -> None:
@@ -238,49 +657,34 @@ async def handle_start(message: Message) -> None:
     if len(args) > 1 and args[1].startswith("duo_"):
         link_id = args[1][4:]
         creator_id = duo_links.get(link_id)
+        if creator_id is None:
+            # Ссылку мог выпустить другой воркер
+            creator_id = await chat_sessions.lookup_link(link_id)
 
         if not creator_id:
-            await message.answer("❌ Ссылка недействительна или устарела")
+            await message.answer(ui["duo_invalid"])
             return
 
         if user_id == creator_id:
-            await message.answer("❌ Нельзя начать диалог с самим собой")
-            return
-
-        if creator_id in active_users or user_id in active_users:
-            await message.answer("❌ Один из пользователей уже в другом диалоге")
+            await message.answer(ui["duo_self"])
             return
 
         # Создаем чат
-        active_users.update({
-            user_id: {"partner_id": creator_id, "username": user.username},
-            creator_id: {"partner_id": user_id, "username": user_data_cache.get(creator_id, {}).get("username")}
-        })
+        if not await chat_sessions.pair(user_id, creator_id):
+            await message.answer(ui["duo_busy"])
+            return
 
-        del duo_links[link_id]
+        duo_links.redeem(link_id)
+        await chat_sessions.drop_link(link_id)
 
         # Уведомляем пользователей
-        success_message = "✅ Диалог создан! Общайтесь анонимно."
-        await asyncio.gather(
-            bot.send_message(user_id, success_message, reply_markup=get_menu_keyboard()),
-            bot.send_message(creator_id, success_message, reply_markup=get_menu_keyboard())
-        )
-        logger.info(f"Создан Duo чат между {user_id} и {creator_id}")
+        await notify_pair(user_id, creator_id, ui["duo_created"])
+        logger.info("Создан Duo чат между %s и %s", user_id, creator_id)
         return
 
     # Стандартное приветствие
-    welcome_message = (
-        "👋 Привет! Это анонимный чат-бот.\n"
-        "Доступные команды:\n"
-        "/find - найти собеседника\n"
-        "/stop - выйти из чата\n"
-        "/next - сменить собеседника\n"
-        "/vip - информация о VIP-статусе\n"
-        "/duo - создать ссылку для диалога\n\n"
-        "Для открытия меню нажмите кнопку '📱 Меню'"
-    )
-    await message.answer(welcome_message, reply_markup=get_menu_keyboard())
-    logger.info(f"Пользователь {get_user_log_info(user_id)} запустил бота")
+    await message.answer(ui["welcome"], reply_markup=ui.keyboards.menu)
+    logger.info("Пользователь %s запустил бота", user_log(user_id))
 
 
 @dp.message(Command("duo"))
@@ -290,21 +694,20 @@ async def create_duo_link(message: Message) -> None:
     await save_user_info(user)
     user_id = user.id
 
-    if user_id in active_users:
-        await message.answer("❌ Вы уже в чате. Сначала завершите текущий диалог с помощью /stop")
+    if await is_chatting(user_id):
+        await message.answer(ui["duo_in_chat"])
         return
 
-    link_id = str(uuid.uuid4())
-    duo_links[link_id] = user_id
+    link_id = duo_links.create(user_id)
+    await chat_sessions.publish_link(link_id, user_id, duo_links.expires_at(link_id))
 
     duo_link = f"https://t.me/{BOT_USERNAME}?start=duo_{link_id}"
 
     await message.answer(
-        f"🔗 Ваша ссылка для диалога:\n\n{duo_link}\n\n"
-        "Отправьте эту ссылку другу, чтобы начать приватный диалог.",
-        reply_markup=get_menu_keyboard()
+        ui.format("duo_link", link=duo_link, hours=int(duo_links.ttl // 3600)),
+        reply_markup=ui.keyboards.menu
     )
-    logger.info(f"Пользователь {get_user_log_info(user_id)} создал Duo ссылку: {link_id}")
+    logger.info("Пользователь %s создал Duo ссылку: %s", user_log(user_id), link_id)
 
 
 @dp.message(Command("vip"))
@@ -316,21 +719,84 @@ async def vip_info(message: Message) -> None:
 
     if user_id in vip_users:
         await message.answer(
-            "🎉 У вас уже есть VIP-статус!\n\nВы можете отправлять видеосообщения и обычные видео",
-            reply_markup=get_vip_keyboard()
+            ui.format("vip_active", until=format_until(vip_users.expires_at(user_id))),
+            reply_markup=ui.keyboards.vip
         )
     else:
         await message.answer(
-            "🔒 VIP-статус открывает дополнительные возможности:\n"
-            "• Отправка видеосообщений (кружков)\n"
-            "• Отправка обычных видео\n"
-            "• Приоритет в поиске собеседника\n\n"
-            f"💰 Стоимость: {VIP_PRICE}\n"
-            f"Для покупки напишите администратору",
-            reply_markup=get_vip_keyboard()
+            ui.format("vip_offer", price=VIP_PRICE),
+            reply_markup=ui.keyboards.vip
         )
 
 
+@dp.message(Command("broadcast"), F.from_user.id == ADMIN_ID)
+async def broadcast_command(message: Message) -> None:
+    """Рассылка администратора всем сохранённым пользователям: /broadcast текст"""
+    parts = message.html_text.split(maxsplit=1)
+    if len(parts) < 2:
+        if broadcaster.jobs:
+            await message.answer("\n".join(f"📣 {job.id}: {job.summary()}" for job in broadcaster.jobs))
+        else:
+            await message.answer("Активных рассылок нет. Использование: /broadcast текст")
+        return
+
+    # Получатели берутся из хранилища: кэш пользователей ограничен и не содержит вытесненных
+    user_ids = (int(uid) for uid in await state_store.keys(NS_USERS))
+    recipients = [uid for uid in user_ids if uid != ADMIN_ID and uid not in delivery_guard]
+    status = await message.answer(f"📣 Рассылка для {len(recipients)} пользователей начата")
+    job = broadcaster.create(parts[1], recipients, meta={"chat_id": message.chat.id, "message_id": status.message_id})
+    broadcaster.start(job)
+    logger.info("Администратор начал рассылку %s для %s пользователей", job.id, len(recipients))
+
+
+@dp.message(Command("vip_grant", "vip_extend", "vip_revoke", "vip_list"), F.from_user.id == ADMIN_ID)
+async def vip_admin_command(message: Message) -> None:
+    """Управление VIP: /vip_grant id [дней], /vip_extend id [дней], /vip_revoke id, /vip_list"""
+    command, *args = message.text.split()
+    command = command[1:].split("@", 1)[0]
+
+    if command == "vip_list":
+        subscriptions = list(vip_users)
+        if not subscriptions:
+            await message.answer("VIP-подписок нет")
+            return
+        lines = [f"{uid}: до {format_until(expires_at)}" for uid, expires_at in subscriptions[:VIP_LIST_LIMIT]]
+        if len(subscriptions) > VIP_LIST_LIMIT:
+            lines.append(f"…и ещё {len(subscriptions) - VIP_LIST_LIMIT}")
+        await message.answer(f"👑 VIP-подписок: {len(subscriptions)}\n" + "\n".join(lines))
+        return
+
+    try:
+        user_id = int(args[0])
+        days = float(args[1]) if len(args) > 1 else None
+        # float() принимает inf и nan, а огромный срок не переводится в дату
+        if days is not None and not 0 < days <= VIP_MAX_DAYS:
+            raise ValueError(days)
+    except (IndexError, ValueError):
+        await message.answer(
+            "Использование: /vip_grant id [дней], /vip_extend id [дней], /vip_revoke id, /vip_list"
+        )
+        return
+
+    if command == "vip_revoke":
+        if not await vip_users.revoke(user_id):
+            await message.answer(f"У пользователя {user_id} нет VIP")
+            return
+        await message.answer(f"VIP пользователя {user_id} отозван")
+        await send_notices({user_id: ui["vip_revoked"]})
+        logger.info("Администратор отозвал VIP у %s", user_log(user_id))
+        return
+
+    if command == "vip_grant":
+        expires_at = await vip_users.grant(user_id, days)
+    else:
+        expires_at = await vip_users.extend(user_id, days)
+    until = format_until(expires_at)
+    await message.answer(f"✅ VIP пользователя {user_id} действует до {until}")
+    await send_notices({user_id: ui.format("vip_granted", until=until)})
+    logger.info("Администратор выдал VIP %s до %s", user_log(user_id), until)
+
+
 @dp.message(Command("find"))
 async def find_partner(message: Message) -> None:
     """Поиск собеседника"""
@@ -338,19 +804,22 @@ async def find_partner(message: Message) -> None:
     await save_user_info(user)
     user_id = user.id
 
-    if user_id in active_users:
-        await message.reply("⚠️ Вы уже в чате! Используйте /stop чтобы выйти.")
+    if await is_chatting(user_id):
+        await message.reply(ui["already_chatting"])
         return
 
-    if user_id in waiting_users:
-        await message.answer("Вы уже в очереди на поиск")
+    if await chat_sessions.is_waiting(user_id):
+        await message.answer(ui["already_waiting"])
         return
 
-    if not await find_partner_logic(user_id):
-        waiting_users.append(user_id)
-        logger.info(
-            f"Пользователь {get_user_log_info(user_id)} добавлен в очередь. Размер очереди: {len(waiting_users)}")
-        await message.reply("🔍 Ищем собеседника... Ожидайте.", reply_markup=get_menu_keyboard())
+    request = parse_search_request(message.text.split()[1:])
+    if request.vip_only and user_id not in vip_users:
+        await message.answer(ui["vip_only_search"])
+        return
+
+    if not await find_partner_logic(user_id, request):
+        logger.info("Пользователь %s добавлен в очередь. Размер очереди: %s", user_log(user_id), chat_sessions.queue_depth())
+        await message.reply(search_notice(request), reply_markup=ui.keyboards.menu)
 
 
 @dp.message(Command("stop"))
@@ -360,14 +829,14 @@ async def stop_chat_handler(message: Message) -> None:
     await save_user_info(user)
     user_id = user.id
 
-    if user_id not in active_users:
-        await message.answer("❌ Вы не в чате. Используйте /find для поиска собеседника.")
+    if not await is_chatting(user_id):
+        await message.answer(ui["not_in_chat"])
         return
 
-    logger.info(f"Пользователь {get_user_log_info(user_id)} хочет выйти из чата")
+    logger.info("Пользователь %s хочет выйти из чата", user_log(user_id))
     await message.answer(
-        "⚠️ Вы уверены, что хотите завершить чат?",
-        reply_markup=get_confirm_keyboard("stop")
+        ui["confirm_stop"],
+        reply_markup=ui.keyboards.confirm["stop"]
     )
 
 
@@ -378,14 +847,14 @@ async def next_partner(message: Message) -> None:
     await save_user_info(user)
     user_id = user.id
 
-    if user_id not in active_users:
-        await message.answer("❌ Вы не в чате. Используйте /find для поиска собеседника.")
+    if not await is_chatting(user_id):
+        await message.answer(ui["not_in_chat"])
         return
 
-    logger.info(f"Пользователь {get_user_log_info(user_id)} запросил подтверждение смены собеседника")
+    logger.info("Пользователь %s запросил подтверждение смены собеседника", user_log(user_id))
     await message.answer(
-        "⚠️ Вы уверены, что хотите сменить собеседника?",
-        reply_markup=get_confirm_keyboard("next")
+        ui["confirm_next"],
+        reply_markup=ui.keyboards.confirm["next"]
     )
 
 
@@ -399,126 +868,109 @@ async def process_confirmation(callback_query: CallbackQuery) -> None:
 
     if response == "yes":
         if action == "next":
-            logger.info(f"Пользователь {get_user_log_info(user_id)} подтвердил смену собеседника")
-            partner_id = await stop_chat(user_id, initiator=True)
+            logger.info("Пользователь %s подтвердил смену собеседника", user_log(user_id))
+            await stop_chat(user_id, initiator=True)
 
-            if user_id not in waiting_users:
-                waiting_users.append(user_id)
+            # Подбор сразу после выхода из чата, чтобы пользователь не выпадал из поиска
+            partner_id = await match_user(user_id, last_search(user_id))
 
             await bot.send_message(
                 user_id,
-                "🔄 Ищем нового собеседника...",
-                reply_markup=get_menu_keyboard()
+                ui["next_searching"],
+                reply_markup=ui.keyboards.menu
             )
-            await find_partner_logic(user_id)
+            if partner_id is not None:
+                await announce_match(user_id, partner_id)
 
         elif action == "stop":
-            logger.info(f"Пользователь {get_user_log_info(user_id)} подтвердил выход из чата")
+            logger.info("Пользователь %s подтвердил выход из чата", user_log(user_id))
             await stop_chat(user_id)
             await bot.send_message(
                 user_id,
-                "🗑️ Чат завершён. Для нового общения используйте /find",
-                reply_markup=get_menu_keyboard()
+                ui["chat_stopped"],
+                reply_markup=ui.keyboards.menu
             )
     else:
-        logger.info(f"Пользователь {get_user_log_info(user_id)} отменил действие: {action}")
+        logger.info("Пользователь %s отменил действие: %s", user_log(user_id), action)
         await bot.send_message(
             user_id,
-            "❌ Действие отменено. Продолжаем общение.",
-            reply_markup=get_menu_keyboard()
+            ui["cancelled"],
+            reply_markup=ui.keyboards.menu
         )
 
 
 # Обработчики медиа
-@dp.message(F.photo)
-async def handle_photo(message: Message) -> None:
-    """Обработка фото"""
+@dp.message(F.content_type.in_(MEDIA_CONTENT_TYPES))
+async def handle_media(message: Message) -> None:
+    """Обработка фото, видео, голосовых, кружков, стикеров, GIF, файлов и аудио"""
     user = message.from_user
     await save_user_info(user)
     user_id = user.id
+    rule = RELAY_RULES[message.content_type]
 
-    await forward_to_admin(user_id, message.photo[-1].file_id, "photo")
-
-    if user_id in active_users:
-        partner_id = active_users[user_id]["partner_id"]
-        await forward_message(user_id, partner_id, message.photo[-1].file_id, "photo")
-    else:
-        await message.reply(
-            "❌ Вы не в чате. Используйте /find для поиска собеседника.",
-            reply_markup=get_menu_keyboard()
-        )
-
-
-@dp.message(F.voice)
-async def handle_voice(message: Message) -> None:
-    """Обработка голосовых сообщений"""
-    user = message.from_user
-    await save_user_info(user)
-    user_id = user.id
-
-    await forward_to_admin(user_id, message.voice.file_id, "voice")
-
-    if user_id in active_users:
-        partner_id = active_users[user_id]["partner_id"]
-        await forward_message(user_id, partner_id, message.voice.file_id, "voice")
-    else:
-        await message.reply(
-            "❌ Вы не в чате. Используйте /find для поиска собеседника.",
-            reply_markup=get_menu_keyboard()
-        )
-
+    if message.media_group_id and message.content_type in ALBUM_INPUT_MEDIA:
+        # Части альбома собираются и пересылаются вместе в handle_album
+        album_coalescer.add(message)
+        return
 
-@dp.message(F.video_note)
-async def handle_video_note(message: Message) -> None:
-    """Обработка видеосообщений (кружков)"""
-    user = message.from_user
-    await save_user_info(user)
-    user_id = user.id
+    if rule.vip_notice and user_id not in vip_users:
+        await message.answer(rule.vip_notice, reply_markup=ui.keyboards.menu)
+        return
 
-    if user_id not in vip_users:
-        await message.answer(
-            "🔒 Отправка видеосообщений доступна только VIP-пользователям\n"
-            "Используйте команду /vip для получения информации",
-            reply_markup=get_menu_keyboard()
-        )
+    notice = moderate(user_id, message.caption)
+    if notice:
+        await message.answer(notice)
         return
 
-    await forward_to_admin(user_id, message.video_note.file_id, "video_note")
+    if rule.mirror:
+        forward_to_admin(user_id, get_file_id(message), message.content_type)
 
-    if user_id in active_users:
-        partner_id = active_users[user_id]["partner_id"]
-        await forward_message(user_id, partner_id, message.video_note.file_id, "video_note")
+    partner_id = await chat_sessions.partner_of(user_id)
+    if partner_id is not None:
+        await forward_message(user_id, partner_id, message)
     else:
         await message.reply(
-            "❌ Вы не в чате. Используйте /find для поиска собеседника.",
-            reply_markup=get_menu_keyboard()
+            ui["not_in_chat"],
+            reply_markup=ui.keyboards.menu
         )
 
 
-@dp.message(F.video)
-async def handle_video(message: Message) -> None:
-    """Обработка видео"""
-    user = message.from_user
-    await save_user_info(user)
-    user_id = user.id
+async def handle_album(album: List[Message]) -> None:
+    """Обработка собранного альбома: одна отправка собеседнику и одна администратору"""
+    user_id = album[0].from_user.id
 
+    notices = {RELAY_RULES[message.content_type].vip_notice for message in album}
     if user_id not in vip_users:
-        await message.answer(
-            "🔒 Отправка обычных видео доступна только VIP-пользователям\n"
-            "Используйте команду /vip для получения информации",
-            reply_markup=get_menu_keyboard()
-        )
+        album = [message for message in album if not RELAY_RULES[message.content_type].vip_notice]
+        for notice in notices - {None}:
+            await bot.send_message(user_id, notice, reply_markup=ui.keyboards.menu)
+    if not album:
         return
 
-    await forward_to_admin(user_id, message.video.file_id, "video")
+    for message in album:
+        notice = moderate(user_id, message.caption)
+        if notice:
+            # Альбом не пересылается целиком: подпись может стоять у любой части
+            await bot.send_message(user_id, notice)
+            return
+
+    admin_mirror.submit_album(
+        user_id,
+        [(message.content_type, get_file_id(message)) for message in album if RELAY_RULES[message.content_type].mirror],
+        f"Альбом от {get_user_log_info(user_id)}"
+    )
 
-    if user_id in active_users:
-        partner_id = active_users[user_id]["partner_id"]
-        await forward_message(user_id, partner_id, message.video.file_id, "video")
+    partner_id = await chat_sessions.partner_of(user_id)
+    if partner_id is not None:
+        if len(album) == 1:
+            await forward_message(user_id, partner_id, album[0])
+        else:
+            await forward_album(user_id, partner_id, album)
     else:
-        await message.reply(
-            "❌ Вы не в чате. Используйте /find для поиска собеседника.",
-            reply_markup=get_menu_keyboard()
+        await bot.send_message(
+            user_id,
+            ui["not_in_chat"],
+            reply_markup=ui.keyboards.menu
         )
 
 
@@ -530,104 +982,223 @@ async def send_text_message(message: Message) -> None:
     user_id = user.id
     text = message.text
 
-    if text == "📱 Меню":
+    if text == ui["menu_button"]:
         await message.answer(
-            "Меню:",
-            reply_markup=get_vip_keyboard() if user_id in vip_users else get_main_keyboard()
+            ui["menu"],
+            reply_markup=ui.keyboards.vip if user_id in vip_users else ui.keyboards.main
         )
         return
 
-    if URL_PATTERN.search(text):
-        await message.answer("⚠️ Отправка ссылок запрещена")
-        logger.warning(f"Попытка отправить ссылку от {get_user_log_info(user_id)}")
+    notice = moderate(user_id, text)
+    if notice:
+        await message.answer(notice)
         return
 
-    log_text = text if len(text) <= 50 else f"{text[:50]}..."
-    logger.info(f"Сообщение от {get_user_log_info(user_id)}: {log_text}")
+    if relay_log_sampled():
+        log_text = text if len(text) <= 50 else f"{text[:50]}..."
+        logger.info("Сообщение от %s: %s", user_log(user_id), log_text)
 
-    if user_id in active_users:
-        partner_id = active_users[user_id]["partner_id"]
-        await forward_message(user_id, partner_id, text, "text")
+    partner_id = await chat_sessions.partner_of(user_id)
+    if partner_id is not None:
+        await forward_message(user_id, partner_id, message)
     else:
         await message.reply(
-            "❌ Вы не в чате. Используйте /find для поиска собеседника.",
-            reply_markup=get_menu_keyboard()
+            ui["not_in_chat"],
+            reply_markup=ui.keyboards.menu
         )
 
 
 @dp.message()
 async def unhandled_message(message: Message) -> None:
     """Обработчик неучтенных сообщений"""
-    logger.debug(f"Необработанное сообщение типа: {message.content_type}")
+    logger.debug("Необработанное сообщение типа: %s", message.content_type)
 
 
-async def on_startup(dp: Dispatcher) -> None:
-    """Обработчик запуска бота в режиме webhook"""
-    if os.getenv("USE_WEBHOOK", "").lower() == "true":
-        await bot.set_webhook(WEBHOOK_URL)
-        logger.info("Webhook установлен")
+@dp.startup()
+async def start_background_tasks() -> None:
+    """Запуск фоновых воркеров: один раз за время работы процесса"""
+    if background_started.is_set():
+        return
+    await restore_state()
+    background_started.set()
+    state_store.start()
+    await chat_sessions.start()
+    # Подписки, записанные только в хранилище процесса, попадают в общий бэкенд
+    await vip_users.sync(publish_missing=True)
+    activity_reaper.track(await chat_sessions.active_user_ids())
+    activity_reaper.track(await chat_sessions.waiting_user_ids())
+    activity_reaper.start()
+    admin_mirror.start()
+    moderator.start()
+    broadcaster.start()
+    duo_links.start()
+    vip_users.start()
+    loop_lag_monitor.start()
+
+
+@dp.shutdown()
+async def on_shutdown(dispatcher: Dispatcher) -> None:
+    """Обработчик завершения работы. Зарегистрирован раньше stop_background_tasks: воркеры ещё работают"""
+    if not shutdown_requested.is_set() or not background_started.is_set():
+        # Перезапуск polling после ошибки: чаты и очередь продолжаются
+        return
+    logger.info("Завершение работы бота...")
+    # Webhook остаётся зарегистрированным: после засыпания сервиса Telegram разбудит
+    # его следующим обновлением. Удаляется он только при переходе на polling
+    if chat_sessions.shared or state_store.persistent:
+        # Чаты сохранены (в общем бэкенде или хранилище) и продолжатся после перезапуска
+        await state_store.flush()
+    else:
+        # Чаты и очередь не переживут перезапуск: завершаем их и уведомляем всех разом
+        user_ids = await chat_sessions.active_user_ids() + await chat_sessions.waiting_user_ids()
+        for user_id in user_ids:
+            await chat_sessions.unpair(user_id)
+            await chat_sessions.cancel_search(user_id)
+        job = broadcaster.create(
+            ui["shutdown"],
+            user_ids,
+            persist=False
+        )
+        await broadcaster.run(job, timeout=float(os.getenv("SHUTDOWN_NOTICE_TIMEOUT", 20)))
+    await dispatcher.storage.close()
+    logger.info("Бот выключен")
 
 
-async def on_shutdown(dp: Dispatcher) -> None:
-    """Обработчик завершения работы"""
-    logger.info("Завершение работы бота...")
+@dp.shutdown()
+async def stop_background_tasks() -> None:
+    """Остановка фоновых воркеров и закрытие хранилищ при окончательном выключении"""
+    if not shutdown_requested.is_set() or not background_started.is_set():
+        # Перезапуск polling после ошибки: хранилище и воркеры нужны следующему запуску
+        return
+    background_started.clear()
+    for task in deferred_setup:
+        task.cancel()
+    await loop_lag_monitor.stop()
+    await album_coalescer.close()
+    await duo_links.stop()
+    await vip_users.stop()
+    await admin_mirror.stop()
+    logger.info("Зеркалирование: отправлено %s, отброшено %s", admin_mirror.mirrored, admin_mirror.dropped)
+    await moderator.stop()
+    await broadcaster.stop()
+    await activity_reaper.stop()
+    logger.info(
+        "Очистка неактивных: снято с поиска %s, завершено чатов %s",
+        activity_reaper.reclaimed_waiting, activity_reaper.reclaimed_sessions
+    )
+    await chat_sessions.close()
+    await state_store.close()
+
+
+async def on_startup(dispatcher: Dispatcher) -> None:
+    """Обработчик запуска бота в режиме webhook.
+
+    Webhook от прошлого запуска ещё действует, поэтому его регистрация идёт
+    в фоне: сервер начинает принимать обновления, не дожидаясь запроса к API.
+    """
     if os.getenv("USE_WEBHOOK", "").lower() == "true":
-        await bot.delete_webhook()
-    # Закрываем все активные чаты
-    for user_id in list(active_users.keys()):
-        await stop_chat(user_id, initiator=False)
-    await dp.storage.close()
-    await dp.storage.wait_closed()
-    logger.info("Бот выключен")
+        task = asyncio.create_task(register_webhook(dispatcher.resolve_used_update_types()))
+        deferred_setup.add(task)
+        task.add_done_callback(deferred_setup.discard)
 
 
-def run_flask():
-    """Запуск Flask сервера для health checks"""
-    port = int(os.getenv("PORT", 5000))
-    flask_app.run(host='0.0.0.0', port=port)
+async def register_webhook(allowed_updates: List[str]) -> None:
+    """Регистрация webhook с текущим адресом и типами обновлений"""
+    try:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40)),
+            allowed_updates=allowed_updates
+        )
+        logger.info("Webhook установлен")
+    except Exception as e:
+        logger.error("Не удалось установить webhook: %s", e, exc_info=True)
 
 
 async def polling_main() -> None:
     """Основная функция запуска бота в режиме polling"""
-    # Обработка сигналов завершения
+    # SIGTERM и SIGINT только выставляют событие: остановка и завершение чатов
+    # идут в основной корутине, через stop_polling и обработчики выключения
     loop = asyncio.get_running_loop()
-    loop.add_signal_handler(
-        signal.SIGTERM,
-        lambda: asyncio.create_task(on_shutdown(dp))
-    )
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, request_shutdown, sig)
+
+    # Метрики и проверка состояния на отдельном порту
+    metrics_port = os.getenv("METRICS_PORT")
+    if metrics_port:
+        from webserver import start_status_server
+
+        await start_status_server(metrics, int(metrics_port))
+        logger.info("Метрики доступны на порту %s", metrics_port)
+
+    # Только типы обновлений, для которых есть обработчики
+    allowed_updates = dp.resolve_used_update_types()
+    bot.session.middleware(UpdateBatchLimit(int(os.getenv("POLLING_BATCH_SIZE", MAX_BATCH))))
 
     restart_delay = 5
     max_restart_delay = 60
-    while True:
-        try:
-            logger.info("Запуск бота в режиме polling...")
-            await bot.delete_webhook(drop_pending_updates=True)
-            await dp.start_polling(bot, close_bot_session=True)
-        except Exception as e:
-            logger.error(f"Ошибка: {e}. Перезапуск через {restart_delay} сек...", exc_info=True)
-            await asyncio.sleep(restart_delay)
-            restart_delay = min(restart_delay * 1.5, max_restart_delay)
+    webhook_deleted = False
+    try:
+        while not shutdown_requested.is_set():
             try:
-                await bot.session.close()
-            except:
-                pass
+                if not webhook_deleted:
+                    # Обновления, пришедшие пока бот лежал, по умолчанию сохраняются
+                    await bot.delete_webhook(
+                        drop_pending_updates=os.getenv("DROP_PENDING_UPDATES", "").lower() == "true"
+                    )
+                    webhook_deleted = True
+                logger.info("Запуск бота в режиме polling (типы обновлений: %s)...", ", ".join(allowed_updates))
+                # Сессия и её пул соединений переживают перезапуск polling
+                await poll_until_stopped(
+                    dp,
+                    bot,
+                    shutdown_requested,
+                    polling_timeout=int(os.getenv("POLLING_TIMEOUT", 30)),
+                    allowed_updates=allowed_updates,
+                    tasks_concurrency_limit=int(os.getenv("POLLING_CONCURRENCY", 1000)),
+                    close_bot_session=False
+                )
+            except Exception as e:
+                logger.error("Ошибка: %s. Перезапуск через %s сек...", e, restart_delay, exc_info=True)
+                try:
+                    # Сигнал завершения прерывает ожидание перезапуска
+                    await asyncio.wait_for(shutdown_requested.wait(), restart_delay)
+                except asyncio.TimeoutError:
+                    pass
+                restart_delay = min(restart_delay * 1.5, max_restart_delay)
+        if background_started.is_set():
+            # Сигнал пришёл между запусками polling: выключение ещё не выполнялось
+            await dp.emit_shutdown(bot=bot, dispatcher=dp)
+    finally:
+        await bot.session.close()
+
+
+def request_shutdown(sig: signal.Signals) -> None:
+    """Обработчик сигнала завершения"""
+    logger.warning("Получен сигнал %s, завершение работы", sig.name)
+    shutdown_requested.set()
 
 
 def webhook_main() -> None:
     """Основная функция запуска бота в режиме webhook"""
-    flask_thread = Thread(target=run_flask)
-    flask_thread.daemon = True
-    flask_thread.start()
-
-    start_webhook(
-        dispatcher=dp,
-        webhook_path=WEBHOOK_PATH,
-        on_startup=on_startup,
-        on_shutdown=on_shutdown,
-        skip_updates=True,
-        host='0.0.0.0',
-        port=int(os.getenv("WEBHOOK_PORT", 3000))
+    # Сервер aiohttp нужен только здесь: в режиме polling он не импортируется
+    from aiohttp import web
+    from webserver import create_app
+
+    # Каждое выключение в режиме webhook окончательное: чаты завершаются
+    shutdown_requested.set()
+    dp.startup.register(on_startup)
+
+    app = create_app(
+        dp,
+        bot,
+        WEBHOOK_PATH,
+        max_in_flight=int(os.getenv("WEBHOOK_MAX_IN_FLIGHT", 1000)),
+        secret_token=WEBHOOK_SECRET,
+        metrics=metrics
     )
+    web.run_app(app, host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
 
 
 if __name__ == '__main__':
@@ -641,4 +1212,4 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         logger.info("Бот остановлен по запросу пользователя")
     except Exception as e:
-        logger.error(f"Критическая ошибка: {e}", exc_info=True)
\ No newline at end of file
+        logger.error("Критическая ошибка: %s", e, exc_info=True)
\ No newline at end of file
@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import secrets
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+SendCallback = Callable[[int, str], Awaitable[Any]]
+ProgressCallback = Callable[["BroadcastJob"], Awaitable[None]]
+
+# Суффикс ключа с курсором: список получателей записывается один раз, курсор — часто
+PROGRESS_SUFFIX = ":progress"
+
+
+class BroadcastJob:
+    """Рассылка одного текста списку получателей с курсором для продолжения.
+
+    ``cursor`` — индекс первого получателя, отправка которому ещё не
+    завершена: все до него уже обработаны. Завершённые индексы после курсора
+    (их не больше, чем успели обогнать медленную отправку) хранятся отдельно,
+    поэтому после перезапуска никто не получит сообщение дважды.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        text: str,
+        recipients: List[int],
+        meta: Optional[Dict[str, Any]] = None,
+        persist: bool = True,
+    ) -> None:
+        self.id = job_id
+        self.text = text
+        self.recipients = recipients
+        self.meta = meta if meta is not None else {}
+        self.persist = persist
+        self.cursor = 0
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._completed: Set[int] = set()  # Завершённые индексы после курсора
+
+    @property
+    def total(self) -> int:
+        return len(self.recipients)
+
+    @property
+    def done(self) -> bool:
+        return self.cursor >= self.total
+
+    def complete(self, index: int) -> None:
+        """Отметка отправки получателю ``index`` и сдвиг курсора"""
+        self._completed.add(index)
+        while self.cursor in self._completed:
+            self._completed.discard(self.cursor)
+            self.cursor += 1
+
+    def summary(self) -> str:
+        return (
+            f"{self.sent + self.failed + self.blocked} из {self.total}: "
+            f"доставлено {self.sent}, ошибок {self.failed}, заблокировали бота {self.blocked}"
+        )
+
+    def as_dict(self) -> dict:
+        return {"text": self.text, "recipients": self.recipients, "meta": self.meta, "started_at": self.started_at}
+
+    def progress_dict(self) -> dict:
+        return {"cursor": self.cursor, "completed": sorted(self._completed),
+                "sent": self.sent, "failed": self.failed, "blocked": self.blocked}
+
+    @classmethod
+    def from_dict(cls, job_id: str, data: dict, progress: Optional[dict] = None) -> "BroadcastJob":
+        job = cls(job_id, data["text"], [int(uid) for uid in data["recipients"]], data.get("meta"))
+        job.started_at = data.get("started_at", job.started_at)
+        if progress:
+            job.cursor = progress.get("cursor", 0)
+            job._completed = set(progress.get("completed", ()))
+            job.sent = progress.get("sent", 0)
+            job.failed = progress.get("failed", 0)
+            job.blocked = progress.get("blocked", 0)
+        return job
+
+
+class BroadcastEngine:
+    """Рассылка сообщений с ограниченным числом одновременных отправок.
+
+    ``concurrency`` воркеров берут получателей по порядку и отправляют через
+    ``send``, поэтому лимиты Telegram соблюдает общий планировщик запросов, а
+    его очередь никогда не переполняется рассылкой. Сетевые сбои повторяются
+    с паузой, заблокировавшие бота считаются отдельно. Сохраняемые рассылки
+    записывают курсор в хранилище состояния и продолжаются после перезапуска.
+    Раз в ``progress_interval`` секунд и по окончании вызывается ``on_progress``.
+    """
+
+    def __init__(
+        self,
+        send: SendCallback,
+        store: Any,
+        ns: str,
+        concurrency: int = 20,
+        progress_interval: float = 5.0,
+        max_attempts: int = 3,
+        on_progress: Optional[ProgressCallback] = None,
+    ) -> None:
+        self.send = send
+        self.store = store
+        self.ns = ns
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self.max_attempts = max_attempts
+        self.on_progress = on_progress
+        self._jobs: Dict[str, BroadcastJob] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    @property
+    def jobs(self) -> List[BroadcastJob]:
+        return list(self._jobs.values())
+
+    def create(
+        self,
+        text: str,
+        recipients: Iterable[int],
+        meta: Optional[Dict[str, Any]] = None,
+        persist: bool = True,
+    ) -> BroadcastJob:
+        """Новая рассылка. Повторяющиеся получатели отбрасываются"""
+        job = BroadcastJob(secrets.token_hex(4), text, list(dict.fromkeys(recipients)), meta, persist)
+        if persist:
+            self.store.put(self.ns, job.id, job.as_dict())
+        return job
+
+    def restore(self, state: Dict[str, Any]) -> None:
+        """Загрузка незавершённых рассылок из пространства имён хранилища"""
+        for key, data in state.items():
+            if key.endswith(PROGRESS_SUFFIX):
+                continue
+            job = BroadcastJob.from_dict(key, data, state.get(key + PROGRESS_SUFFIX))
+            self._jobs[job.id] = job
+
+    def start(self, job: Optional[BroadcastJob] = None) -> None:
+        """Запуск рассылки в фоне; без аргумента — продолжение восстановленных"""
+        jobs = [job] if job is not None else list(self._jobs.values())
+        for item in jobs:
+            self._jobs[item.id] = item
+            task = self._tasks.get(item.id)
+            if task is None or task.done():
+                self._tasks[item.id] = asyncio.create_task(self.run(item))
+
+    async def stop(self) -> None:
+        """Остановка фоновых рассылок. Сохраняемые продолжатся после перезапуска"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def run(self, job: BroadcastJob, timeout: Optional[float] = None) -> BroadcastJob:
+        """Рассылка до конца или до истечения ``timeout`` секунд"""
+        self._jobs[job.id] = job
+        if job.cursor:
+            logger.info("Рассылка %s продолжена с %d из %d", job.id, job.cursor, job.total)
+        indexes = (index for index in range(job.cursor, job.total) if index not in job._completed)
+        workers = [asyncio.create_task(self._worker(job, indexes)) for _ in range(min(self.concurrency, job.total))]
+        reporter = asyncio.create_task(self._report(job))
+        try:
+            await asyncio.wait_for(asyncio.gather(*workers), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Рассылка %s прервана по таймауту: %s", job.id, job.summary())
+        finally:
+            for worker in workers:
+                worker.cancel()
+            reporter.cancel()
+            await asyncio.gather(*workers, reporter, return_exceptions=True)
+            self._save(job)
+
+        if job.done or not job.persist:
+            # Несохраняемая рассылка после таймаута не продолжится
+            self._jobs.pop(job.id, None)
+            self._tasks.pop(job.id, None)
+        if job.done:
+            job.finished_at = time.time()
+            if job.persist:
+                self.store.delete(self.ns, job.id)
+                self.store.delete(self.ns, job.id + PROGRESS_SUFFIX)
+            logger.info("Рассылка %s завершена за %.1f сек: %s",
+                        job.id, job.finished_at - job.started_at, job.summary())
+        await self._notify(job)
+        return job
+
+    async def _worker(self, job: BroadcastJob, indexes: Iterable[int]) -> None:
+        # Общий итератор: каждый индекс достаётся ровно одному воркеру
+        for index in indexes:
+            await self._deliver(job, job.recipients[index])
+            job.complete(index)
+            self._save(job)
+
+    async def _deliver(self, job: BroadcastJob, user_id: int) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await self.send(user_id, job.text)
+                job.sent += 1
+                return
+            except TelegramForbiddenError:
+                job.blocked += 1
+                return
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt == self.max_attempts:
+                    logger.warning("Рассылка %s: не доставлено %s: %s", job.id, user_id, e)
+                    break
+                await asyncio.sleep(2 ** (attempt - 1))
+            except Exception as e:
+                logger.warning("Рассылка %s: не доставлено %s: %s", job.id, user_id, e)
+                break
+        job.failed += 1
+
+    def _save(self, job: BroadcastJob) -> None:
+        # Хранилище записывает только последнее значение ключа, поэтому это дёшево
+        if job.persist:
+            self.store.put(self.ns, job.id + PROGRESS_SUFFIX, job.progress_dict())
+
+    async def _report(self, job: BroadcastJob) -> None:
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            logger.info("Рассылка %s: %s", job.id, job.summary())
+            await self._notify(job)
+
+    async def _notify(self, job: BroadcastJob) -> None:
+        if self.on_progress is None:
+            return
+        try:
+            await self.on_progress(job)
+        except Exception as e:
+            logger.warning("Не удалось сообщить о ходе рассылки %s: %s", job.id, e)
@@ -0,0 +1,228 @@
+import logging
+from types import MappingProxyType
+from typing import Any, Dict, Iterator, Mapping, NamedTuple, Optional, Tuple, Union
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InputFile,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+)
+from aiohttp import FormData
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LOCALE = "ru"
+
+# Действия, требующие подтверждения кнопками «Да» / «Нет»
+CONFIRM_ACTIONS = ("stop", "next")
+
+# Кнопки главной клавиатуры: по две в ряд
+MAIN_COMMANDS = ("/find", "/stop", "/next", "/vip", "/duo")
+
+# Все тексты бота по языкам. Шаблоны с параметрами заполняются через str.format
+MESSAGES: Dict[str, Dict[str, str]] = {
+    "ru": {
+        "menu_button": "📱 Меню",
+        "menu": "Меню:",
+        "yes": "✅ Да",
+        "no": "❌ Нет",
+        "welcome": (
+            "👋 Привет! Это анонимный чат-бот.\n"
+            "Доступные команды:\n"
+            "/find - найти собеседника\n"
+            "/find ru музыка - найти по языку и интересам\n"
+            "/stop - выйти из чата\n"
+            "/next - сменить собеседника\n"
+            "/vip - информация о VIP-статусе\n"
+            "/duo - создать ссылку для диалога\n\n"
+            "Для открытия меню нажмите кнопку '📱 Меню'"
+        ),
+        "not_in_chat": "❌ Вы не в чате. Используйте /find для поиска собеседника.",
+        "already_chatting": "⚠️ Вы уже в чате! Используйте /stop чтобы выйти.",
+        "already_waiting": "Вы уже в очереди на поиск",
+        "vip_only_search": "🔒 Поиск только среди VIP доступен VIP-пользователям\nИспользуйте команду /vip",
+        "searching": "🔍 Ищем собеседника... Ожидайте.",
+        "searching_tags": "🔍 Ищем собеседника: {tags}... Ожидайте.",
+        "vip_only_tag": "только VIP",
+        "match_found": "✅ Собеседник найден! Общайтесь анонимно.\nДля открытия меню нажмите '📱 Меню'",
+        "chat_left": "❌ Чат завершён. Ищем нового собеседника...",
+        "partner_left": "❌ Собеседник покинул чат",
+        "partner_left_find": "❌ Собеседник покинул чат. Используйте /find для нового поиска.",
+        "confirm_stop": "⚠️ Вы уверены, что хотите завершить чат?",
+        "confirm_next": "⚠️ Вы уверены, что хотите сменить собеседника?",
+        "next_searching": "🔄 Ищем нового собеседника...",
+        "chat_stopped": "🗑️ Чат завершён. Для нового общения используйте /find",
+        "cancelled": "❌ Действие отменено. Продолжаем общение.",
+        "queue_timeout": (
+            "⌛ Собеседник не нашёлся за {minutes} мин. Поиск остановлен.\n"
+            "Используйте /find, чтобы искать снова."
+        ),
+        "idle_chat": "⌛ Чат завершён из-за неактивности. Используйте /find для нового поиска.",
+        "flood_mute": "⏳ Слишком много сообщений. Они не доставляются ещё {seconds} сек.",
+        "relay_prefix": "👤: ",
+        "relay_rejected": "⚠️ Сообщение не доставлено собеседнику",
+        "caption_photo": "📷 Фото от собеседника",
+        "caption_voice": "🎤 Голосовое от собеседника",
+        "caption_video": "🎥 Видео от собеседника",
+        "vip_only_video": (
+            "🔒 Отправка обычных видео доступна только VIP-пользователям\n"
+            "Используйте команду /vip для получения информации"
+        ),
+        "vip_only_video_note": (
+            "🔒 Отправка видеосообщений доступна только VIP-пользователям\n"
+            "Используйте команду /vip для получения информации"
+        ),
+        "moderation_link": "⚠️ Отправка ссылок запрещена",
+        "moderation_mention": "⚠️ Упоминания пользователей и каналов запрещены",
+        "moderation_word": "⚠️ Сообщение содержит запрещённые слова",
+        "duo_invalid": "❌ Ссылка недействительна или устарела",
+        "duo_self": "❌ Нельзя начать диалог с самим собой",
+        "duo_busy": "❌ Один из пользователей уже в другом диалоге",
+        "duo_created": "✅ Диалог создан! Общайтесь анонимно.",
+        "duo_in_chat": "❌ Вы уже в чате. Сначала завершите текущий диалог с помощью /stop",
+        "duo_link": (
+            "🔗 Ваша ссылка для диалога:\n\n{link}\n\n"
+            "Отправьте эту ссылку другу, чтобы начать приватный диалог.\n"
+            "Ссылка действует {hours} ч."
+        ),
+        "vip_active": (
+            "🎉 У вас уже есть VIP-статус до {until}!\n\n"
+            "Вы можете отправлять видеосообщения и обычные видео"
+        ),
+        "vip_granted": "🎉 Вам выдан VIP-статус до {until}! Подробнее: /vip",
+        "vip_revoked": "🔒 VIP-статус отключён",
+        "vip_expired": "⌛ Срок VIP-статуса истёк. Продлить: /vip",
+        "vip_offer": (
+            "🔒 VIP-статус открывает дополнительные возможности:\n"
+            "• Отправка видеосообщений (кружков)\n"
+            "• Отправка обычных видео\n"
+            "• Приоритет в поиске собеседника\n"
+            "• Поиск только среди VIP (/find vip)\n\n"
+            "💰 Стоимость: {price}\n"
+            "Для покупки напишите администратору"
+        ),
+        "shutdown": "❌ Бот перезапускается, чат и поиск завершены. Используйте /find через минуту.",
+    },
+}
+
+Markup = Union[ReplyKeyboardMarkup, InlineKeyboardMarkup]
+
+
+class Keyboards(NamedTuple):
+    """Клавиатуры одного языка, построенные один раз"""
+    menu: ReplyKeyboardMarkup  # Кнопка меню под каждым сообщением
+    main: ReplyKeyboardMarkup  # Команды бота
+    vip: ReplyKeyboardMarkup  # Команды для VIP (пока те же)
+    confirm: Mapping[str, InlineKeyboardMarkup]  # Подтверждение действия по его имени
+
+
+def build_keyboards(texts: Mapping[str, str]) -> Keyboards:
+    """Клавиатуры из текстов языка. Объекты aiogram неизменяемы, их можно отправлять повторно"""
+    menu = ReplyKeyboardMarkup(keyboard=[[KeyboardButton(text=texts["menu_button"])]], resize_keyboard=True)
+    buttons = [KeyboardButton(text=command) for command in MAIN_COMMANDS]
+    main = ReplyKeyboardMarkup(
+        keyboard=[buttons[index:index + 2] for index in range(0, len(buttons), 2)],
+        resize_keyboard=True
+    )
+    confirm = {
+        action: InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text=texts["yes"], callback_data=f"confirm_{action}_yes"),
+            InlineKeyboardButton(text=texts["no"], callback_data=f"confirm_{action}_no"),
+        ]])
+        for action in CONFIRM_ACTIONS
+    }
+    return Keyboards(menu=menu, main=main, vip=main, confirm=MappingProxyType(confirm))
+
+
+class Locale:
+    """Тексты и клавиатуры одного языка: ``ui["not_in_chat"]``, ``ui.keyboards.menu``"""
+
+    __slots__ = ("code", "texts", "keyboards")
+
+    def __init__(self, code: str, texts: Mapping[str, str]) -> None:
+        self.code = code
+        self.texts = MappingProxyType(dict(texts))
+        self.keyboards = build_keyboards(self.texts)
+
+    def __getitem__(self, key: str) -> str:
+        return self.texts[key]
+
+    def format(self, key: str, **params: Any) -> str:
+        return self.texts[key].format(**params)
+
+
+class ResponseCatalog:
+    """Все ответы бота, собранные при запуске.
+
+    Для каждого языка строятся неизменяемые тексты и клавиатуры, так что
+    обработчики не создают объекты на каждое сообщение. Отсутствующие в
+    языке тексты берутся из языка по умолчанию. Язык выбирается по коду
+    Telegram (``en-US`` → ``en``), неизвестный код даёт язык по умолчанию.
+    """
+
+    def __init__(self, messages: Mapping[str, Mapping[str, str]] = MESSAGES, default: str = DEFAULT_LOCALE) -> None:
+        base = messages[default]
+        self.default = default
+        self._locales: Dict[str, Locale] = {
+            code: Locale(code, {**base, **texts}) for code, texts in messages.items()
+        }
+
+    def locale(self, code: Optional[str] = None) -> Locale:
+        if code:
+            found = self._locales.get(code) or self._locales.get(code.split("-", 1)[0].lower())
+            if found is not None:
+                return found
+        return self._locales[self.default]
+
+    @property
+    def codes(self) -> Tuple[str, ...]:
+        return tuple(self._locales)
+
+    def markups(self) -> Iterator[Markup]:
+        """Все клавиатуры всех языков (повторяющиеся объекты — один раз)"""
+        seen = set()
+        for locale in self._locales.values():
+            keyboards = locale.keyboards
+            for markup in (keyboards.menu, keyboards.main, keyboards.vip, *keyboards.confirm.values()):
+                if id(markup) not in seen:
+                    seen.add(id(markup))
+                    yield markup
+
+
+class CatalogSession(AiohttpSession):
+    """Сессия, которая сериализует клавиатуры каталога один раз.
+
+    JSON каждой клавиатуры из ``ResponseCatalog`` готовится при создании
+    сессии. Если в запросе стоит именно этот объект (проверка по ``is``),
+    поле ``reply_markup`` не проходит через ``model_dump`` и ``json_dumps``,
+    а берётся готовой строкой. Остальные запросы собираются как обычно.
+    """
+
+    def __init__(self, catalog: ResponseCatalog, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._markup_json: Dict[int, Tuple[Markup, str]] = {}
+        for markup in catalog.markups():
+            # В клавиатурах нет полей со значениями по умолчанию бота, bot не нужен
+            self._markup_json[id(markup)] = (markup, self.prepare_value(markup, bot=None, files={}))
+
+    def build_form_data(self, bot: Bot, method: TelegramMethod[Any]) -> FormData:
+        cached = self._markup_json.get(id(getattr(method, "reply_markup", None)))
+        if cached is None or cached[0] is not method.reply_markup:
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files: Dict[str, InputFile] = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", cached[1])
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
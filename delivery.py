@@ -0,0 +1,180 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+# Ответы на BadRequest, означающие, что чата с пользователем больше нет
+DEAD_CHAT_ERRORS = ("chat not found", "user is deactivated", "peer_id_invalid")
+
+DeadRecipientCallback = Callable[[int], Awaitable[None]]
+
+
+class RecipientUnavailable(TelegramForbiddenError):
+    """Получатель ранее заблокировал бота: запрос не отправлялся"""
+
+
+class CircuitOpen(TelegramNetworkError):
+    """Bot API недоступен: запрос не отправлялся до окончания паузы"""
+
+
+def is_dead_chat_error(error: Exception) -> bool:
+    """Означает ли ошибка, что пользователь заблокировал бота или удалён"""
+    if isinstance(error, TelegramForbiddenError):
+        return True
+    return isinstance(error, TelegramBadRequest) and any(
+        text in error.message.lower() for text in DEAD_CHAT_ERRORS
+    )
+
+
+class CircuitBreaker:
+    """Предохранитель для сетевых ошибок Bot API.
+
+    После ``threshold`` сетевых ошибок подряд запросы отклоняются без
+    обращения к сети на ``backoff`` секунд. Затем пропускается один пробный
+    запрос: успех замыкает цепь, ошибка снова размыкает её с удвоенной
+    паузой (не больше ``max_backoff``).
+    """
+
+    def __init__(self, threshold: int = 5, backoff: float = 1.0, max_backoff: float = 60.0) -> None:
+        self.threshold = threshold
+        self.base_backoff = backoff
+        self.max_backoff = max_backoff
+        self.backoff = backoff
+        self.failures = 0
+        self.open_until = 0.0
+        self.opened = 0
+        self.rejected = 0
+        self._probing = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.threshold
+
+    def allow(self, now: float) -> bool:
+        """Можно ли отправить запрос"""
+        if not self.is_open:
+            return True
+        if now < self.open_until or self._probing:
+            self.rejected += 1
+            return False
+        self._probing = True
+        return True
+
+    def success(self) -> None:
+        if self.is_open:
+            logger.info("Связь с Bot API восстановлена")
+        self.failures = 0
+        self.backoff = self.base_backoff
+        self._probing = False
+
+    def release(self) -> None:
+        """Запрос завершился без ответа API: пробу может сделать следующий"""
+        self._probing = False
+
+    def failure(self, now: float) -> None:
+        self.failures += 1
+        if self._probing:
+            self._probing = False
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+        elif self.failures != self.threshold:
+            return
+        self.open_until = now + self.backoff
+        self.opened += 1
+        logger.warning("Bot API недоступен, запросы приостановлены на %.1f сек", self.backoff)
+
+
+class DeliveryGuard(BaseRequestMiddleware):
+    """Защита исходящих запросов от недоступных получателей и сбоев сети.
+
+    Чаты пользователей, заблокировавших бота, запоминаются (и сохраняются в
+    хранилище состояния): следующие запросы к ним сразу завершаются
+    ``RecipientUnavailable`` без обращения к API. При первой такой ошибке
+    вызывается ``on_dead``, чтобы убрать пользователя из чата, очереди и Duo
+    ссылок. Сетевые ошибки и ответы 5xx проходят через ``CircuitBreaker``,
+    пока он разомкнут, запросы завершаются ``CircuitOpen``.
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        ns: str,
+        breaker: Optional[CircuitBreaker] = None,
+        on_dead: Optional[DeadRecipientCallback] = None,
+    ) -> None:
+        self.store = store
+        self.ns = ns
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+        self.on_dead = on_dead
+        self._dead: Dict[int, float] = {}  # {chat_id: когда обнаружен}
+        self.skipped = 0
+
+    def __len__(self) -> int:
+        return len(self._dead)
+
+    def __contains__(self, chat_id: object) -> bool:
+        return chat_id in self._dead
+
+    def restore(self, chat_id: Any, detected_at: float) -> None:
+        """Загрузка недоступного чата из хранилища"""
+        self._dead[int(chat_id)] = detected_at
+
+    def revive(self, chat_id: int) -> bool:
+        """Пользователь снова пишет боту: чат доступен. Возвращает True, если он был недоступен"""
+        if self._dead.pop(chat_id, None) is None:
+            return False
+        self.store.delete(self.ns, chat_id)
+        logger.info("Пользователь %s снова доступен", chat_id)
+        return True
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Any,
+        method: Any,
+    ) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id in self._dead:
+            self.skipped += 1
+            raise RecipientUnavailable(method, f"chat {chat_id} is unavailable")
+        if not self.breaker.allow(time.monotonic()):
+            raise CircuitOpen(method, "Bot API is unavailable")
+        try:
+            result = await make_request(bot, method)
+        except (TelegramNetworkError, TelegramServerError):
+            self.breaker.failure(time.monotonic())
+            raise
+        except TelegramAPIError as e:
+            # Ответ получен: API доступен, ошибка относится к запросу
+            self.breaker.success()
+            if isinstance(chat_id, int) and is_dead_chat_error(e):
+                await self._mark_dead(chat_id, e)
+            raise
+        except BaseException:
+            # Запрос не дошёл до API (отмена, переполнение очереди)
+            self.breaker.release()
+            raise
+        self.breaker.success()
+        return result
+
+    async def _mark_dead(self, chat_id: int, error: Exception) -> None:
+        if chat_id in self._dead:
+            return
+        now = time.time()
+        self._dead[chat_id] = now
+        self.store.put(self.ns, chat_id, now)
+        logger.info("Пользователь %s недоступен: %s", chat_id, error)
+        if self.on_dead is not None:
+            try:
+                await self.on_dead(chat_id)
+            except Exception as e:
+                logger.warning("Не удалось убрать недоступного пользователя %s: %s", chat_id, e)
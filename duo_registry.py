@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import logging
+import secrets
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Длина токена ссылки: 12 случайных байт в base64url, всегда 16 символов
+TOKEN_BYTES = 12
+
+
+class DuoLinkRegistry:
+    """Реестр Duo ссылок со сроком жизни и лимитом на создателя.
+
+    Поиск при переходе по ссылке — O(1) по словарю. Истечение обрабатывается
+    через min-кучу по времени окончания: фоновая очистка извлекает только
+    истёкшие ссылки, не просматривая остальные. Все изменения записываются
+    в хранилище состояния, поэтому ссылки переживают перезапуск.
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        ns: str,
+        ttl: float = 24 * 3600,
+        max_per_creator: int = 3,
+        sweep_interval: float = 60.0,
+    ) -> None:
+        self.store = store
+        self.ns = ns
+        self.ttl = ttl
+        self.max_per_creator = max_per_creator
+        self.sweep_interval = sweep_interval
+        self._links: Dict[str, Tuple[int, float]] = {}  # {token: (creator_id, expires_at)}
+        self._by_creator: Dict[int, Deque[str]] = {}
+        self._expiry: List[Tuple[float, str]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+        self.replaced = 0
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def create(self, creator_id: int) -> str:
+        """Выпуск новой ссылки. Самая старая ссылка создателя сверх лимита отзывается"""
+        token = secrets.token_urlsafe(TOKEN_BYTES)
+        self._add(token, creator_id, time.time() + self.ttl)
+        tokens = self._by_creator[creator_id]
+        while len(tokens) > self.max_per_creator:
+            self._remove(tokens[0])
+            self.replaced += 1
+        return token
+
+    def get(self, token: str) -> Optional[int]:
+        """Создатель ссылки или None, если ссылки нет или она истекла"""
+        link = self._links.get(token)
+        if link is None or link[1] <= time.time():
+            return None
+        return link[0]
+
+    def expires_at(self, token: str) -> float:
+        """Время окончания действия ссылки"""
+        return self._links[token][1]
+
+    def redeem(self, token: str) -> Optional[int]:
+        """Использование ссылки: она удаляется из реестра"""
+        creator_id = self.get(token)
+        if creator_id is not None:
+            self._remove(token)
+        return creator_id
+
+    def revoke_creator(self, creator_id: int) -> List[str]:
+        """Отзыв всех ссылок создателя. Возвращает их токены"""
+        tokens = list(self._by_creator.get(creator_id, ()))
+        for token in tokens:
+            self._remove(token)
+        return tokens
+
+    def restore(self, token: str, value: Any) -> None:
+        """Загрузка ссылки из хранилища. Уже загруженная ссылка не добавляется второй раз"""
+        if token in self._links:
+            return
+        if isinstance(value, list):
+            creator_id, expires_at = value
+        else:  # Ссылки, сохранённые до появления срока жизни
+            creator_id, expires_at = value, time.time() + self.ttl
+        if expires_at > time.time():
+            self._add(token, int(creator_id), expires_at, persist=False)
+        else:
+            self.store.delete(self.ns, token)
+
+    def sweep(self) -> int:
+        """Удаление истёкших ссылок. Стоимость пропорциональна их числу"""
+        now = time.time()
+        removed = 0
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, token = heapq.heappop(self._expiry)
+            link = self._links.get(token)
+            # Ссылка могла быть уже использована или отозвана
+            if link is not None and link[1] == expires_at:
+                self._remove(token)
+                removed += 1
+        self.expired += removed
+        return removed
+
+    def _add(self, token: str, creator_id: int, expires_at: float, persist: bool = True) -> None:
+        self._links[token] = (creator_id, expires_at)
+        self._by_creator.setdefault(creator_id, deque()).append(token)
+        heapq.heappush(self._expiry, (expires_at, token))
+        if persist:
+            self.store.put(self.ns, token, [creator_id, expires_at])
+
+    def _remove(self, token: str) -> None:
+        creator_id, _ = self._links.pop(token)
+        tokens = self._by_creator[creator_id]
+        tokens.remove(token)
+        if not tokens:
+            del self._by_creator[creator_id]
+        self.store.delete(self.ns, token)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.info("Удалено истёкших Duo ссылок: %d", removed)
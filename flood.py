@@ -0,0 +1,168 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Collection, Dict, Optional
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Виды входящих обновлений с отдельными лимитами
+KIND_TEXT = "text"  # Текст, команды и нажатия кнопок
+KIND_MEDIA = "media"  # Фото, видео, голосовые и прочие вложения
+KINDS = (KIND_TEXT, KIND_MEDIA)
+
+MuteCallback = Callable[[int, float], Awaitable[None]]
+
+
+class _FloodSlot:
+    """Вёдра токенов одного пользователя и история нарушений"""
+
+    __slots__ = ("text", "media", "updated", "violations", "muted_until", "strikes", "album")
+
+    def __init__(self, text: float, media: float, now: float) -> None:
+        self.text = text
+        self.media = media
+        self.updated = now
+        self.violations = 0  # Отброшено с последнего затишья
+        self.muted_until = 0.0
+        self.strikes = 0  # Мутов подряд, от них зависит длительность следующего
+        self.album: Optional[str] = None  # Последний альбом: его части считаются одним сообщением
+
+
+class FloodControl(BaseMiddleware):
+    """Ограничение частоты входящих обновлений от каждого пользователя.
+
+    Внешний middleware, подключаемый первым: лишние обновления отбрасываются
+    молча, до блокировок, логов и запросов к API. У каждого пользователя два
+    ведра токенов — для текста и для медиа (альбом расходует один токен).
+    После ``mute_after`` отброшенных обновлений без затишья пользователь
+    получает мут на ``mute_base`` секунд, каждый следующий мут вдвое длиннее
+    (не больше ``mute_max``), пока пользователь не ведёт себя спокойно
+    ``strike_reset`` секунд. При превышении ``max_users`` вытесняется
+    состояние самого давно писавшего пользователя (LRU).
+    """
+
+    # Сколько недавно наказанных пользователей пропустить за одно вытеснение
+    MAX_EVICT_SKIPS = 64
+
+    def __init__(
+        self,
+        text_rate: float = 1.0,
+        text_burst: float = 5.0,
+        media_rate: float = 0.2,
+        media_burst: float = 5.0,
+        mute_after: int = 10,
+        mute_base: float = 30.0,
+        mute_max: float = 3600.0,
+        strike_reset: float = 600.0,
+        max_users: int = 100000,
+        exempt: Collection[int] = (),
+        on_mute: Optional[MuteCallback] = None,
+    ) -> None:
+        self.text_rate = text_rate
+        self.text_burst = text_burst
+        self.media_rate = media_rate
+        self.media_burst = media_burst
+        self.mute_after = mute_after
+        self.mute_base = mute_base
+        self.mute_max = mute_max
+        self.strike_reset = strike_reset
+        self.max_users = max_users
+        self.exempt = exempt
+        self.on_mute = on_mute
+        self._slots: "OrderedDict[int, _FloodSlot]" = OrderedDict()
+        self.dropped = {kind: 0 for kind in KINDS}
+        self.dropped_muted = 0
+        self.mutes = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+        message = getattr(event, "message", None)
+        if message is not None:
+            kind = KIND_TEXT if message.text is not None else KIND_MEDIA
+            album = message.media_group_id
+        elif getattr(event, "callback_query", None) is not None:
+            kind, album = KIND_TEXT, None
+        else:
+            return await handler(event, data)
+
+        muted_for = self.admit(user.id, kind, album)
+        if muted_for is None:
+            return await handler(event, data)
+        if muted_for and self.on_mute is not None:
+            await self.on_mute(user.id, muted_for)
+        return None
+
+    def admit(self, user_id: int, kind: str, album: Optional[str] = None, now: Optional[float] = None) -> Optional[float]:
+        """Учёт обновления. None — пропустить, 0 — отбросить, иначе длительность нового мута"""
+        now = time.monotonic() if now is None else now
+        slot = self._slots.get(user_id)
+        if slot is None:
+            if len(self._slots) >= self.max_users:
+                self._evict(now)
+            slot = self._slots[user_id] = _FloodSlot(self.text_burst, self.media_burst, now)
+        elif now < slot.muted_until:
+            self.dropped_muted += 1
+            return 0.0
+        else:
+            self._slots.move_to_end(user_id)
+            elapsed = now - slot.updated
+            slot.text = min(self.text_burst, slot.text + elapsed * self.text_rate)
+            slot.media = min(self.media_burst, slot.media + elapsed * self.media_rate)
+            slot.updated = now
+            if slot.text >= self.text_burst and slot.media >= self.media_burst:
+                slot.violations = 0
+
+        if kind == KIND_MEDIA:
+            if album is not None:
+                if album == slot.album:
+                    return None
+                slot.album = album
+            if slot.media >= 1:
+                slot.media -= 1
+                return None
+        elif slot.text >= 1:
+            slot.text -= 1
+            return None
+
+        self.dropped[kind] += 1
+        slot.violations += 1
+        if slot.violations < self.mute_after:
+            return 0.0
+        return self._mute(user_id, slot, now)
+
+    def _mute(self, user_id: int, slot: _FloodSlot, now: float) -> float:
+        if now - slot.muted_until >= self.strike_reset:
+            slot.strikes = 0
+        duration = min(self.mute_max, self.mute_base * 2 ** slot.strikes)
+        slot.strikes += 1
+        slot.muted_until = now + duration
+        slot.violations = 0
+        self.mutes += 1
+        logger.warning("Пользователь %s заглушён на %.0f сек за флуд (мут №%d подряд)", user_id, duration, slot.strikes)
+        return duration
+
+    def _evict(self, now: float) -> None:
+        """Вытеснение самого давно писавшего пользователя.
+
+        Недавно заглушённых возвращаем в конец очереди, чтобы вытеснение не
+        снимало мут досрочно; если такие занимают всю проверенную голову,
+        вытесняется самый старый.
+        """
+        for _ in range(self.MAX_EVICT_SKIPS):
+            user_id, slot = self._slots.popitem(last=False)
+            if not slot.strikes or now >= slot.muted_until + self.strike_reset:
+                return
+            self._slots[user_id] = slot
+        self._slots.popitem(last=False)
@@ -0,0 +1,150 @@
+import json
+import logging
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from aiogram import Bot, __version__
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.methods import TelegramMethod
+from aiohttp import ClientSession, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+
+from catalog import CatalogSession, ResponseCatalog
+
+logger = logging.getLogger(__name__)
+
+JsonCodec = Tuple[Callable[[str], Any], Callable[[Any], str]]
+
+# Таймауты запросов по методам Bot API, сек. Остальные методы — общий таймаут сессии
+DEFAULT_METHOD_TIMEOUTS: Dict[str, float] = {
+    "answerCallbackQuery": 10,
+    "sendMessage": 15,
+    "copyMessage": 15,
+    "editMessageText": 15,
+    "sendMediaGroup": 60,
+}
+
+
+def json_codec(fast: bool = True) -> JsonCodec:
+    """Функции (loads, dumps) для сессии: orjson, если установлен, иначе стандартный json"""
+    if fast:
+        try:
+            import orjson
+        except ImportError:
+            logger.info("orjson не установлен, используется стандартный json")
+        else:
+            return orjson.loads, lambda value: orjson.dumps(value).decode()
+    return json.loads, json.dumps
+
+
+def parse_method_timeouts(spec: str) -> Dict[str, float]:
+    """Разбор ``sendMessage=10,sendMediaGroup=60`` поверх таймаутов по умолчанию"""
+    timeouts = dict(DEFAULT_METHOD_TIMEOUTS)
+    for item in spec.split(","):
+        method, _, value = item.partition("=")
+        if not method.strip():
+            continue
+        try:
+            timeouts[method.strip()] = float(value)
+        except ValueError:
+            logger.warning("Таймаут метода пропущен: %r", item)
+    return timeouts
+
+
+class PooledSession(CatalogSession):
+    """HTTP-сессия Bot API с настроенным пулом соединений.
+
+    Все запросы идут к одному хосту, поэтому ``limit`` задаёт, сколько
+    запросов одновременно могут быть в сети; остальные ждут свободного
+    соединения. Соединения переиспользуются (keep-alive), адрес API
+    кэшируется на ``dns_ttl`` секунд. Таймаут выбирается по методу, если
+    вызывающий не передал свой (getUpdates в polling передаёт). Сессия
+    создаётся один раз и переживает перезапуски polling; счётчики пула
+    собираются через трассировку aiohttp.
+    """
+
+    def __init__(
+        self,
+        catalog: ResponseCatalog,
+        limit: int = 100,
+        keepalive_timeout: float = 30.0,
+        dns_ttl: int = 300,
+        method_timeouts: Optional[Mapping[str, float]] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(catalog, limit=limit, **kwargs)
+        self._connector_init.update(
+            limit_per_host=limit,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_ttl,
+            use_dns_cache=True,
+        )
+        self.limit = limit
+        self.method_timeouts = dict(DEFAULT_METHOD_TIMEOUTS if method_timeouts is None else method_timeouts)
+        self.in_flight = 0
+        self.waiting = 0
+        self.created = 0
+        self.reused = 0
+        self.sessions = 0
+        self._trace = TraceConfig()
+        self._trace.on_connection_queued_start.append(self._on_queued_start)
+        self._trace.on_connection_queued_end.append(self._on_queued_end)
+        self._trace.on_connection_create_end.append(self._on_create)
+        self._trace.on_connection_reuseconn.append(self._on_reuse)
+
+    async def create_session(self) -> ClientSession:
+        if self._should_reset_connector:
+            await self.close()
+
+        if self._session is None or self._session.closed:
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{__version__}"},
+                trace_configs=[self._trace],
+            )
+            self._should_reset_connector = False
+            self.sessions += 1
+        return self._session
+
+    async def make_request(self, bot: Bot, method: TelegramMethod[Any], timeout: Optional[int] = None) -> Any:
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        self.in_flight += 1
+        try:
+            return await super().make_request(bot, method, timeout)
+        finally:
+            self.in_flight -= 1
+
+    def pool_stats(self) -> Dict[str, int]:
+        """Соединения в работе, запросы в ожидании соединения, открыто и переиспользовано"""
+        return {
+            "in_use": max(0, self.in_flight - self.waiting),
+            "waiting": self.waiting,
+            "created": self.created,
+            "reused": self.reused,
+        }
+
+    async def _on_queued_start(self, session: ClientSession, context: Any, params: Any) -> None:
+        self.waiting += 1
+
+    async def _on_queued_end(self, session: ClientSession, context: Any, params: Any) -> None:
+        self.waiting -= 1
+
+    async def _on_create(self, session: ClientSession, context: Any, params: Any) -> None:
+        self.created += 1
+
+    async def _on_reuse(self, session: ClientSession, context: Any, params: Any) -> None:
+        self.reused += 1
+
+
+def create_api_session(
+    catalog: ResponseCatalog,
+    api_url: Optional[str] = None,
+    fast_json: bool = True,
+    **kwargs: Any,
+) -> PooledSession:
+    """Сессия Bot API: свой сервер (локальный telegram-bot-api или тестовая замена) и быстрый JSON"""
+    if api_url:
+        kwargs["api"] = TelegramAPIServer.from_base(api_url)
+    loads, dumps = json_codec(fast_json)
+    return PooledSession(catalog, json_loads=loads, json_dumps=dumps, **kwargs)
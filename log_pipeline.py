@@ -0,0 +1,98 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Callable, List, Optional
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class DeferredQueueHandler(QueueHandler):
+    """Постановка записи в очередь без форматирования.
+
+    Стандартный ``QueueHandler.prepare`` форматирует сообщение в вызывающем
+    потоке. Здесь запись уходит в очередь как есть, а подстановка аргументов,
+    форматирование и запись на диск выполняются в потоке ``QueueListener``.
+    Только ``LazyUserInfo`` вычисляется здесь, в вызывающем потоке: оно
+    читает данные цикла событий, которые нельзя трогать из другого потока.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if isinstance(record.args, tuple):
+            record.args = tuple(str(arg) if isinstance(arg, LazyUserInfo) else arg for arg in record.args)
+        if record.exc_info:
+            # Трейсбек держит кадры стека: превращаем его в текст сразу
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LazyUserInfo:
+    """Описание пользователя для логов, которое строится, только если запись проходит по уровню"""
+
+    __slots__ = ("user_id", "formatter")
+
+    def __init__(self, user_id: int, formatter: Callable[[int], str]) -> None:
+        self.user_id = user_id
+        self.formatter = formatter
+
+    def __str__(self) -> str:
+        return self.formatter(self.user_id)
+
+
+class LogSampler:
+    """Пропуск в лог только каждого N-го события (``rate`` — доля от 0 до 1)"""
+
+    __slots__ = ("every", "counter")
+
+    def __init__(self, rate: float) -> None:
+        self.every = 0 if rate <= 0 else max(1, round(1 / rate))
+        self.counter = 0
+
+    def __call__(self) -> bool:
+        if not self.every:
+            return False
+        self.counter += 1
+        if self.counter >= self.every:
+            self.counter = 0
+            return True
+        return False
+
+
+def setup_logging(
+    level: str = "INFO",
+    log_file: Optional[str] = "bot.log",
+    max_bytes: int = 10 * 1024 * 1024,
+    backup_count: int = 5,
+    use_queue: bool = True,
+) -> Optional[QueueListener]:
+    """Настройка логирования в консоль и файл с ротацией.
+
+    При ``use_queue`` обработчики работают в отдельном потоке, а цикл событий
+    только кладёт записи в очередь. Возвращает запущенный ``QueueListener``.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers: List[logging.Handler] = [logging.StreamHandler()]
+    if log_file:
+        handlers.append(RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8", delay=True
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if not use_queue:
+        for handler in handlers:
+            root.addHandler(handler)
+        return None
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,349 @@
+import re
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from typing import Deque, Dict, FrozenSet, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# Уровни приоритета в очереди поиска
+TIER_VIP = "vip"
+TIER_REGULAR = "regular"
+TIERS = (TIER_VIP, TIER_REGULAR)
+
+# Сколько записей подкорзины просматривать в поисках совместимого собеседника (не меньше)
+SCAN_LIMIT = 8
+# Подкорзина всех ожидающих без деления по языку: в ней ищут пользователи без языка
+ANY_LANG = "*"
+# Не больше трёх интересов в одном поиске
+MAX_INTERESTS = 3
+# Языки, которые можно указать в /find
+LANGUAGES = frozenset({"ru", "en", "uk", "be", "kk", "uz", "de", "fr", "es", "it", "pt", "tr", "pl"})
+# Слово в /find, ограничивающее поиск VIP-собеседниками
+VIP_ONLY_TAG = "vip"
+_INTEREST_PATTERN = re.compile(r"^\w{2,24}$")
+
+
+class SearchRequest(NamedTuple):
+    """Параметры поиска из /find: интересы, язык и поиск только среди VIP"""
+    interests: FrozenSet[str] = frozenset()
+    lang: Optional[str] = None
+    vip_only: bool = False
+
+    def bucket_keys(self) -> Tuple[str, ...]:
+        """Корзины, в которых ищут и ждут: по интересам, иначе по языку, иначе общая"""
+        if self.interests:
+            return tuple(sorted(self.interests))
+        if self.lang:
+            return (f"lang:{self.lang}",)
+        return ()
+
+    def as_dict(self) -> dict:
+        return {"interests": sorted(self.interests), "lang": self.lang, "vip_only": self.vip_only}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SearchRequest":
+        return cls(frozenset(data.get("interests", ())), data.get("lang"), data.get("vip_only", False))
+
+
+ANY_PARTNER = SearchRequest()
+
+
+def parse_search_request(args: Iterable[str]) -> SearchRequest:
+    """Разбор аргументов /find: ``/find ru музыка кино vip``"""
+    interests = set()
+    lang = None
+    vip_only = False
+    for arg in args:
+        tag = arg.lower().lstrip("#")
+        if tag == VIP_ONLY_TAG:
+            vip_only = True
+        elif tag in LANGUAGES and lang is None:
+            lang = tag
+        elif _INTEREST_PATTERN.match(tag) and len(interests) < MAX_INTERESTS:
+            interests.add(tag)
+    return SearchRequest(frozenset(interests), lang, vip_only)
+
+
+def entry_pools(request: SearchRequest) -> Tuple[Tuple[bool, str], ...]:
+    """Подкорзины (vip_only, язык), в которые попадает ожидающий: своего языка и общая"""
+    return (request.vip_only, request.lang or ""), (request.vip_only, ANY_LANG)
+
+
+def search_pools(request: SearchRequest, vip: bool) -> Tuple[Tuple[bool, str], ...]:
+    """Подкорзины, все кандидаты из которых проходят фильтры по языку и поиску только среди VIP"""
+    langs = (request.lang, "") if request.lang else (ANY_LANG,)
+    flags = (False, True) if vip else (False,)
+    return tuple((flag, lang) for flag in flags for lang in langs)
+
+
+def scan_depth(recent_size: int) -> int:
+    """Глубина просмотра подкорзины.
+
+    В подходящей подкорзине несовместимы только сам пользователь и его
+    недавние собеседники, поэтому совместимый кандидат, если он есть,
+    найдётся среди первых ``recent_size + 2`` записей.
+    """
+    return max(SCAN_LIMIT, recent_size + 2)
+
+
+def is_compatible(
+    user_id: int,
+    vip: bool,
+    request: SearchRequest,
+    widened: bool,
+    candidate_id: int,
+    candidate_request: SearchRequest,
+    candidate_widened: bool,
+    recent: Iterable[int] = (),
+) -> bool:
+    """Подходят ли пользователи друг другу.
+
+    Разные указанные языки несовместимы всегда. Поиск только среди VIP
+    ограничивает кандидата. Недавних собеседников пропускаем, пока поиск
+    ни одного из двоих не расширен.
+    """
+    if candidate_id == user_id:
+        return False
+    if candidate_request.vip_only and not vip:
+        return False
+    if request.lang and candidate_request.lang and request.lang != candidate_request.lang:
+        return False
+    if not (widened or candidate_widened) and candidate_id in recent:
+        return False
+    return True
+
+
+class RecentPartners:
+    """Последние собеседники каждого пользователя в кольцевом буфере.
+
+    Для каждого пользователя хранится не больше ``size`` ID, а сами буферы
+    вытесняются по LRU сверх ``max_users`` пользователей.
+    """
+
+    def __init__(self, size: int = 5, max_users: int = 100000) -> None:
+        self.size = size
+        self.max_users = max_users
+        self._recent: "OrderedDict[int, Deque[int]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    def add(self, user_id: int, partner_id: int) -> None:
+        """Запоминание чата для обоих собеседников"""
+        for uid, other in ((user_id, partner_id), (partner_id, user_id)):
+            ring = self._recent.get(uid)
+            if ring is None:
+                ring = self._recent[uid] = deque(maxlen=self.size)
+            else:
+                self._recent.move_to_end(uid)
+            ring.append(other)
+        while len(self._recent) > self.max_users:
+            self._recent.popitem(last=False)
+
+    def of(self, user_id: int) -> Tuple[int, ...]:
+        return tuple(self._recent.get(user_id, ()))
+
+    def seen(self, user_id: int, partner_id: int) -> bool:
+        ring = self._recent.get(user_id)
+        return ring is not None and partner_id in ring
+
+
+class QueueEntry:
+    """Ожидающий в очереди пользователь"""
+
+    __slots__ = ("user_id", "tier", "request", "enqueued_at", "widened")
+
+    def __init__(self, user_id: int, tier: str, request: SearchRequest, enqueued_at: float) -> None:
+        self.user_id = user_id
+        self.tier = tier
+        self.request = request
+        self.enqueued_at = enqueued_at
+        # Поиск расширен: подойдёт собеседник без общих интересов и недавний
+        self.widened = False
+
+    @property
+    def vip(self) -> bool:
+        return self.tier == TIER_VIP
+
+
+class MatchQueue:
+    """Очередь поиска собеседника с приоритетом для VIP и корзинами по интересам.
+
+    Каждый ожидающий лежит в OrderedDict своего уровня {user_id: время
+    постановки} и в корзинах по ключам поиска (интересы или язык); без
+    ключей — в общей корзине уровня. Корзина делится на подкорзины по
+    vip_only и языку (см. ``entry_pools``), и поиск смотрит только те, где
+    кандидаты проходят жёсткие фильтры. Несовместимыми в них могут быть лишь
+    недавние собеседники, поэтому достаточно просмотреть первые
+    ``scan_depth`` записей каждой подкорзины: поиск стоит O(1) независимо от
+    длины очереди и не упирается в несовместимых в голове корзины. Из
+    подкорзин одной корзины выбирается дольше всех ждущий. Прождавший
+    ``widen_after`` секунд пользователь переходит и в общую корзину: его
+    поиск расширяется до любого совместимого собеседника, в том числе
+    недавнего.
+
+    VIP-пользователи извлекаются первыми, но после ``vip_burst`` подряд идущих
+    VIP (или если обычный пользователь ждёт дольше ``max_regular_wait`` секунд)
+    очередь отдаёт обычного пользователя, чтобы он не ждал бесконечно.
+    """
+
+    def __init__(
+        self,
+        vip_burst: int = 3,
+        max_regular_wait: float = 30.0,
+        widen_after: float = 20.0,
+        recent: Optional[RecentPartners] = None,
+    ) -> None:
+        self.vip_burst = vip_burst
+        self.max_regular_wait = max_regular_wait
+        self.widen_after = widen_after
+        self.recent = recent if recent is not None else RecentPartners()
+        self._tiers: Dict[str, "OrderedDict[int, float]"] = {tier: OrderedDict() for tier in TIERS}
+        self._open: Dict[str, Dict[Tuple[bool, str], "OrderedDict[int, None]"]] = {tier: {} for tier in TIERS}
+        self._buckets: Dict[Tuple[str, str], Dict[Tuple[bool, str], "OrderedDict[int, None]"]] = {}
+        self._unwidened: "OrderedDict[int, None]" = OrderedDict()  # В порядке постановки
+        self._entries: Dict[int, QueueEntry] = {}
+        self._vip_streak = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._entries
+
+    def __iter__(self) -> Iterator[int]:
+        for tier in TIERS:
+            yield from self._tiers[tier]
+
+    def depth(self, tier: str) -> int:
+        """Количество ожидающих на уровне"""
+        return len(self._tiers[tier])
+
+    def bucket_count(self) -> int:
+        """Количество непустых корзин по интересам и языкам"""
+        return len(self._buckets)
+
+    def entry(self, user_id: int) -> Optional[QueueEntry]:
+        return self._entries.get(user_id)
+
+    def push(
+        self,
+        user_id: int,
+        vip: bool = False,
+        request: SearchRequest = ANY_PARTNER,
+        enqueued_at: Optional[float] = None,
+    ) -> bool:
+        """Постановка в очередь. Возвращает False, если пользователь уже в очереди"""
+        if user_id in self._entries:
+            return False
+        tier = TIER_VIP if vip else TIER_REGULAR
+        entry = QueueEntry(user_id, tier, request, time.monotonic() if enqueued_at is None else enqueued_at)
+        self._entries[user_id] = entry
+        self._tiers[tier][user_id] = entry.enqueued_at
+        keys = request.bucket_keys()
+        for key in keys:
+            self._add(self._buckets.setdefault((tier, key), {}), entry, user_id)
+        if not keys:
+            self._add(self._open[tier], entry, user_id)
+        self._unwidened[user_id] = None
+        return True
+
+    def discard(self, user_id: int) -> bool:
+        """Отмена поиска. Возвращает True, если пользователь был в очереди"""
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return False
+        del self._tiers[entry.tier][user_id]
+        self._remove(self._open[entry.tier], entry, user_id)
+        self._unwidened.pop(user_id, None)
+        for key in entry.request.bucket_keys():
+            bucket = self._buckets[(entry.tier, key)]
+            self._remove(bucket, entry, user_id)
+            if not bucket:
+                del self._buckets[(entry.tier, key)]
+        return True
+
+    @staticmethod
+    def _add(bucket: Dict[Tuple[bool, str], "OrderedDict[int, None]"], entry: QueueEntry, user_id: int) -> None:
+        for pool in entry_pools(entry.request):
+            bucket.setdefault(pool, OrderedDict())[user_id] = None
+
+    @staticmethod
+    def _remove(bucket: Dict[Tuple[bool, str], "OrderedDict[int, None]"], entry: QueueEntry, user_id: int) -> None:
+        for pool in entry_pools(entry.request):
+            waiting = bucket.get(pool)
+            if waiting is None:
+                continue
+            waiting.pop(user_id, None)
+            if not waiting:
+                del bucket[pool]
+
+    def pop(
+        self,
+        user_id: int,
+        vip: bool = False,
+        request: SearchRequest = ANY_PARTNER,
+        widened: bool = False,
+    ) -> Optional[int]:
+        """Извлечение подходящего собеседника для ``user_id``.
+
+        Сначала просматриваются корзины по ключам поиска, общая корзина — только
+        если у пользователя нет ключей или его поиск расширен.
+        """
+        keys = request.bucket_keys()
+        search_open = widened or not keys
+        recent = self.recent.of(user_id)
+        pools = search_pools(request, vip)
+        depth = scan_depth(self.recent.size)
+        tiers = (TIER_VIP,) if request.vip_only else self._tier_order()
+        for tier in tiers:
+            buckets = [self._buckets.get((tier, key)) for key in keys]
+            if search_open:
+                buckets.append(self._open[tier])
+            for bucket in buckets:
+                if not bucket:
+                    continue
+                best: Optional[QueueEntry] = None
+                for pool in pools:
+                    for candidate_id in islice(bucket.get(pool, ()), depth):
+                        candidate = self._entries[candidate_id]
+                        if is_compatible(user_id, vip, request, widened,
+                                         candidate_id, candidate.request, candidate.widened, recent):
+                            if best is None or candidate.enqueued_at < best.enqueued_at:
+                                best = candidate
+                            break
+                if best is not None:
+                    self.discard(best.user_id)
+                    self._vip_streak = self._vip_streak + 1 if tier == TIER_VIP else 0
+                    return best.user_id
+        return None
+
+    def widen(self, now: Optional[float] = None) -> List[int]:
+        """Расширение поиска для ждущих дольше ``widen_after``. Возвращает их ID.
+
+        Пользователь с интересами попадает и в общую корзину, а недавние
+        собеседники перестают отсеиваться.
+        """
+        deadline = (time.monotonic() if now is None else now) - self.widen_after
+        widened = []
+        while self._unwidened:
+            user_id = next(iter(self._unwidened))
+            entry = self._entries[user_id]
+            if entry.enqueued_at > deadline:
+                break
+            del self._unwidened[user_id]
+            entry.widened = True
+            self._add(self._open[entry.tier], entry, user_id)
+            widened.append(user_id)
+        return widened
+
+    def _tier_order(self) -> tuple:
+        """Порядок обхода уровней с защитой обычных пользователей от голодания"""
+        regular = self._tiers[TIER_REGULAR]
+        if not regular or not self._tiers[TIER_VIP]:
+            return TIERS
+        if self._vip_streak >= self.vip_burst:
+            return TIER_REGULAR, TIER_VIP
+        oldest_wait = time.monotonic() - next(iter(regular.values()))
+        if oldest_wait >= self.max_regular_wait:
+            return TIER_REGULAR, TIER_VIP
+        return TIERS
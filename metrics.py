@@ -0,0 +1,228 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+
+# Границы корзин гистограмм задержки, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+GaugeValue = Union[float, Dict[LabelValues, float]]
+
+
+def _counter_name(name: str) -> str:
+    # Счётчик выводится с суффиксом _total в TYPE, HELP и значениях: иначе парсер разделит семейство
+    return name if name.endswith("_total") else f"{name}_total"
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    __slots__ = ("value",)
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+
+class Histogram:
+    """Гистограмма с заранее выделенными корзинами"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = LATENCY_BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Family:
+    """Набор метрик одного имени с разными значениями меток.
+
+    Дочерняя метрика создаётся один раз при первом обращении с новыми
+    метками, дальше ``labels`` — это только поиск в словаре.
+    """
+
+    def __init__(self, name: str, help_text: str, kind: str, label_names: Tuple[str, ...],
+                 factory: Callable[[], Any]) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.kind = kind
+        self.label_names = label_names
+        self._factory = factory
+        self._children: Dict[LabelValues, Any] = {}
+
+    def labels(self, *values: str) -> Any:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._factory()
+        return child
+
+    def render(self, lines: List[str]) -> None:
+        name = _counter_name(self.name) if self.kind == "counter" else self.name
+        lines.append(f"# HELP {name} {self.help_text}")
+        lines.append(f"# TYPE {name} {self.kind}")
+        for values, child in self._children.items():
+            if isinstance(child, Counter):
+                lines.append(f"{name}{_format_labels(self.label_names, values)} {child.value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(child.bounds, child.counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, values, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, values, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {child.count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, values)} {child.sum}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, values)} {child.count}")
+
+
+class CallbackGauge:
+    """Показатель, значение которого вычисляется в момент сбора"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], GaugeValue],
+                 label_names: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help_text = help_text
+        self.collect = collect
+        self.label_names = label_names
+
+    def render(self, lines: List[str]) -> None:
+        lines.append(f"# HELP {self.name} {self.help_text}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        value = self.collect()
+        if isinstance(value, dict):
+            for values, item in value.items():
+                lines.append(f"{self.name}{_format_labels(self.label_names, values)} {item}")
+        else:
+            lines.append(f"{self.name} {value}")
+
+
+class CallbackCounter(CallbackGauge):
+    """Счётчик, который ведёт сам объект (только растёт), читается в момент сбора"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], GaugeValue],
+                 label_names: Tuple[str, ...] = ()) -> None:
+        super().__init__(_counter_name(name), help_text, collect, label_names)
+
+
+class MetricsRegistry:
+    """Реестр метрик в текстовом формате Prometheus"""
+
+    def __init__(self) -> None:
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, help_text: str, label_names: Tuple[str, ...] = ()) -> Family:
+        return self._add(Family(name, help_text, "counter", label_names, Counter))
+
+    def histogram(self, name: str, help_text: str, label_names: Tuple[str, ...] = (),
+                  bounds: Tuple[float, ...] = LATENCY_BUCKETS) -> Family:
+        return self._add(Family(name, help_text, "histogram", label_names, lambda: Histogram(bounds)))
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], GaugeValue],
+              label_names: Tuple[str, ...] = ()) -> CallbackGauge:
+        return self._add(CallbackGauge(name, help_text, collect, label_names))
+
+    def callback_counter(self, name: str, help_text: str, collect: Callable[[], GaugeValue],
+                         label_names: Tuple[str, ...] = ()) -> CallbackCounter:
+        return self._add(CallbackCounter(name, help_text, collect, label_names))
+
+    def _add(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            metric.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Время работы обработчиков по имени функции"""
+
+    def __init__(self, latency: Family) -> None:
+        self.latency = latency
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        histogram = self.latency.labels(data["handler"].callback.__name__)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время и ошибки исходящих запросов к Bot API по методу"""
+
+    def __init__(self, latency: Family, errors: Family) -> None:
+        self.latency = latency
+        self.errors = errors
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Any, method: Any) -> Any:
+        api_method = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            self.errors.labels(api_method, type(e).__name__).inc()
+            raise
+        finally:
+            self.latency.labels(api_method).observe(time.perf_counter() - started)
+
+
+class EventLoopLagMonitor:
+    """Измерение задержки цикла событий по опозданию пробуждения"""
+
+    def __init__(self, lag: Family, interval: float = 0.5) -> None:
+        self.histogram = lag.labels()
+        self.interval = interval
+        self.last_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, loop.time() - expected)
+            self.histogram.observe(self.last_lag)
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import os
+import re
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Виды правил в файле модерации: ``<вид> <значение>`` в каждой строке
+RULE_URL = "url"  # Любые ссылки http(s):// и www. (значение — ``*``)
+RULE_DOMAIN = "domain"  # Домен со всеми поддоменами, в том числе без http: ``t.me``
+RULE_TLD = "tld"  # Любой домен в зоне: ``com`` ловит ``example.com``
+RULE_MENTION = "mention"  # Упоминание @username; ``*`` — любое
+RULE_WORD = "word"  # Слово целиком; ``казин*`` — все слова с этим началом
+RULE_KINDS = (RULE_URL, RULE_DOMAIN, RULE_TLD, RULE_MENTION, RULE_WORD)
+WILDCARD = "*"
+
+# Правила на случай, если файла нет: прежний запрет ссылок
+DEFAULT_RULES = ((RULE_URL, WILDCARD),)
+
+
+class Violation(NamedTuple):
+    """Первое нарушение в тексте"""
+    kind: str
+    fragment: str
+
+
+def _trie_pattern(values: Iterable[str]) -> str:
+    """Регулярное выражение для набора строк, свёрнутого в префиксное дерево.
+
+    Ветви каждого узла начинаются с разных символов, поэтому движок
+    отбрасывает неподходящие по первому символу, и стоимость проверки позиции
+    зависит от длины строк, а не от их числа. Строка с ``*`` на конце
+    совпадает с любым продолжением из букв.
+    """
+    trie: Dict[str, dict] = {}
+    for value in values:
+        node = trie
+        for char in value:
+            node = node.setdefault(char, {})
+        node[""] = {}
+    return _node_pattern(trie)
+
+
+def _node_pattern(node: Dict[str, dict]) -> str:
+    branches = []
+    optional = False
+    for char in sorted(node):
+        if char == "":
+            optional = True
+        elif char == WILDCARD:
+            branches.append(r"\w*")
+        else:
+            branches.append(re.escape(char) + _node_pattern(node[char]))
+    if not branches:
+        return ""
+    if len(branches) == 1 and not optional:
+        return branches[0]
+    body = branches[0] if len(branches) == 1 and len(branches[0]) == 1 else f"(?:{'|'.join(branches)})"
+    return f"{body}?" if optional else body
+
+
+def parse_rules(lines: Iterable[str]) -> List[Tuple[str, str]]:
+    """Разбор файла правил. Пустые строки и комментарии (#) пропускаются"""
+    rules = []
+    for number, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        kind, _, value = line.partition(" ")
+        kind, value = kind.lower(), value.strip().lower()
+        if kind not in RULE_KINDS or not value:
+            logger.warning("Строка %d правил модерации пропущена: %r", number, line)
+            continue
+        rules.append((kind, value))
+    return rules
+
+
+def compile_rules(rules: Iterable[Tuple[str, str]]) -> Optional[Pattern[str]]:
+    """Все правила в одном выражении с именованной группой на каждый вид"""
+    values: Dict[str, List[str]] = {kind: [] for kind in RULE_KINDS}
+    for kind, value in rules:
+        values[kind].append(value.lstrip("@").rstrip(".") if kind != RULE_WORD else value)
+
+    parts = []
+    if values[RULE_URL]:
+        parts.append(rf"(?P<{RULE_URL}>\b(?:https?://|www\.)\S+)")
+    if values[RULE_DOMAIN]:
+        parts.append(rf"(?P<{RULE_DOMAIN}>(?<![\w.-])(?:[\w-]+\.)*{_trie_pattern(values[RULE_DOMAIN])}(?![\w-]))")
+    if values[RULE_TLD]:
+        parts.append(rf"(?P<{RULE_TLD}>(?<![\w.-])[\w-]+(?:\.[\w-]+)*\.{_trie_pattern(values[RULE_TLD])}(?![\w.-]))")
+    if values[RULE_MENTION]:
+        names = r"\w{4,32}" if WILDCARD in values[RULE_MENTION] else _trie_pattern(values[RULE_MENTION])
+        parts.append(rf"(?P<{RULE_MENTION}>(?<![\w@])@{names}(?!\w))")
+    if values[RULE_WORD]:
+        parts.append(rf"(?P<{RULE_WORD}>\b{_trie_pattern(values[RULE_WORD])}\b)")
+    if not parts:
+        return None
+    return re.compile("|".join(parts), re.IGNORECASE)
+
+
+class Moderator:
+    """Проверка текста и подписей по правилам из файла.
+
+    Все правила собираются в одно регулярное выражение: строки доменов, слов
+    и упоминаний свёрнуты в префиксные деревья, поэтому проверка сообщения —
+    один проход ``search`` со стоимостью, почти не зависящей от числа правил.
+    Файл перечитывается при изменении времени модификации без перезапуска
+    бота; выражение заменяется целиком, а при ошибке остаются прежние правила.
+    """
+
+    def __init__(self, path: Optional[str] = None, reload_interval: float = 5.0) -> None:
+        self.path = path
+        self.reload_interval = reload_interval
+        self._pattern = compile_rules(DEFAULT_RULES)
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+        self.rule_count = len(DEFAULT_RULES)
+        self.reloads = 0
+
+    def check(self, text: Optional[str]) -> Optional[Violation]:
+        """Первое нарушение в тексте или None"""
+        if not text or self._pattern is None:
+            return None
+        match = self._pattern.search(text)
+        if match is None:
+            return None
+        return Violation(match.lastgroup, match.group())
+
+    def load_rules(self, rules: Iterable[Tuple[str, str]]) -> None:
+        rules = list(rules)
+        self._pattern = compile_rules(rules)
+        self.rule_count = len(rules)
+
+    def reload(self) -> bool:
+        """Перечитывание файла, если он изменился. Возвращает True, если правила обновлены"""
+        if not self.path:
+            return False
+        mtime = None
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self._mtime:
+                return False
+            with open(self.path, encoding="utf-8") as rules_file:
+                rules = parse_rules(rules_file)
+            pattern = compile_rules(rules)
+        except FileNotFoundError:
+            if self._mtime is None:
+                logger.warning("Файл правил модерации %s не найден, действуют правила по умолчанию", self.path)
+                self._mtime = 0.0
+            return False
+        except (OSError, UnicodeDecodeError, re.error) as e:
+            logger.error("Не удалось загрузить правила модерации из %s: %s", self.path, e)
+            # Не повторяем ошибку до следующего изменения файла
+            self._mtime = mtime
+            return False
+        self._pattern = pattern
+        self._mtime = mtime
+        self.rule_count = len(rules)
+        self.reloads += 1
+        logger.info("Загружено правил модерации: %d", len(rules))
+        return True
+
+    def start(self) -> None:
+        self.reload()
+        if self.path and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            # Сборка выражения для тысяч правил занимает заметное время: вне цикла событий
+            await asyncio.to_thread(self.reload)
@@ -0,0 +1,60 @@
+import asyncio
+import logging
+from typing import Any
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import GetUpdates
+
+logger = logging.getLogger(__name__)
+
+# Больше Telegram не отдаёт за один getUpdates
+MAX_BATCH = 100
+
+
+class UpdateBatchLimit(BaseRequestMiddleware):
+    """Размер пачки обновлений в getUpdates.
+
+    ``start_polling`` не принимает ``limit``, поэтому он подставляется в
+    запрос по пути в сеть. Меньшая пачка быстрее подтверждается и при
+    перезапуске меньше обновлений обрабатывается повторно.
+    """
+
+    def __init__(self, limit: int = MAX_BATCH) -> None:
+        self.limit = max(1, min(limit, MAX_BATCH))
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Any,
+        method: Any,
+    ) -> Any:
+        if isinstance(method, GetUpdates):
+            method.limit = self.limit
+        return await make_request(bot, method)
+
+
+async def poll_until_stopped(dispatcher: Dispatcher, bot: Bot, stop: asyncio.Event, **kwargs: Any) -> None:
+    """Один запуск polling до события ``stop`` или ошибки.
+
+    Сигналы обрабатывает вызывающий: он выставляет ``stop``, а остановка
+    идёт через ``stop_polling`` в этой же корутине, без отдельных задач.
+    Ошибка polling пробрасывается, чтобы вызывающий мог перезапустить его.
+    """
+    polling = asyncio.create_task(dispatcher.start_polling(bot, handle_signals=False, **kwargs))
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait((polling, stopped), return_when=asyncio.FIRST_COMPLETED)
+        if not polling.done():
+            try:
+                await dispatcher.stop_polling()
+            except RuntimeError:
+                # Polling ещё не успел запуститься
+                polling.cancel()
+        try:
+            await polling
+        except asyncio.CancelledError:
+            if not stop.is_set():
+                raise
+    finally:
+        stopped.cancel()
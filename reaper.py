@@ -0,0 +1,185 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+
+from session_backend import SessionBackend
+
+logger = logging.getLogger(__name__)
+
+QueueTimeoutCallback = Callable[[int], Awaitable[None]]
+IdleChatCallback = Callable[[int, int], Awaitable[None]]
+
+
+class ActivityReaper(BaseMiddleware):
+    """Снятие с поиска и завершение чатов пользователей, переставших отвечать.
+
+    Как внешний middleware запоминает время последнего обновления каждого
+    пользователя в словаре {user_id: время}. Проверки запланированы через
+    min-кучу: у каждого отслеживаемого пользователя в ней одна запись, и
+    фоновая очистка извлекает только наступившие сроки. Если пользователь
+    с тех пор был активен, запись возвращается в кучу с новым сроком
+    (ленивое переприсваивание), поэтому обновление активности — O(1), а
+    стоимость очистки пропорциональна числу истёкших сроков.
+
+    Пользователь в очереди дольше ``queue_timeout`` секунд без активности
+    снимается с поиска; чат, в котором оба собеседника молчат дольше
+    ``idle_timeout`` секунд, завершается. Пользователь не в чате и не в
+    очереди перестаёт отслеживаться до следующего обновления.
+    """
+
+    def __init__(
+        self,
+        sessions: SessionBackend,
+        queue_timeout: float = 600.0,
+        idle_timeout: float = 1800.0,
+        interval: float = 10.0,
+        on_queue_timeout: Optional[QueueTimeoutCallback] = None,
+        on_idle_chat: Optional[IdleChatCallback] = None,
+    ) -> None:
+        self.sessions = sessions
+        self.queue_timeout = queue_timeout
+        self.idle_timeout = idle_timeout
+        self.interval = interval
+        self.on_queue_timeout = on_queue_timeout
+        self.on_idle_chat = on_idle_chat
+        self._first_check = min(queue_timeout, idle_timeout)
+        self._last: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._dirty: Dict[int, float] = {}  # Активность для общего бэкенда, ещё не записанная
+        self._task: Optional[asyncio.Task] = None
+        self.reclaimed_waiting = 0
+        self.reclaimed_sessions = 0
+
+    def __len__(self) -> int:
+        return len(self._last)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            self.touch(user.id)
+        return await handler(event, data)
+
+    def touch(self, user_id: int, now: Optional[float] = None) -> None:
+        """Отметка активности пользователя"""
+        now = time.time() if now is None else now
+        if user_id not in self._last:
+            heapq.heappush(self._heap, (now + self._first_check, user_id))
+        self._last[user_id] = now
+        if self.sessions.shared:
+            self._dirty[user_id] = now
+
+    def track(self, user_ids: Iterable[int]) -> None:
+        """Отслеживание пользователей из восстановленного состояния, как будто они только что были активны"""
+        now = time.time()
+        for user_id in user_ids:
+            if user_id not in self._last:
+                self.touch(user_id, now)
+
+    async def sweep(self, now: Optional[float] = None) -> int:
+        """Проверка наступивших сроков. Возвращает число снятых с поиска и завершённых чатов"""
+        now = time.time() if now is None else now
+        reclaimed = 0
+        while self._heap and self._heap[0][0] <= now:
+            _, user_id = heapq.heappop(self._heap)
+            try:
+                reclaimed += await self._check(user_id, now)
+            except Exception as e:
+                # Проверим снова в следующий раз
+                heapq.heappush(self._heap, (now + self.interval, user_id))
+                logger.warning("Не удалось проверить активность %s: %s", user_id, e)
+                break
+        return reclaimed
+
+    async def _check(self, user_id: int, now: float) -> int:
+        partner_id = await self.sessions.partner_of(user_id)
+        if partner_id is not None:
+            deadline = await self._last_seen(user_id, partner_id) + self.idle_timeout
+            if deadline > now:
+                heapq.heappush(self._heap, (deadline, user_id))
+                return 0
+            del self._last[user_id]
+            # Чат мог завершить другой воркер: уведомляет тот, чей unpair удался
+            partner_id = await self.sessions.unpair(user_id)
+            if partner_id is None:
+                return 0
+            self.reclaimed_sessions += 1
+            if self.on_idle_chat is not None:
+                await self._notify(self.on_idle_chat, user_id, partner_id)
+            return 1
+
+        if await self.sessions.is_waiting(user_id):
+            deadline = await self._last_seen(user_id) + self.queue_timeout
+            if deadline > now:
+                heapq.heappush(self._heap, (deadline, user_id))
+                return 0
+            del self._last[user_id]
+            if not await self.sessions.cancel_search(user_id):
+                return 0
+            self.reclaimed_waiting += 1
+            if self.on_queue_timeout is not None:
+                await self._notify(self.on_queue_timeout, user_id)
+            return 1
+
+        del self._last[user_id]
+        return 0
+
+    async def _last_seen(self, *user_ids: int) -> float:
+        """Последняя активность любого из пользователей, с учётом других воркеров"""
+        last = max(self._last.get(user_id, 0.0) for user_id in user_ids)
+        if self.sessions.shared:
+            remote = await self.sessions.last_activity(list(user_ids))
+            last = max([last, *remote.values()])
+        return last
+
+    async def _notify(self, callback: Callable[..., Awaitable[None]], *user_ids: int) -> None:
+        try:
+            await callback(*user_ids)
+        except Exception as e:
+            logger.warning("Не удалось уведомить %s о неактивности: %s", user_ids, e)
+
+    async def flush_activity(self) -> None:
+        """Запись накопленной активности в общий бэкенд"""
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        try:
+            await self.sessions.record_activity(batch)
+        except Exception as e:
+            # Возвращаем, не затирая более свежие отметки
+            batch.update(self._dirty)
+            self._dirty = batch
+            logger.warning("Не удалось записать активность пользователей: %s", e)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_activity()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush_activity()
+            reclaimed = await self.sweep()
+            if reclaimed:
+                logger.info(
+                    "Очистка неактивных: освобождено %d (всего снято с поиска %d, завершено чатов %d)",
+                    reclaimed, self.reclaimed_waiting, self.reclaimed_sessions
+                )
@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Iterator, List, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: чем меньше номер, тем раньше отправка
+LANE_RELAY = 0  # Пересылка сообщений между собеседниками
+LANE_NOTICE = 1  # Служебные уведомления пользователям
+LANE_ADMIN = 2  # Зеркалирование администратору
+LANE_BULK = 3  # Массовые рассылки
+LANES = (LANE_RELAY, LANE_NOTICE, LANE_ADMIN, LANE_BULK)
+
+current_lane: ContextVar[int] = ContextVar("current_lane", default=LANE_NOTICE)
+
+
+@contextmanager
+def send_lane(lane: int) -> Iterator[None]:
+    """Отправка всех запросов внутри блока в указанной полосе"""
+    token = current_lane.set(lane)
+    try:
+        yield
+    finally:
+        current_lane.reset(token)
+
+
+class SendQueueFull(Exception):
+    """Очередь отправки переполнена, запрос отброшен"""
+
+
+class TokenBucket:
+    """Ведро токенов с непрерывным пополнением"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: float, capacity: float, now: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.paused_until = 0.0
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен"""
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API.
+
+    Все запросы с ``chat_id`` проходят через общее ведро токенов (глобальный
+    лимит Telegram) и ведро конкретного чата. Ожидающие запросы обслуживаются
+    по полосам приоритета, глубина каждой полосы ограничена. На ``RetryAfter``
+    чат ставится на паузу на указанное время, и запрос повторяется.
+    """
+
+    # Сколько запросов в голове полосы просматривается в поисках свободного чата
+    SCAN_DEPTH = 32
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        chat_burst: float = 3.0,
+        max_queue: int = 5000,
+        max_retries: int = 3,
+        max_chat_buckets: int = 50000,
+    ) -> None:
+        now = time.monotonic()
+        self.global_bucket = TokenBucket(global_rate, global_rate, now)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.max_chat_buckets = max_chat_buckets
+        self._chats: "OrderedDict[int | str, TokenBucket]" = OrderedDict()  # В порядке LRU
+        self._lanes: List[Deque[Tuple[Any, asyncio.Future]]] = [deque() for _ in LANES]
+        self._wakeup = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.retried = 0
+        self.rejected = 0
+
+    def queue_depth(self, lane: int) -> int:
+        return len(self._lanes[lane])
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType,
+        bot: Any,
+        method: Any,
+    ) -> Any:
+        chat_id = getattr(method, "chat_id", None)
+        lane = current_lane.get()
+        attempt = 0
+        while True:
+            if chat_id is not None:
+                await self._acquire(chat_id, lane)
+            try:
+                result = await make_request(bot, method)
+                self.sent += 1
+                return result
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                self.retried += 1
+                self._pause(chat_id, e.retry_after)
+                logger.warning(
+                    "RetryAfter %s сек для %s (чат %s), попытка %d",
+                    e.retry_after, method.__api_method__, chat_id, attempt
+                )
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+
+    def _pause(self, chat_id: Any, retry_after: float) -> None:
+        """Пауза чата (или всех отправок) на время из ответа Telegram"""
+        now = time.monotonic()
+        bucket = self.global_bucket if chat_id is None else self._bucket(chat_id, now)
+        bucket.paused_until = max(bucket.paused_until, now + retry_after)
+        bucket.tokens = 0
+
+    def _bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        """Ведро чата. Сверх ``max_chat_buckets`` вытесняется давно не использованное, O(1)"""
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            while len(self._chats) >= self.max_chat_buckets:
+                self._chats.popitem(last=False)
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id: Any, lane: int) -> None:
+        now = time.monotonic()
+        chat_bucket = self._bucket(chat_id, now)
+        # Быстрый путь: очередь пуста и оба ведра готовы
+        if not any(self._lanes) and self.global_bucket.delay(now) == 0 and chat_bucket.delay(now) == 0:
+            self.global_bucket.take()
+            chat_bucket.take()
+            return
+
+        queue = self._lanes[lane]
+        if len(queue) >= self.max_queue:
+            self.rejected += 1
+            raise SendQueueFull(f"Очередь отправки {lane} переполнена")
+
+        future = asyncio.get_running_loop().create_future()
+        queue.append((chat_id, future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        self._wakeup.set()
+        await future
+
+    async def _pump(self) -> None:
+        """Выдача токенов ожидающим запросам в порядке приоритета"""
+        while any(self._lanes):
+            now = time.monotonic()
+            wait = self.global_bucket.delay(now)
+            if wait == 0:
+                wait = self._grant_next(now)
+                if wait == 0:
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    def _grant_next(self, now: float) -> float:
+        """Выдать токен первому готовому запросу. Возвращает время ожидания, если таких нет"""
+        min_wait = float("inf")
+        for queue in self._lanes:
+            index = 0
+            while index < len(queue) and index < self.SCAN_DEPTH:
+                chat_id, future = queue[index]
+                if future.done():  # Запрос отменён, пока ждал
+                    del queue[index]
+                    continue
+                bucket = self._bucket(chat_id, now)
+                wait = bucket.delay(now)
+                if wait == 0:
+                    del queue[index]
+                    self.global_bucket.take()
+                    bucket.take()
+                    future.set_result(None)
+                    return 0.0
+                min_wait = min(min_wait, wait)
+                index += 1
+        return min_wait if min_wait != float("inf") else 0.0
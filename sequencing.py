@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+
+
+class _UserSlot:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self) -> None:
+        self.lock = asyncio.Lock()
+        self.refs = 0
+
+
+class UserSequencer(BaseMiddleware):
+    """Последовательная обработка обновлений одного пользователя.
+
+    Обновления разных пользователей обрабатываются параллельно, а обновления
+    одного пользователя — строго по очереди в порядке поступления (asyncio.Lock
+    отдаёт блокировку ожидающим по порядку). Блокировка существует, только
+    пока у пользователя есть обновления в обработке.
+    """
+
+    def __init__(self) -> None:
+        self._slots: Dict[int, _UserSlot] = {}
+        self.waited = 0
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        slot = self._slots.get(user.id)
+        if slot is None:
+            slot = self._slots[user.id] = _UserSlot()
+        elif slot.lock.locked():
+            self.waited += 1
+        slot.refs += 1
+        try:
+            async with slot.lock:
+                return await handler(event, data)
+        finally:
+            slot.refs -= 1
+            if not slot.refs:
+                del self._slots[user.id]
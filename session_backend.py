@@ -0,0 +1,1251 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from matchmaking import (
+    ANY_LANG,
+    ANY_PARTNER,
+    TIER_REGULAR,
+    TIER_VIP,
+    TIERS,
+    MatchQueue,
+    RecentPartners,
+    SearchRequest,
+    is_compatible,
+    scan_depth,
+    search_pools,
+)
+from storage import NS_ACTIVE, NS_WAITING, State, StateStore
+
+logger = logging.getLogger(__name__)
+
+# Значение кэша «пользователь не в чате» отличается от отсутствия записи
+_MISSING = object()
+
+Pair = Tuple[int, int]
+MatchCallback = Callable[[int, int], Awaitable[None]]
+
+
+class PartnerCache:
+    """Локальный кэш собеседников для пути пересылки.
+
+    Хранит и положительные ответы (ID собеседника), и отрицательные (не в
+    чате). Записи сбрасываются по уведомлениям других воркеров, а ``ttl``
+    ограничивает срок жизни записи, если уведомление потерялось. Счётчик
+    ``epoch`` растёт при каждой инвалидации: ответ бэкенда, полученный до
+    неё, в кэш не попадает.
+    """
+
+    def __init__(self, max_size: int = 100000, ttl: float = 30.0) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[int, float]]" = OrderedDict()  # {user_id: (partner_id или 0, истекает)}
+        self.epoch = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int) -> Any:
+        """ID собеседника, None (не в чате) или _MISSING, если ответа в кэше нет"""
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] <= time.monotonic():
+            self.misses += 1
+            return _MISSING
+        self.hits += 1
+        return entry[0] or None
+
+    def peek(self, user_id: int) -> Optional[int]:
+        """Собеседник из кэша без учёта статистики и срока жизни"""
+        entry = self._entries.get(user_id)
+        return (entry[0] or None) if entry is not None else None
+
+    def set(self, user_id: int, partner_id: Optional[int], epoch: Optional[int] = None) -> None:
+        """Запоминание ответа. Если с момента запроса ``epoch`` изменился, ответ мог устареть"""
+        if epoch is not None and epoch != self.epoch:
+            self._entries.pop(user_id, None)
+            return
+        self._entries[user_id] = (partner_id or 0, time.monotonic() + self.ttl)
+        self._entries.move_to_end(user_id)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        self.epoch += 1
+        for user_id in user_ids:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        self.epoch += 1
+        self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class SessionBackend(ABC):
+    """Состояние чатов и очереди поиска.
+
+    Все изменяющие операции атомарны: ``pair`` создаёт чат, только если оба
+    пользователя свободны, ``match`` извлекает собеседника из очереди и
+    создаёт чат (или ставит пользователя в очередь) одной операцией, даже
+    если с бэкендом работают несколько процессов.
+    """
+
+    # Состояние общее для нескольких воркеров и живёт вне процесса
+    shared = False
+
+    def __init__(self, on_match: Optional[MatchCallback] = None, widen_interval: float = 5.0) -> None:
+        self.on_match = on_match
+        self.widen_interval = widen_interval
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self) -> None:
+        self._tasks.append(asyncio.create_task(self._widen_loop()))
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _widen_loop(self) -> None:
+        """Периодическое расширение поиска и уведомление о созданных при этом чатах"""
+        while True:
+            await asyncio.sleep(self.widen_interval)
+            try:
+                pairs = await self.widen()
+            except Exception as e:
+                logger.warning("Не удалось расширить поиск: %s", e)
+                continue
+            for user_id, partner_id in pairs:
+                if self.on_match is None:
+                    continue
+                try:
+                    await self.on_match(user_id, partner_id)
+                except Exception as e:
+                    logger.error("Ошибка уведомления о чате %s-%s: %s", user_id, partner_id, e, exc_info=True)
+
+    def restore(self, state: State) -> None:
+        """Загрузка состояния из хранилища бота (только для локального бэкенда)"""
+
+    @abstractmethod
+    async def partner_of(self, user_id: int) -> Optional[int]:
+        """ID собеседника или None, если пользователь не в чате"""
+
+    @abstractmethod
+    async def is_waiting(self, user_id: int) -> bool:
+        """Находится ли пользователь в очереди поиска"""
+
+    @abstractmethod
+    async def pair(self, user_id: int, partner_id: int) -> bool:
+        """Создание чата. False, если кто-то из пользователей уже в чате"""
+
+    @abstractmethod
+    async def unpair(self, user_id: int) -> Optional[int]:
+        """Удаление чата пользователя. Возвращает ID бывшего собеседника"""
+
+    @abstractmethod
+    async def match(self, user_id: int, vip: bool = False, request: SearchRequest = ANY_PARTNER) -> Optional[int]:
+        """Подбор собеседника из очереди или постановка в очередь, если подходящих нет"""
+
+    @abstractmethod
+    async def widen(self) -> List[Pair]:
+        """Расширение поиска долго ждущих. Возвращает созданные при этом чаты"""
+
+    @abstractmethod
+    async def cancel_search(self, user_id: int) -> bool:
+        """Удаление пользователя из очереди поиска"""
+
+    @abstractmethod
+    async def active_user_ids(self) -> List[int]:
+        """Все пользователи в чатах"""
+
+    @abstractmethod
+    async def waiting_user_ids(self) -> List[int]:
+        """Все пользователи в очереди поиска"""
+
+    @abstractmethod
+    def cached_partner(self, user_id: int) -> Optional[int]:
+        """Собеседник, известный этому процессу, без обращения к бэкенду"""
+
+    @abstractmethod
+    def pair_count(self) -> int:
+        """Количество чатов (для общего бэкенда — на момент последней синхронизации)"""
+
+    @abstractmethod
+    def queue_depth(self, tier: Optional[str] = None) -> int:
+        """Длина очереди уровня или всей очереди"""
+
+    def is_engaged(self, user_id: int) -> bool:
+        """Участвует ли пользователь в чате или поиске, насколько известно процессу"""
+        return self.cached_partner(user_id) is not None
+
+    # Duo ссылки: локальный бэкенд полагается на реестр процесса,
+    # общий публикует ссылки, чтобы их мог принять любой воркер
+    async def publish_link(self, token: str, creator_id: int, expires_at: float) -> None:
+        pass
+
+    async def lookup_link(self, token: str) -> Optional[int]:
+        return None
+
+    async def drop_link(self, token: str) -> None:
+        pass
+
+    # VIP подписки: локальный бэкенд полагается на реестр процесса, общий хранит
+    # сроки подписок, чтобы выдачу, продление и отзыв видели все воркеры
+    async def publish_vip(self, user_id: int, expires_at: float) -> None:
+        pass
+
+    async def extend_vip(self, user_id: int, seconds: float) -> Optional[float]:
+        """Продление от срока в бэкенде. None — бэкенд подписки не хранит"""
+        return None
+
+    async def drop_vip(self, user_id: int, expired_before: Optional[float] = None) -> bool:
+        """Удаление подписки (если задан ``expired_before`` — только истёкшей к этому времени)"""
+        return False
+
+    async def vip_subscriptions(self) -> Dict[int, float]:
+        return {}
+
+    # Последняя активность пользователей: общий бэкенд хранит её, чтобы воркер
+    # не счёл неактивным пользователя, чьи обновления обрабатывает другой воркер
+    async def record_activity(self, activity: Dict[int, float]) -> None:
+        pass
+
+    async def last_activity(self, user_ids: List[int]) -> Dict[int, float]:
+        return {}
+
+
+class LocalSessionBackend(SessionBackend):
+    """Состояние в памяти процесса с сохранением через хранилище бота.
+
+    Методы не содержат await, поэтому в asyncio каждый из них атомарен:
+    проверка и изменение не могут перемежаться с другими задачами.
+    """
+
+    def __init__(self, store: StateStore, queue: MatchQueue, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.store = store
+        self.queue = queue
+        self._partners: Dict[int, int] = {}
+
+    def restore(self, state: State) -> None:
+        for uid, partner_id in state.get(NS_ACTIVE, {}).items():
+            self._partners[int(uid)] = partner_id
+        waiting = sorted(state.get(NS_WAITING, {}).items(), key=lambda item: item[1]["ts"])
+        for uid, entry in waiting:
+            self.queue.push(int(uid), vip=entry["vip"], request=SearchRequest.from_dict(entry.get("search", {})))
+
+    async def partner_of(self, user_id: int) -> Optional[int]:
+        return self._partners.get(user_id)
+
+    async def is_waiting(self, user_id: int) -> bool:
+        return user_id in self.queue
+
+    async def pair(self, user_id: int, partner_id: int) -> bool:
+        return self._pair(user_id, partner_id)
+
+    async def unpair(self, user_id: int) -> Optional[int]:
+        partner_id = self._partners.pop(user_id, None)
+        if partner_id is None:
+            return None
+        self._partners.pop(partner_id, None)
+        self.store.delete(NS_ACTIVE, user_id)
+        self.store.delete(NS_ACTIVE, partner_id)
+        return partner_id
+
+    async def match(self, user_id: int, vip: bool = False, request: SearchRequest = ANY_PARTNER) -> Optional[int]:
+        if user_id in self._partners:
+            return None
+        while True:
+            partner_id = self.queue.pop(user_id, vip=vip, request=request)
+            if partner_id is None:
+                if self.queue.push(user_id, vip=vip, request=request):
+                    self.store.put(NS_WAITING, user_id, {"vip": vip, "ts": time.time(), "search": request.as_dict()})
+                return None
+            self.store.delete(NS_WAITING, partner_id)
+            if self._pair(user_id, partner_id):
+                return partner_id
+
+    async def widen(self) -> List[Pair]:
+        pairs = []
+        for user_id in self.queue.widen():
+            entry = self.queue.entry(user_id)
+            if entry is None:
+                continue
+            partner_id = self.queue.pop(user_id, vip=entry.vip, request=entry.request, widened=True)
+            if partner_id is not None:
+                self.store.delete(NS_WAITING, partner_id)
+                if self._pair(user_id, partner_id):
+                    pairs.append((user_id, partner_id))
+        return pairs
+
+    async def cancel_search(self, user_id: int) -> bool:
+        if not self.queue.discard(user_id):
+            return False
+        self.store.delete(NS_WAITING, user_id)
+        return True
+
+    async def active_user_ids(self) -> List[int]:
+        return list(self._partners)
+
+    async def waiting_user_ids(self) -> List[int]:
+        return list(self.queue)
+
+    def cached_partner(self, user_id: int) -> Optional[int]:
+        return self._partners.get(user_id)
+
+    def pair_count(self) -> int:
+        return len(self._partners) // 2
+
+    def queue_depth(self, tier: Optional[str] = None) -> int:
+        return len(self.queue) if tier is None else self.queue.depth(tier)
+
+    def is_engaged(self, user_id: int) -> bool:
+        return user_id in self._partners or user_id in self.queue
+
+    def _pair(self, user_id: int, partner_id: int) -> bool:
+        if user_id == partner_id or user_id in self._partners or partner_id in self._partners:
+            return False
+        for uid in (user_id, partner_id):
+            if self.queue.discard(uid):
+                self.store.delete(NS_WAITING, uid)
+        self._partners[user_id] = partner_id
+        self._partners[partner_id] = user_id
+        self.queue.recent.add(user_id, partner_id)
+        self.store.put(NS_ACTIVE, user_id, partner_id)
+        self.store.put(NS_ACTIVE, partner_id, user_id)
+        return True
+
+
+class SharedSessionBackend(SessionBackend):
+    """Общее состояние нескольких воркеров с локальным кэшем собеседников.
+
+    ``partner_of`` обслуживается из ``PartnerCache``; промах читает бэкенд.
+    Изменения, сделанные этим воркером, сразу попадают в кэш, изменения
+    других воркеров сбрасывают записи через механизм уведомлений бэкенда.
+    Счётчики для метрик обновляются фоновой синхронизацией раз в
+    ``stats_interval`` секунд.
+    """
+
+    shared = True
+
+    def __init__(
+        self,
+        vip_burst: int = 3,
+        max_regular_wait: float = 30.0,
+        cache_size: int = 100000,
+        cache_ttl: float = 30.0,
+        stats_interval: float = 5.0,
+        widen_after: float = 20.0,
+        recent_size: int = 5,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.vip_burst = vip_burst
+        self.max_regular_wait = max_regular_wait
+        self.stats_interval = stats_interval
+        self.widen_after = widen_after
+        self.recent_size = recent_size
+        self.cache = PartnerCache(cache_size, cache_ttl)
+        # Свои изменения воркер сразу вносит в кэш, уведомления о них пропускаются
+        self.origin = uuid.uuid4().hex
+        self._pairs = 0
+        self._depths: Dict[str, int] = {tier: 0 for tier in TIERS}
+
+    async def start(self) -> None:
+        await super().start()
+        await self._refresh_stats()
+        self._tasks.append(asyncio.create_task(self._sync_stats()))
+
+    async def partner_of(self, user_id: int) -> Optional[int]:
+        cached = self.cache.get(user_id)
+        if cached is not _MISSING:
+            return cached
+        epoch = self.cache.epoch
+        partner_id = await self._fetch_partner(user_id)
+        self.cache.set(user_id, partner_id, epoch)
+        return partner_id
+
+    async def pair(self, user_id: int, partner_id: int) -> bool:
+        epoch = self.cache.epoch
+        if not await self._pair(user_id, partner_id):
+            return False
+        self._remember(user_id, partner_id, epoch)
+        return True
+
+    async def unpair(self, user_id: int) -> Optional[int]:
+        partner_id = await self._unpair(user_id)
+        self.cache.set(user_id, None)
+        if partner_id is not None:
+            self.cache.set(partner_id, None)
+        return partner_id
+
+    async def match(self, user_id: int, vip: bool = False, request: SearchRequest = ANY_PARTNER) -> Optional[int]:
+        epoch = self.cache.epoch
+        partner_id = await self._match(user_id, vip, request)
+        if partner_id is not None:
+            self._remember(user_id, partner_id, epoch)
+        return partner_id
+
+    async def widen(self) -> List[Pair]:
+        epoch = self.cache.epoch
+        pairs = await self._widen()
+        for user_id, partner_id in pairs:
+            self._remember(user_id, partner_id, epoch)
+        return pairs
+
+    def cached_partner(self, user_id: int) -> Optional[int]:
+        return self.cache.peek(user_id)
+
+    def pair_count(self) -> int:
+        return self._pairs
+
+    def queue_depth(self, tier: Optional[str] = None) -> int:
+        return sum(self._depths.values()) if tier is None else self._depths[tier]
+
+    def _remember(self, user_id: int, partner_id: int, epoch: int) -> None:
+        self.cache.set(user_id, partner_id, epoch)
+        self.cache.set(partner_id, user_id, epoch)
+
+    async def _sync_stats(self) -> None:
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            try:
+                await self._refresh_stats()
+            except Exception as e:
+                logger.warning("Не удалось обновить статистику чатов: %s", e)
+
+    @abstractmethod
+    async def _fetch_partner(self, user_id: int) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def _pair(self, user_id: int, partner_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def _unpair(self, user_id: int) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def _match(self, user_id: int, vip: bool, request: SearchRequest) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    async def _widen(self) -> List[Pair]:
+        pass
+
+    @abstractmethod
+    async def _refresh_stats(self) -> None:
+        pass
+
+
+class SQLiteSessionBackend(SharedSessionBackend):
+    """Общее состояние в файле SQLite для нескольких процессов на одной машине.
+
+    Каждая операция — транзакция ``BEGIN IMMEDIATE``, которая берёт блокировку
+    записи сразу и поэтому сериализует изменения между процессами. Изменённые
+    пользователи записываются в таблицу ``changes``; каждый воркер опрашивает
+    её раз в ``poll_interval`` секунд и сбрасывает их из своего кэша.
+    Корзины поиска — таблица ``queue_pools`` с индексами по (уровень, ключ,
+    vip_only, язык) и по (уровень, ключ, vip_only): запрос к подкорзине
+    сразу отсекает кандидатов, не проходящих фильтры по языку и vip_only.
+    """
+
+    # Сколько последних изменений хранить для отстающих воркеров
+    CHANGES_KEPT = 100000
+    # Сколько секунд хранить последнюю активность пользователя
+    ACTIVITY_KEPT = 24 * 3600
+
+    _QUEUE_COLUMNS = "q.seq, q.user_id, q.lang, q.vip_only, q.interests, q.widened"
+
+    def __init__(self, path: str, poll_interval: float = 0.1, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.path = path
+        self.poll_interval = poll_interval
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS pairs (user_id INTEGER PRIMARY KEY, partner_id INTEGER NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS queue ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL UNIQUE, "
+            "tier TEXT NOT NULL, enqueued_at REAL NOT NULL, lang TEXT, vip_only INTEGER NOT NULL, "
+            "interests TEXT NOT NULL, open INTEGER NOT NULL, widened INTEGER NOT NULL DEFAULT 0);"
+            "CREATE INDEX IF NOT EXISTS queue_by_tier ON queue (tier, seq);"
+            "DROP INDEX IF EXISTS queue_open;"
+            "CREATE INDEX IF NOT EXISTS queue_open_any ON queue (tier, open, vip_only, seq);"
+            "CREATE INDEX IF NOT EXISTS queue_open_lang ON queue (tier, open, vip_only, lang, seq);"
+            "CREATE INDEX IF NOT EXISTS queue_unwidened ON queue (enqueued_at) WHERE widened = 0;"
+            "CREATE TABLE IF NOT EXISTS queue_pools ("
+            "tier TEXT NOT NULL, key TEXT NOT NULL, vip_only INTEGER NOT NULL, lang TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, user_id INTEGER NOT NULL, "
+            "PRIMARY KEY (tier, key, vip_only, lang, seq)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS queue_pools_any ON queue_pools (tier, key, vip_only, seq);"
+            "CREATE INDEX IF NOT EXISTS queue_pools_by_user ON queue_pools (user_id);"
+            "CREATE TABLE IF NOT EXISTS recent ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, partner_id INTEGER NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS recent_by_user ON recent (user_id, seq);"
+            "CREATE TABLE IF NOT EXISTS changes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, origin TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS links ("
+            "token TEXT PRIMARY KEY, creator_id INTEGER NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS activity (user_id INTEGER PRIMARY KEY, ts REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS vip (user_id INTEGER PRIMARY KEY, expires_at REAL NOT NULL);"
+        )
+        self._run_transaction(self._migrate_queue_keys_tx)
+        self._last_change = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def _migrate_queue_keys_tx(self) -> None:
+        """Перенос корзин из прежней таблицы ``queue_keys`` без деления на подкорзины"""
+        if self._db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'queue_keys'").fetchone():
+            self._db.execute(
+                "INSERT OR IGNORE INTO queue_pools (tier, key, vip_only, lang, seq, user_id) "
+                "SELECT k.tier, k.key, q.vip_only, COALESCE(q.lang, ''), k.seq, k.user_id "
+                "FROM queue_keys k JOIN queue q ON q.user_id = k.user_id"
+            )
+            self._db.execute("DROP TABLE queue_keys")
+
+    async def start(self) -> None:
+        await super().start()
+        self._tasks.append(asyncio.create_task(self._poll_changes()))
+
+    async def close(self) -> None:
+        await super().close()
+        await asyncio.to_thread(self._close)
+
+    async def is_waiting(self, user_id: int) -> bool:
+        row = await self._query("SELECT 1 FROM queue WHERE user_id = ?", (user_id,))
+        return row is not None
+
+    async def cancel_search(self, user_id: int) -> bool:
+        return await self._transaction(self._dequeue_tx, user_id)
+
+    async def active_user_ids(self) -> List[int]:
+        return await asyncio.to_thread(self._read_ids, "SELECT user_id FROM pairs")
+
+    async def waiting_user_ids(self) -> List[int]:
+        return await asyncio.to_thread(self._read_ids, "SELECT user_id FROM queue")
+
+    async def record_activity(self, activity: Dict[int, float]) -> None:
+        await self._transaction(self._record_activity_tx, list(activity.items()))
+
+    async def last_activity(self, user_ids: List[int]) -> Dict[int, float]:
+        return await asyncio.to_thread(self._read_activity, user_ids)
+
+    async def publish_link(self, token: str, creator_id: int, expires_at: float) -> None:
+        await self._transaction(self._publish_link_tx, token, creator_id, expires_at)
+
+    async def lookup_link(self, token: str) -> Optional[int]:
+        row = await self._query(
+            "SELECT creator_id FROM links WHERE token = ? AND expires_at > ?", (token, time.time()))
+        return row[0] if row is not None else None
+
+    async def drop_link(self, token: str) -> None:
+        await self._transaction(self._drop_link_tx, token)
+
+    async def publish_vip(self, user_id: int, expires_at: float) -> None:
+        await self._transaction(self._publish_vip_tx, user_id, expires_at)
+
+    async def extend_vip(self, user_id: int, seconds: float) -> Optional[float]:
+        return await self._transaction(self._extend_vip_tx, user_id, seconds)
+
+    async def drop_vip(self, user_id: int, expired_before: Optional[float] = None) -> bool:
+        return await self._transaction(self._drop_vip_tx, user_id, expired_before)
+
+    async def vip_subscriptions(self) -> Dict[int, float]:
+        return await asyncio.to_thread(self._read_vip)
+
+    async def _fetch_partner(self, user_id: int) -> Optional[int]:
+        row = await self._query("SELECT partner_id FROM pairs WHERE user_id = ?", (user_id,))
+        return row[0] if row is not None else None
+
+    async def _pair(self, user_id: int, partner_id: int) -> bool:
+        return await self._transaction(self._pair_tx, user_id, partner_id)
+
+    async def _unpair(self, user_id: int) -> Optional[int]:
+        return await self._transaction(self._unpair_tx, user_id)
+
+    async def _match(self, user_id: int, vip: bool, request: SearchRequest) -> Optional[int]:
+        return await self._transaction(self._match_tx, user_id, vip, request, time.time())
+
+    async def _widen(self) -> List[Pair]:
+        return await self._transaction(self._widen_tx, time.time())
+
+    async def _refresh_stats(self) -> None:
+        pairs, depths = await asyncio.to_thread(self._read_stats)
+        self._pairs = pairs
+        self._depths = {tier: depths.get(tier, 0) for tier in TIERS}
+
+    async def _poll_changes(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                user_ids = await asyncio.to_thread(self._read_changes)
+            except Exception as e:
+                # Пропущенные уведомления могли оставить устаревшие записи
+                self.cache.clear()
+                logger.warning("Не удалось прочитать изменения чатов: %s", e)
+                continue
+            if user_ids:
+                self.cache.invalidate(user_ids)
+
+    async def _query(self, sql: str, params: Tuple[Any, ...]) -> Optional[Tuple[Any, ...]]:
+        return await asyncio.to_thread(self._fetchone, sql, params)
+
+    async def _transaction(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.to_thread(self._run_transaction, fn, *args)
+
+    def _fetchone(self, sql: str, params: Tuple[Any, ...]) -> Optional[Tuple[Any, ...]]:
+        with self._db_lock:
+            return self._db.execute(sql, params).fetchone()
+
+    def _run_transaction(self, fn: Callable[..., Any], *args: Any) -> Any:
+        with self._db_lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(*args)
+                self._db.execute("COMMIT")
+                return result
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _pair_tx(self, user_id: int, partner_id: int) -> bool:
+        if user_id == partner_id:
+            return False
+        busy = self._db.execute("SELECT 1 FROM pairs WHERE user_id IN (?, ?)", (user_id, partner_id)).fetchone()
+        if busy is not None:
+            return False
+        self._dequeue_tx(user_id)
+        self._dequeue_tx(partner_id)
+        self._db.executemany("INSERT INTO pairs (user_id, partner_id) VALUES (?, ?)",
+                             ((user_id, partner_id), (partner_id, user_id)))
+        for uid, other in ((user_id, partner_id), (partner_id, user_id)):
+            self._db.execute("INSERT INTO recent (user_id, partner_id) VALUES (?, ?)", (uid, other))
+            self._db.execute(
+                "DELETE FROM recent WHERE user_id = ? AND seq NOT IN "
+                "(SELECT seq FROM recent WHERE user_id = ? ORDER BY seq DESC LIMIT ?)",
+                (uid, uid, self.recent_size)
+            )
+        self._log_changes(user_id, partner_id)
+        return True
+
+    def _unpair_tx(self, user_id: int) -> Optional[int]:
+        row = self._db.execute("SELECT partner_id FROM pairs WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None:
+            return None
+        partner_id = row[0]
+        self._db.execute("DELETE FROM pairs WHERE user_id = ?", (user_id,))
+        self._db.execute("DELETE FROM pairs WHERE user_id = ? AND partner_id = ?", (partner_id, user_id))
+        self._log_changes(user_id, partner_id)
+        return partner_id
+
+    def _match_tx(self, user_id: int, vip: bool, request: SearchRequest, now: float) -> Optional[int]:
+        if self._db.execute("SELECT 1 FROM pairs WHERE user_id = ?", (user_id,)).fetchone() is not None:
+            return None
+        keys = request.bucket_keys()
+        partner_id = self._find_tx(user_id, vip, request, False, now)
+        if partner_id is not None:
+            self._pair_tx(user_id, partner_id)
+            return partner_id
+        tier = TIER_VIP if vip else TIER_REGULAR
+        cursor = self._db.execute(
+            "INSERT INTO queue (user_id, tier, enqueued_at, lang, vip_only, interests, open) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (user_id) DO NOTHING",
+            (user_id, tier, now, request.lang, request.vip_only, json.dumps(sorted(request.interests)), not keys)
+        )
+        if cursor.rowcount:
+            seq = cursor.lastrowid
+            self._db.executemany(
+                "INSERT INTO queue_pools (tier, key, vip_only, lang, seq, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+                ((tier, key, request.vip_only, request.lang or "", seq, user_id) for key in keys)
+            )
+        return None
+
+    def _widen_tx(self, now: float) -> List[Pair]:
+        rows = self._db.execute(
+            "SELECT user_id FROM queue WHERE widened = 0 AND enqueued_at <= ? ORDER BY enqueued_at LIMIT 100",
+            (now - self.widen_after,)
+        ).fetchall()
+        pairs = []
+        for (user_id,) in rows:
+            self._db.execute("UPDATE queue SET widened = 1, open = 1 WHERE user_id = ?", (user_id,))
+        for (user_id,) in rows:
+            row = self._db.execute(
+                "SELECT tier, lang, vip_only, interests FROM queue WHERE user_id = ?", (user_id,)).fetchone()
+            if row is None:
+                continue  # Уже в чате с другим расширенным
+            tier, lang, vip_only, interests = row
+            request = SearchRequest(frozenset(json.loads(interests)), lang, bool(vip_only))
+            partner_id = self._find_tx(user_id, tier == TIER_VIP, request, True, now)
+            if partner_id is not None and self._pair_tx(user_id, partner_id):
+                pairs.append((user_id, partner_id))
+        return pairs
+
+    def _find_tx(self, user_id: int, vip: bool, request: SearchRequest, widened: bool, now: float) -> Optional[int]:
+        """Поиск совместимого собеседника в подкорзинах (как MatchQueue.pop)"""
+        recent = {row[0] for row in self._db.execute("SELECT partner_id FROM recent WHERE user_id = ?", (user_id,))}
+        depth = scan_depth(self.recent_size)
+        tiers = (TIER_VIP,) if request.vip_only else self._tier_order(now)
+        for tier in tiers:
+            buckets: List[Optional[str]] = list(request.bucket_keys())
+            if widened or not buckets:
+                buckets.append(None)  # Общая корзина
+            for key in buckets:
+                best = None
+                for sql, params in self._pool_queries(tier, key, user_id, vip, request, depth):
+                    for seq, candidate_id, lang, vip_only, interests, candidate_widened in self._db.execute(sql, params):
+                        candidate = SearchRequest(frozenset(json.loads(interests)), lang, bool(vip_only))
+                        if is_compatible(user_id, vip, request, widened,
+                                         candidate_id, candidate, bool(candidate_widened), recent):
+                            if best is None or seq < best[0]:
+                                best = (seq, candidate_id)
+                            break
+                if best is not None:
+                    streak = self._vip_streak() + 1 if tier == TIER_VIP else 0
+                    self._db.execute(
+                        "INSERT INTO meta (key, value) VALUES ('vip_streak', ?) "
+                        "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (streak,))
+                    return best[1]
+        return None
+
+    def _pool_queries(
+        self, tier: str, key: Optional[str], user_id: int, vip: bool, request: SearchRequest, depth: int
+    ) -> List[Tuple[str, Tuple[Any, ...]]]:
+        """Запросы к подкорзинам корзины ``key`` (None — общая), где кандидаты проходят фильтры"""
+        if key is None:
+            sql = (f"SELECT {self._QUEUE_COLUMNS} FROM queue q "
+                   "WHERE q.tier = ? AND q.open = 1 AND q.vip_only = ? AND q.user_id != ?")
+            lang_filter, order, head = " AND q.lang IS ?", " ORDER BY q.seq LIMIT ?", (tier,)
+        else:
+            sql = (f"SELECT {self._QUEUE_COLUMNS} FROM queue_pools k JOIN queue q ON q.user_id = k.user_id "
+                   "WHERE k.tier = ? AND k.key = ? AND k.vip_only = ? AND k.user_id != ?")
+            lang_filter, order, head = " AND k.lang = ?", " ORDER BY k.seq LIMIT ?", (tier, key)
+        queries = []
+        for flag, lang in search_pools(request, vip):
+            if lang == ANY_LANG:
+                queries.append((sql + order, (*head, flag, user_id, depth)))
+            else:
+                # В queue язык без указания хранится как NULL, в queue_pools — пустой строкой
+                value = (lang or None) if key is None else lang
+                queries.append((sql + lang_filter + order, (*head, flag, user_id, value, depth)))
+        return queries
+
+    def _tier_order(self, now: float) -> Tuple[str, ...]:
+        """Порядок обхода уровней, как в MatchQueue, но по общему состоянию"""
+        oldest = self._db.execute(
+            "SELECT enqueued_at FROM queue WHERE tier = ? ORDER BY seq LIMIT 1", (TIER_REGULAR,)).fetchone()
+        if oldest is None or self._db.execute("SELECT 1 FROM queue WHERE tier = ?", (TIER_VIP,)).fetchone() is None:
+            return TIERS
+        if self._vip_streak() >= self.vip_burst or now - oldest[0] >= self.max_regular_wait:
+            return TIER_REGULAR, TIER_VIP
+        return TIERS
+
+    def _vip_streak(self) -> int:
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'vip_streak'").fetchone()
+        return row[0] if row is not None else 0
+
+    def _dequeue_tx(self, user_id: int) -> bool:
+        self._db.execute("DELETE FROM queue_pools WHERE user_id = ?", (user_id,))
+        return self._db.execute("DELETE FROM queue WHERE user_id = ?", (user_id,)).rowcount > 0
+
+    def _publish_link_tx(self, token: str, creator_id: int, expires_at: float) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO links (token, creator_id, expires_at) VALUES (?, ?, ?)",
+            (token, creator_id, expires_at)
+        )
+
+    def _drop_link_tx(self, token: str) -> None:
+        self._db.execute("DELETE FROM links WHERE token = ?", (token,))
+
+    def _publish_vip_tx(self, user_id: int, expires_at: float) -> None:
+        self._db.execute("INSERT OR REPLACE INTO vip (user_id, expires_at) VALUES (?, ?)", (user_id, expires_at))
+
+    def _extend_vip_tx(self, user_id: int, seconds: float) -> float:
+        row = self._db.execute("SELECT expires_at FROM vip WHERE user_id = ?", (user_id,)).fetchone()
+        expires_at = max(time.time(), row[0] if row is not None else 0.0) + seconds
+        self._publish_vip_tx(user_id, expires_at)
+        return expires_at
+
+    def _drop_vip_tx(self, user_id: int, expired_before: Optional[float]) -> bool:
+        if expired_before is None:
+            return self._db.execute("DELETE FROM vip WHERE user_id = ?", (user_id,)).rowcount > 0
+        return self._db.execute(
+            "DELETE FROM vip WHERE user_id = ? AND expires_at <= ?", (user_id, expired_before)).rowcount > 0
+
+    def _read_vip(self) -> Dict[int, float]:
+        with self._db_lock:
+            return dict(self._db.execute("SELECT user_id, expires_at FROM vip").fetchall())
+
+    def _log_changes(self, *user_ids: int) -> None:
+        self._db.executemany(
+            "INSERT INTO changes (user_id, origin) VALUES (?, ?)", ((uid, self.origin) for uid in user_ids))
+
+    def _read_changes(self) -> List[int]:
+        with self._db_lock:
+            rows = self._db.execute(
+                "SELECT seq, user_id, origin FROM changes WHERE seq > ? ORDER BY seq", (self._last_change,)
+            ).fetchall()
+        if not rows:
+            return []
+        self._last_change = rows[-1][0]
+        return [user_id for _, user_id, origin in rows if origin != self.origin]
+
+    def _record_activity_tx(self, activity: List[Tuple[int, float]]) -> None:
+        self._db.executemany(
+            "INSERT INTO activity (user_id, ts) VALUES (?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET ts = MAX(ts, excluded.ts)",
+            activity
+        )
+
+    def _read_activity(self, user_ids: List[int]) -> Dict[int, float]:
+        placeholders = ", ".join("?" * len(user_ids))
+        with self._db_lock:
+            return dict(self._db.execute(
+                f"SELECT user_id, ts FROM activity WHERE user_id IN ({placeholders})", user_ids).fetchall())
+
+    def _read_ids(self, sql: str) -> List[int]:
+        with self._db_lock:
+            return [row[0] for row in self._db.execute(sql)]
+
+    def _read_stats(self) -> Tuple[int, Dict[str, int]]:
+        with self._db_lock:
+            pairs = self._db.execute("SELECT COUNT(*) FROM pairs").fetchone()[0] // 2
+            depths = dict(self._db.execute("SELECT tier, COUNT(*) FROM queue GROUP BY tier").fetchall())
+            # Заодно чистим старый журнал изменений и истёкшие ссылки
+            self._db.execute("DELETE FROM changes WHERE seq <= ?", (self._last_change - self.CHANGES_KEPT,))
+            self._db.execute("DELETE FROM links WHERE expires_at <= ?", (time.time(),))
+            self._db.execute("DELETE FROM activity WHERE ts <= ?", (time.time() - self.ACTIVITY_KEPT,))
+        return pairs, depths
+
+    def _close(self) -> None:
+        with self._db_lock:
+            self._db.close()
+
+
+# Общая часть Lua-скриптов. KEYS: 1 — хэш чатов, 2 — хэш {user_id: запись очереди в JSON},
+# 3 и 4 — очереди VIP и обычная (все ожидающие уровня), 5 — счётчик VIP подряд,
+# 6 — ожидающие расширения поиска. Корзины и списки недавних собеседников
+# адресуются через префикс P, поэтому скрипты рассчитаны на один сервер, а не Redis Cluster.
+# Корзина делится на подкорзины <корзина>:<vip_only>:<язык> (как matchmaking.entry_pools):
+# ожидающий лежит в подкорзине своего языка и в общей '*'.
+_LUA_COMMON = """
+local function tier_key(tier)
+  return tier == 'vip' and KEYS[3] or KEYS[4]
+end
+local function entry_pools(bucket, entry)
+  local prefix = bucket .. ':' .. (entry.vip_only and '1' or '0') .. ':'
+  return {prefix .. entry.lang, prefix .. '*'}
+end
+local function add_pools(bucket, entry, score, user)
+  for _, pool in ipairs(entry_pools(bucket, entry)) do
+    redis.call('ZADD', pool, score, user)
+  end
+end
+local function remove_pools(bucket, entry, user)
+  for _, pool in ipairs(entry_pools(bucket, entry)) do
+    redis.call('ZREM', pool, user)
+  end
+end
+local function dequeue(P, user)
+  local raw = redis.call('HGET', KEYS[2], user)
+  if not raw then
+    return false
+  end
+  local entry = cjson.decode(raw)
+  redis.call('ZREM', tier_key(entry.tier), user)
+  remove_pools(P .. 'open:' .. entry.tier, entry, user)
+  redis.call('ZREM', KEYS[6], user)
+  for _, key in ipairs(entry.keys) do
+    remove_pools(P .. 'bucket:' .. entry.tier .. ':' .. key, entry, user)
+  end
+  redis.call('HDEL', KEYS[2], user)
+  return true
+end
+local function pair(P, a, b, recent_size, channel, origin)
+  dequeue(P, a)
+  dequeue(P, b)
+  redis.call('HSET', KEYS[1], a, b, b, a)
+  for _, ids in ipairs({{a, b}, {b, a}}) do
+    local key = P .. 'recent:' .. ids[1]
+    redis.call('LPUSH', key, ids[2])
+    redis.call('LTRIM', key, 0, recent_size - 1)
+    redis.call('EXPIRE', key, 86400)
+  end
+  redis.call('PUBLISH', channel, origin .. ' ' .. a .. ' ' .. b)
+end
+"""
+
+# ARGV: a, b, префикс, размер списка недавних, канал, источник
+_LUA_PAIR = _LUA_COMMON + """
+local a, b = ARGV[1], ARGV[2]
+if a == b or redis.call('HEXISTS', KEYS[1], a) == 1 or redis.call('HEXISTS', KEYS[1], b) == 1 then
+  return 0
+end
+pair(ARGV[3], a, b, tonumber(ARGV[4]), ARGV[5], ARGV[6])
+return 1
+"""
+
+# Уведомление в канале: ID воркера-источника и изменённые пользователи через пробел
+# ARGV: user, канал, источник
+_LUA_UNPAIR = """
+local partner = redis.call('HGET', KEYS[1], ARGV[1])
+if not partner then
+  return 0
+end
+redis.call('HDEL', KEYS[1], ARGV[1])
+if redis.call('HGET', KEYS[1], partner) == ARGV[1] then
+  redis.call('HDEL', KEYS[1], partner)
+end
+redis.call('PUBLISH', ARGV[2], ARGV[3] .. ' ' .. ARGV[1] .. ' ' .. partner)
+return tonumber(partner)
+"""
+
+# Поиск совместимого собеседника, как MatchQueue.pop
+_LUA_FIND = """
+local function search_pools(bucket, vip, req)
+  local langs = req.lang ~= '' and {req.lang, ''} or {'*'}
+  local flags = vip and {'0', '1'} or {'0'}
+  local pools = {}
+  for _, flag in ipairs(flags) do
+    for _, lang in ipairs(langs) do
+      pools[#pools + 1] = bucket .. ':' .. flag .. ':' .. lang
+    end
+  end
+  return pools
+end
+local function find(P, user, vip, req, widened, now, max_wait, burst, scan)
+  local recent = {}
+  for _, id in ipairs(redis.call('LRANGE', P .. 'recent:' .. user, 0, -1)) do
+    recent[id] = true
+  end
+  local tiers = {'vip', 'regular'}
+  if req.vip_only then
+    tiers = {'vip'}
+  else
+    local oldest = redis.call('ZRANGE', KEYS[4], 0, 0, 'WITHSCORES')
+    if oldest[1] and redis.call('ZCARD', KEYS[3]) > 0 then
+      local streak = tonumber(redis.call('GET', KEYS[5]) or '0')
+      if streak >= burst or now - tonumber(oldest[2]) >= max_wait then
+        tiers = {'regular', 'vip'}
+      end
+    end
+  end
+  for _, tier in ipairs(tiers) do
+    local buckets = {}
+    for _, key in ipairs(req.keys) do
+      buckets[#buckets + 1] = P .. 'bucket:' .. tier .. ':' .. key
+    end
+    if widened or #req.keys == 0 then
+      buckets[#buckets + 1] = P .. 'open:' .. tier
+    end
+    for _, bucket in ipairs(buckets) do
+      local best, best_score = nil, nil
+      for _, pool in ipairs(search_pools(bucket, vip, req)) do
+        local heads = redis.call('ZRANGE', pool, 0, scan - 1, 'WITHSCORES')
+        for i = 1, #heads, 2 do
+          local candidate, score = heads[i], tonumber(heads[i + 1])
+          local raw = redis.call('HGET', KEYS[2], candidate)
+          local entry = raw and cjson.decode(raw) or {}
+          local ok = raw and candidate ~= user
+            and not (entry.vip_only and not vip)
+            and not (req.lang ~= '' and entry.lang ~= '' and req.lang ~= entry.lang)
+            and (widened or entry.widened or not recent[candidate])
+          if ok then
+            if not best or score < best_score then
+              best, best_score = candidate, score
+            end
+            break
+          end
+        end
+      end
+      if best then
+        if tier == 'vip' then
+          redis.call('INCR', KEYS[5])
+        else
+          redis.call('SET', KEYS[5], 0)
+        end
+        return best
+      end
+    end
+  end
+  return nil
+end
+"""
+
+# ARGV: user, vip, now, max_regular_wait, vip_burst, канал, источник, префикс,
+#       запрос в JSON {lang, vip_only, keys}, размер списка недавних, глубина просмотра подкорзины
+_LUA_MATCH = _LUA_COMMON + _LUA_FIND + """
+local user, vip, now, P = ARGV[1], ARGV[2] == '1', tonumber(ARGV[3]), ARGV[8]
+if redis.call('HEXISTS', KEYS[1], user) == 1 then
+  return 0
+end
+local req = cjson.decode(ARGV[9])
+local partner = find(P, user, vip, req, false, now, tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[11]))
+if partner then
+  pair(P, user, partner, tonumber(ARGV[10]), ARGV[6], ARGV[7])
+  return tonumber(partner)
+end
+if redis.call('HEXISTS', KEYS[2], user) == 0 then
+  req.tier = vip and 'vip' or 'regular'
+  req.widened = false
+  redis.call('HSET', KEYS[2], user, cjson.encode(req))
+  redis.call('ZADD', tier_key(req.tier), now, user)
+  redis.call('ZADD', KEYS[6], now, user)
+  if #req.keys == 0 then
+    add_pools(P .. 'open:' .. req.tier, req, now, user)
+  end
+  for _, key in ipairs(req.keys) do
+    add_pools(P .. 'bucket:' .. req.tier .. ':' .. key, req, now, user)
+  end
+end
+return 0
+"""
+
+# ARGV: now, widen_after, max_regular_wait, vip_burst, канал, источник, префикс, размер списка недавних,
+#       глубина просмотра подкорзины
+# Возвращает плоский список пар [a1, b1, a2, b2, ...]
+_LUA_WIDEN = _LUA_COMMON + _LUA_FIND + """
+local now, P = tonumber(ARGV[1]), ARGV[7]
+local due = redis.call('ZRANGEBYSCORE', KEYS[6], '-inf', now - tonumber(ARGV[2]), 'LIMIT', 0, 100)
+for _, user in ipairs(due) do
+  local entry = cjson.decode(redis.call('HGET', KEYS[2], user))
+  entry.widened = true
+  redis.call('HSET', KEYS[2], user, cjson.encode(entry))
+  add_pools(P .. 'open:' .. entry.tier, entry, redis.call('ZSCORE', tier_key(entry.tier), user), user)
+  redis.call('ZREM', KEYS[6], user)
+end
+local matched = {}
+for _, user in ipairs(due) do
+  local raw = redis.call('HGET', KEYS[2], user)
+  if raw then
+    local entry = cjson.decode(raw)
+    local partner = find(P, user, entry.tier == 'vip', entry, true, now,
+      tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[9]))
+    if partner then
+      pair(P, user, partner, tonumber(ARGV[8]), ARGV[5], ARGV[6])
+      matched[#matched + 1] = user
+      matched[#matched + 1] = partner
+    end
+  end
+end
+return matched
+"""
+
+# ARGV: user, префикс
+_LUA_CANCEL = _LUA_COMMON + """
+return dequeue(ARGV[2], ARGV[1]) and 1 or 0
+"""
+
+
+# Продление VIP от текущего срока. ARGV: user, текущее время, секунды.
+# Срок возвращается строкой: целые ответы Lua отбросили бы дробную часть
+_LUA_EXTEND_VIP = """
+local current = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+local expires = string.format('%.6f', math.max(current, tonumber(ARGV[2])) + tonumber(ARGV[3]))
+redis.call('HSET', KEYS[1], ARGV[1], expires)
+return expires
+"""
+
+# ARGV: user, время (пустая строка — удалить подписку с любым сроком)
+_LUA_DROP_VIP = """
+local current = redis.call('HGET', KEYS[1], ARGV[1])
+if not current then
+  return 0
+end
+if ARGV[2] ~= '' and tonumber(current) > tonumber(ARGV[2]) then
+  return 0
+end
+return redis.call('HDEL', KEYS[1], ARGV[1])
+"""
+
+
+class RedisSessionBackend(SharedSessionBackend):
+    """Общее состояние в Redis (или совместимом сервере) для нескольких машин.
+
+    Чаты хранятся в хэше ``pairs``, очередь — в отсортированных множествах по
+    времени постановки: по уровню, по корзинам поиска и общая корзина.
+    Атомарность обеспечивают Lua-скрипты, а об изменениях воркеры узнают
+    через pub/sub канал. Требуется пакет ``redis`` (``pip install redis``).
+    """
+
+    # Сколько секунд хранить последнюю активность пользователя
+    ACTIVITY_KEPT = 24 * 3600
+
+    def __init__(self, url: str, prefix: str = "anonchat:", **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        try:
+            from redis import asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError("Для SESSION_BACKEND_URL=redis:// установите пакет redis") from e
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._keys = [f"{prefix}{name}" for name in
+                      ("pairs", "queued", "queue:vip", "queue:regular", "vip_streak", "unwidened")]
+        self._links_prefix = f"{prefix}link:"
+        self._activity_prefix = f"{prefix}activity:"
+        self._vip_key = f"{prefix}vip"
+        self._channel = f"{prefix}invalidate"
+        self._pair_script = self._redis.register_script(_LUA_PAIR)
+        self._unpair_script = self._redis.register_script(_LUA_UNPAIR)
+        self._match_script = self._redis.register_script(_LUA_MATCH)
+        self._widen_script = self._redis.register_script(_LUA_WIDEN)
+        self._cancel_script = self._redis.register_script(_LUA_CANCEL)
+        self._extend_vip_script = self._redis.register_script(_LUA_EXTEND_VIP)
+        self._drop_vip_script = self._redis.register_script(_LUA_DROP_VIP)
+
+    async def start(self) -> None:
+        await super().start()
+        self._tasks.append(asyncio.create_task(self._listen()))
+
+    async def close(self) -> None:
+        await super().close()
+        await self._redis.aclose()
+
+    async def is_waiting(self, user_id: int) -> bool:
+        return bool(await self._redis.hexists(self._keys[1], user_id))
+
+    async def cancel_search(self, user_id: int) -> bool:
+        return bool(await self._cancel_script(keys=self._keys, args=[user_id, self._prefix]))
+
+    async def active_user_ids(self) -> List[int]:
+        return [int(uid) for uid in await self._redis.hkeys(self._keys[0])]
+
+    async def waiting_user_ids(self) -> List[int]:
+        return [int(uid) for uid in await self._redis.hkeys(self._keys[1])]
+
+    async def record_activity(self, activity: Dict[int, float]) -> None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for user_id, ts in activity.items():
+                pipe.set(f"{self._activity_prefix}{user_id}", ts, ex=self.ACTIVITY_KEPT)
+            await pipe.execute()
+
+    async def last_activity(self, user_ids: List[int]) -> Dict[int, float]:
+        values = await self._redis.mget([f"{self._activity_prefix}{user_id}" for user_id in user_ids])
+        return {user_id: float(ts) for user_id, ts in zip(user_ids, values) if ts is not None}
+
+    async def publish_link(self, token: str, creator_id: int, expires_at: float) -> None:
+        ttl = int((expires_at - time.time()) * 1000)
+        if ttl > 0:
+            await self._redis.set(self._links_prefix + token, creator_id, px=ttl)
+
+    async def lookup_link(self, token: str) -> Optional[int]:
+        creator_id = await self._redis.get(self._links_prefix + token)
+        return int(creator_id) if creator_id is not None else None
+
+    async def drop_link(self, token: str) -> None:
+        await self._redis.delete(self._links_prefix + token)
+
+    async def publish_vip(self, user_id: int, expires_at: float) -> None:
+        await self._redis.hset(self._vip_key, user_id, expires_at)
+
+    async def extend_vip(self, user_id: int, seconds: float) -> Optional[float]:
+        return float(await self._extend_vip_script(keys=[self._vip_key], args=[user_id, time.time(), seconds]))
+
+    async def drop_vip(self, user_id: int, expired_before: Optional[float] = None) -> bool:
+        args = [user_id, "" if expired_before is None else expired_before]
+        return bool(await self._drop_vip_script(keys=[self._vip_key], args=args))
+
+    async def vip_subscriptions(self) -> Dict[int, float]:
+        return {int(uid): float(expires_at) for uid, expires_at in (await self._redis.hgetall(self._vip_key)).items()}
+
+    async def _fetch_partner(self, user_id: int) -> Optional[int]:
+        partner_id = await self._redis.hget(self._keys[0], user_id)
+        return int(partner_id) if partner_id is not None else None
+
+    async def _pair(self, user_id: int, partner_id: int) -> bool:
+        args = [user_id, partner_id, self._prefix, self.recent_size, self._channel, self.origin]
+        return bool(await self._pair_script(keys=self._keys, args=args))
+
+    async def _unpair(self, user_id: int) -> Optional[int]:
+        return await self._unpair_script(keys=self._keys[:1], args=[user_id, self._channel, self.origin]) or None
+
+    async def _match(self, user_id: int, vip: bool, request: SearchRequest) -> Optional[int]:
+        search = json.dumps({"lang": request.lang or "", "vip_only": request.vip_only,
+                             "keys": list(request.bucket_keys())})
+        args = [user_id, int(vip), time.time(), self.max_regular_wait, self.vip_burst, self._channel,
+                self.origin, self._prefix, search, self.recent_size, scan_depth(self.recent_size)]
+        return await self._match_script(keys=self._keys, args=args) or None
+
+    async def _widen(self) -> List[Pair]:
+        args = [time.time(), self.widen_after, self.max_regular_wait, self.vip_burst, self._channel,
+                self.origin, self._prefix, self.recent_size, scan_depth(self.recent_size)]
+        flat = [int(uid) for uid in await self._widen_script(keys=self._keys, args=args)]
+        return list(zip(flat[::2], flat[1::2]))
+
+    async def _refresh_stats(self) -> None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hlen(self._keys[0]).zcard(self._keys[2]).zcard(self._keys[3])
+            active, vip, regular = await pipe.execute()
+        self._pairs = active // 2
+        self._depths = {TIER_VIP: vip, TIER_REGULAR: regular}
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.subscribe(self._channel)
+                # Пока подписки не было, уведомления могли быть пропущены
+                self.cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    origin, *user_ids = message["data"].split()
+                    if origin != self.origin:
+                        self.cache.invalidate(int(uid) for uid in user_ids)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Подписка на изменения чатов прервана: %s", e)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+def create_session_backend(
+    store: StateStore,
+    url: Optional[str] = None,
+    vip_burst: int = 3,
+    max_regular_wait: float = 30.0,
+    widen_after: float = 20.0,
+    recent_size: int = 5,
+    on_match: Optional[MatchCallback] = None,
+    widen_interval: float = 5.0,
+    **kwargs: Any,
+) -> SessionBackend:
+    """Создание бэкенда по адресу ``local://``, ``sqlite:///sessions.db`` или ``redis://host:6379/0``"""
+    url = url or os.getenv("SESSION_BACKEND_URL", "local://")
+    common = dict(on_match=on_match, widen_interval=widen_interval)
+    if url.startswith("local:"):
+        queue = MatchQueue(
+            vip_burst=vip_burst,
+            max_regular_wait=max_regular_wait,
+            widen_after=widen_after,
+            recent=RecentPartners(recent_size)
+        )
+        return LocalSessionBackend(store, queue, **common)
+    shared = dict(vip_burst=vip_burst, max_regular_wait=max_regular_wait, widen_after=widen_after,
+                  recent_size=recent_size, **common, **kwargs)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionBackend(url[len("sqlite:///"):], **shared)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisSessionBackend(url, **shared)
+    raise ValueError(f"Неизвестный бэкенд чатов: {url}")
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Пространства имён состояния бота
+NS_VIP = "vip"
+NS_ACTIVE = "active"
+NS_WAITING = "waiting"
+NS_USERS = "users"
+NS_DUO = "duo"
+NS_DEAD = "dead"
+NS_BROADCAST = "broadcast"
+
+_DELETED = object()
+_MISSING = object()
+
+State = Dict[str, Dict[str, Any]]
+
+
+class StateStore(ABC):
+    """Хранилище состояния с отложенной пакетной записью.
+
+    ``put`` и ``delete`` только запоминают изменение в памяти (последнее
+    значение ключа побеждает) и никогда не блокируют цикл событий. Фоновая
+    задача раз в ``flush_interval`` секунд записывает накопленные изменения
+    одной транзакцией в отдельном потоке.
+    """
+
+    persistent = True
+
+    def __init__(self, flush_interval: float = 0.5, max_pending: int = 10000) -> None:
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: Dict[Tuple[str, str], Any] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_requested = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.flushed = 0
+
+    def put(self, ns: str, key: Any, value: Any) -> None:
+        self._pending[(ns, str(key))] = value
+        if len(self._pending) >= self.max_pending:
+            self._flush_requested.set()
+
+    def delete(self, ns: str, key: Any) -> None:
+        self._pending[(ns, str(key))] = _DELETED
+        if len(self._pending) >= self.max_pending:
+            self._flush_requested.set()
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        await asyncio.to_thread(self._close)
+
+    async def flush(self) -> None:
+        """Запись всех накопленных изменений"""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            upserts = [(ns, key, json.dumps(value)) for (ns, key), value in batch.items() if value is not _DELETED]
+            deletes = [(ns, key) for (ns, key), value in batch.items() if value is _DELETED]
+            try:
+                await asyncio.to_thread(self._write_batch, upserts, deletes)
+                self.flushed += len(batch)
+            except Exception as e:
+                # Возвращаем изменения, не затирая более свежие
+                batch.update(self._pending)
+                self._pending = batch
+                logger.error("Ошибка записи состояния: %s", e, exc_info=True)
+
+    async def get(self, ns: str, key: Any) -> Any:
+        """Значение одного ключа (None, если его нет): из ещё не записанных изменений или из базы"""
+        async with self._flush_lock:
+            value = self._pending.get((ns, str(key)), _MISSING)
+            if value is not _MISSING:
+                return None if value is _DELETED else value
+            stored = await asyncio.to_thread(self._read_one, ns, str(key))
+        return None if stored is None else json.loads(stored)
+
+    async def keys(self, ns: str) -> List[str]:
+        """Все ключи пространства имён с учётом ещё не записанных изменений"""
+        async with self._flush_lock:
+            keys = dict.fromkeys(await asyncio.to_thread(self._read_keys, ns))
+            for (pending_ns, key), value in list(self._pending.items()):
+                if pending_ns != ns:
+                    continue
+                if value is _DELETED:
+                    keys.pop(key, None)
+                else:
+                    keys[key] = None
+        return list(keys)
+
+    async def load(self) -> State:
+        """Чтение всего состояния: из снимка одним разбором JSON, иначе по записям одним запросом"""
+        return await asyncio.to_thread(self._load)
+
+    def _load(self) -> State:
+        snapshot = self._read_snapshot()
+        if snapshot is not None:
+            return json.loads(snapshot)
+        state: State = {}
+        for ns, key, value in self._read_all():
+            state.setdefault(ns, {})[key] = json.loads(value)
+        return state
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            await self.flush()
+
+    @abstractmethod
+    def _write_batch(self, upserts: List[Tuple[str, str, str]], deletes: List[Tuple[str, str]]) -> None:
+        """Запись пакета изменений (выполняется в отдельном потоке)"""
+
+    @abstractmethod
+    def _read_all(self) -> List[Tuple[str, str, str]]:
+        """Чтение всех записей (выполняется в отдельном потоке)"""
+
+    @abstractmethod
+    def _read_one(self, ns: str, key: str) -> Optional[str]:
+        """Чтение одной записи (выполняется в отдельном потоке)"""
+
+    @abstractmethod
+    def _read_keys(self, ns: str) -> List[str]:
+        """Чтение ключей пространства имён (выполняется в отдельном потоке)"""
+
+    def _read_snapshot(self) -> Optional[str]:
+        """Снимок всего состояния одной строкой JSON, если он актуален"""
+        return None
+
+    def _close(self) -> None:
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Хранилище без сохранения: состояние живёт в памяти до перезапуска"""
+
+    persistent = False
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._data: Dict[Tuple[str, str], str] = {}
+
+    def _write_batch(self, upserts: List[Tuple[str, str, str]], deletes: List[Tuple[str, str]]) -> None:
+        for ns, key, value in upserts:
+            self._data[(ns, key)] = value
+        for ns, key in deletes:
+            self._data.pop((ns, key), None)
+
+    def _read_all(self) -> List[Tuple[str, str, str]]:
+        return [(ns, key, value) for (ns, key), value in list(self._data.items())]
+
+    def _read_one(self, ns: str, key: str) -> Optional[str]:
+        return self._data.get((ns, key))
+
+    def _read_keys(self, ns: str) -> List[str]:
+        return [key for key_ns, key in list(self._data) if key_ns == ns]
+
+
+class SQLiteStateStore(StateStore):
+    """Хранилище в SQLite в режиме WAL.
+
+    При закрытии всё состояние дополнительно сохраняется снимком — одной
+    строкой JSON, собранной из уже сериализованных значений. Следующий запуск
+    читает одну строку и разбирает её одним вызовом вместо разбора каждой
+    записи. Каждая запись увеличивает номер версии в базе, а снимок хранит
+    версию, из которой он собран. Снимок читается, только если версии
+    совпадают, поэтому запись любого процесса после снимка (в том числе
+    другого воркера с той же базой) делает его неактуальным.
+    """
+
+    def __init__(self, path: str, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.path = path
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "ns TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+            "PRIMARY KEY (ns, key)) WITHOUT ROWID"
+        )
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS state_version ("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL);"
+            "INSERT OR IGNORE INTO state_version (id, version) VALUES (1, 0);"
+            "CREATE TABLE IF NOT EXISTS state_snapshot ("
+            "id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, value TEXT NOT NULL);"
+            # Снимок прежнего формата без версии
+            "DROP TABLE IF EXISTS snapshot;"
+        )
+
+    def _write_batch(self, upserts: List[Tuple[str, str, str]], deletes: List[Tuple[str, str]]) -> None:
+        with self._db_lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT INTO state (ns, key, value) VALUES (?, ?, ?) "
+                    "ON CONFLICT (ns, key) DO UPDATE SET value = excluded.value",
+                    upserts
+                )
+                self._db.executemany("DELETE FROM state WHERE ns = ? AND key = ?", deletes)
+                self._db.execute("UPDATE state_version SET version = version + 1")
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def _read_all(self) -> List[Tuple[str, str, str]]:
+        with self._db_lock:
+            return self._db.execute("SELECT ns, key, value FROM state").fetchall()
+
+    def _read_one(self, ns: str, key: str) -> Optional[str]:
+        with self._db_lock:
+            row = self._db.execute("SELECT value FROM state WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+        return row[0] if row else None
+
+    def _read_keys(self, ns: str) -> List[str]:
+        with self._db_lock:
+            return [key for key, in self._db.execute("SELECT key FROM state WHERE ns = ?", (ns,))]
+
+    def _read_snapshot(self) -> Optional[str]:
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT s.value FROM state_snapshot s JOIN state_version v ON s.version = v.version"
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write_snapshot(self) -> None:
+        """Снимок из записей без повторной сериализации: значения уже хранятся в JSON"""
+        with self._db_lock:
+            # Версия и записи читаются в одной транзакции и соответствуют друг другу
+            self._db.execute("BEGIN")
+            try:
+                version = self._db.execute("SELECT version FROM state_version").fetchone()[0]
+                rows = self._db.execute("SELECT ns, key, value FROM state").fetchall()
+            finally:
+                self._db.execute("COMMIT")
+        namespaces: Dict[str, List[str]] = {}
+        for ns, key, value in rows:
+            namespaces.setdefault(ns, []).append(f"{json.dumps(key)}:{value}")
+        snapshot = "{" + ",".join(f"{json.dumps(ns)}:{{{','.join(items)}}}" for ns, items in namespaces.items()) + "}"
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO state_snapshot (id, version, value) VALUES (1, ?, ?)", (version, snapshot))
+
+    def _close(self) -> None:
+        try:
+            self._write_snapshot()
+        except Exception as e:
+            logger.error("Не удалось сохранить снимок состояния: %s", e, exc_info=True)
+        with self._db_lock:
+            self._db.close()
+
+
+def create_state_store(url: Optional[str] = None, **kwargs: Any) -> StateStore:
+    """Создание хранилища по адресу вида ``sqlite:///bot_state.db`` или ``memory://``"""
+    url = url or os.getenv("STATE_STORE_URL", "sqlite:///bot_state.db")
+    if url.startswith("memory:"):
+        return MemoryStateStore(**kwargs)
+    if url.startswith("sqlite:///"):
+        return SQLiteStateStore(url[len("sqlite:///"):], **kwargs)
+    raise ValueError(f"Неизвестное хранилище состояния: {url}")
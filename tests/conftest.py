@@ -0,0 +1,21 @@
+"""Окружение тестов: bot.py читает настройки при импорте, поэтому они задаются здесь.
+
+Состояние бота пишется во временный каталог, логи — только в консоль и без
+отдельного потока, сеть не используется.
+"""
+import os
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+STATE_DIR = tempfile.mkdtemp(prefix="anonbot-tests-")
+
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123456:TEST-TOKEN",
+    "STATE_STORE_URL": f"sqlite:///{STATE_DIR}/state.db",
+    "SESSION_BACKEND_URL": "local://",
+    "MODERATION_RULES": str(ROOT / "moderation_rules.txt"),
+    "LOG_FILE": "",
+    "LOG_ASYNC": "false",
+    "LOG_LEVEL": "WARNING",
+})
@@ -0,0 +1,40 @@
+import asyncio
+
+from admin_mirror import AdminMirror
+
+
+class FakeBot:
+    def __init__(self):
+        self.calls = []
+
+    async def send_media_group(self, chat_id, media):
+        self.calls.append(("media_group", [item.media for item in media]))
+
+    async def send_voice(self, chat_id, file_id, caption=None):
+        self.calls.append(("voice", file_id))
+
+
+def test_media_in_one_window_is_sent_as_album():
+    async def scenario():
+        bot = FakeBot()
+        mirror = AdminMirror(bot, admin_id=1, batch_window=0.05)
+        mirror.submit(10, "p1", "photo", "от 10")
+        mirror.submit(11, "v1", "voice", "от 11")
+        mirror.submit(12, "p2", "photo", "от 12")
+        mirror.start()
+        await asyncio.sleep(0.2)
+        await mirror.stop()
+
+        assert bot.calls == [("media_group", ["p1", "p2"]), ("voice", "v1")]
+        assert mirror.mirrored == 3
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_drops_without_waiting():
+    mirror = AdminMirror(FakeBot(), admin_id=1, max_queue=1)
+    assert mirror.submit(10, "p1", "photo", "")
+    assert not mirror.submit(10, "p2", "photo", "")
+    assert not mirror.submit_album(10, [("voice", "v1")], "")
+    assert mirror.dropped == 1
+    assert len(mirror) == 1
@@ -0,0 +1,63 @@
+import asyncio
+import datetime
+
+from aiogram.types import Chat, Message
+
+from albums import AlbumCoalescer
+
+
+def album_part(message_id: int, group: str, chat_id: int = 1) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.datetime.now(),
+        chat=Chat(id=chat_id, type="private"),
+        media_group_id=group,
+    )
+
+
+def test_drain_delivers_pending_albums_in_order_before_returning():
+    async def scenario():
+        delivered = []
+
+        async def on_album(album):
+            # Первый альбом отправляется дольше второго
+            await asyncio.sleep(0.05 if album[0].media_group_id == "first" else 0)
+            delivered.append(album[0].media_group_id)
+
+        coalescer = AlbumCoalescer(on_album, window=10)
+        coalescer.add(album_part(1, "first"))
+        coalescer.add(album_part(2, "first"))
+        coalescer.add(album_part(3, "second"))
+
+        await coalescer.drain(1)
+        delivered.append("text")
+        assert delivered == ["first", "second", "text"]
+        assert len(coalescer) == 0
+        await coalescer.close()
+
+    asyncio.run(scenario())
+
+
+def test_drain_leaves_albums_of_other_chats_pending():
+    async def scenario():
+        delivered = []
+
+        async def on_album(album):
+            delivered.append((album[0].chat.id, len(album)))
+
+        coalescer = AlbumCoalescer(on_album, window=0.05)
+        coalescer.add(album_part(1, "a", chat_id=1))
+        coalescer.add(album_part(2, "b", chat_id=2))
+        coalescer.add(album_part(3, "b", chat_id=2))
+
+        await coalescer.drain(1)
+        assert delivered == [(1, 1)]
+        assert list(coalescer._by_chat) == [2]
+
+        # Альбом другого чата уходит по своему таймеру
+        await asyncio.sleep(0.1)
+        assert delivered == [(1, 1), (2, 2)]
+        assert not coalescer._by_chat and len(coalescer) == 0
+        await coalescer.close()
+
+    asyncio.run(scenario())
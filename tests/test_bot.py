@@ -0,0 +1,104 @@
+import asyncio
+import datetime
+import time
+
+from aiogram.types import Chat, Document, Message, User
+
+import bot
+from storage import NS_DUO, NS_USERS, NS_VIP, MemoryStateStore
+from user_cache import UserCache
+from vip import VipRegistry
+
+
+def album_document(message_id: int, caption=None) -> Message:
+    return Message(
+        message_id=message_id,
+        date=datetime.datetime.now(),
+        chat=Chat(id=1, type="private"),
+        from_user=User(id=1, is_bot=False, first_name="Тест"),
+        media_group_id="album",
+        document=Document(file_id=f"file-{message_id}", file_unique_id=f"unique-{message_id}"),
+        caption=caption,
+    )
+
+
+def test_known_users_are_warmed_at_startup_without_reads_per_message(monkeypatch):
+    async def scenario():
+        store = MemoryStateStore()
+        store.put(NS_USERS, 1, {"username": "old", "first_name": "Тест", "last_name": None})
+        await store.flush()
+        monkeypatch.setattr(bot, "state_store", store)
+        monkeypatch.setattr(bot, "user_data_cache", UserCache(max_size=10))
+        await bot.restore_state()
+
+        async def no_reads(ns, key):
+            raise AssertionError("чтение хранилища при обработке сообщения")
+
+        monkeypatch.setattr(store, "get", no_reads)
+        await bot.save_user_info(User(id=1, is_bot=False, first_name="Тест", username="old"))
+        await bot.save_user_info(User(id=2, is_bot=False, first_name="Новый"))
+        # Известный пользователь без изменений не перезаписывается, новый — записывается
+        assert list(store._pending) == [(NS_USERS, "2")]
+
+    asyncio.run(scenario())
+
+
+def test_album_captions_are_escaped_for_html(monkeypatch):
+    sent = {}
+
+    async def send_media_group(chat_id, media, **kwargs):
+        sent["media"] = media
+
+    monkeypatch.setattr(bot.bot, "send_media_group", send_media_group)
+    album = [album_document(1, "a <b> & c"), album_document(2)]
+    assert asyncio.run(bot.forward_album(1, 2, album))
+    assert [item.caption for item in sent["media"]] == ["a &lt;b&gt; &amp; c", None]
+
+
+def test_polling_restart_keeps_store_open_and_restores_once():
+    dispatcher = bot.dp
+
+    async def scenario():
+        bot.state_store.put(NS_DUO, "token", [7, time.time() + 3600])
+        await bot.state_store.flush()
+
+        await dispatcher.emit_startup(bot=bot.bot, dispatcher=dispatcher)
+        # start_polling упал (например, getMe вернул 500): aiogram вызывает обработчики выключения
+        await dispatcher.emit_shutdown(bot=bot.bot, dispatcher=dispatcher)
+        await dispatcher.emit_startup(bot=bot.bot, dispatcher=dispatcher)
+
+        assert bot.duo_links.get("token") == 7
+        assert list(bot.duo_links._by_creator[7]) == ["token"]
+        bot.state_store.put(NS_USERS, 1, {"username": "user", "first_name": None, "last_name": None})
+        await bot.state_store.flush()
+        assert (await bot.state_store.load())[NS_USERS]["1"]["username"] == "user"
+
+        bot.shutdown_requested.set()
+        await dispatcher.emit_shutdown(bot=bot.bot, dispatcher=dispatcher)
+        assert not bot.background_started.is_set()
+
+    asyncio.run(scenario())
+
+
+def test_vip_admin_command_rejects_bad_days(monkeypatch):
+    replies = []
+
+    async def answer(self, text, **kwargs):
+        replies.append(text)
+
+    monkeypatch.setattr(Message, "answer", answer)
+    monkeypatch.setattr(bot, "vip_users", VipRegistry(MemoryStateStore(), NS_VIP))
+
+    def command(text):
+        return Message(
+            message_id=1,
+            date=datetime.datetime.now(),
+            chat=Chat(id=bot.ADMIN_ID, type="private"),
+            from_user=User(id=bot.ADMIN_ID, is_bot=False, first_name="Админ"),
+            text=text,
+        )
+
+    for days in ("inf", "nan", "0", "-1", "1e300"):
+        asyncio.run(bot.vip_admin_command(command(f"/vip_grant 5 {days}")))
+        assert replies.pop().startswith("Использование:")
+    assert 5 not in bot.vip_users
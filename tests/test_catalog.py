@@ -0,0 +1,41 @@
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import SendMessage
+
+from catalog import MESSAGES, CatalogSession, ResponseCatalog
+
+TOKEN = "42:TEST"
+
+
+def form_fields(session, method):
+    form = session.build_form_data(Bot(TOKEN, session=session), method)
+    return {options["name"]: value for options, _, value in form._fields}
+
+
+def test_locale_falls_back_to_default_texts_and_code():
+    catalog = ResponseCatalog({**MESSAGES, "en": {"menu": "Menu:"}})
+    en = catalog.locale("en-US")
+    assert en.code == "en"
+    assert en["menu"] == "Menu:"
+    assert en["not_in_chat"] == MESSAGES["ru"]["not_in_chat"]
+    assert catalog.locale("de").code == "ru"
+    assert catalog.locale(None) is catalog.locale("ru")
+    assert en.keyboards.menu is not catalog.locale().keyboards.menu
+    assert en.format("queue_timeout", minutes=5).startswith("⌛")
+
+
+def test_cached_markup_is_sent_as_plain_session_would_serialize_it():
+    catalog = ResponseCatalog()
+    keyboards = catalog.locale().keyboards
+    session, plain = CatalogSession(catalog), AiohttpSession()
+    for markup in (keyboards.menu, keyboards.confirm["stop"]):
+        method = SendMessage(chat_id=1, text="привет", reply_markup=markup)
+        fields = form_fields(session, method)
+        assert fields == form_fields(plain, method)
+        assert fields["reply_markup"] is session._markup_json[id(markup)][1]
+
+    # Равная, но другая клавиатура собирается как обычно
+    copy = keyboards.menu.model_copy()
+    method = SendMessage(chat_id=1, text="x", reply_markup=copy)
+    assert form_fields(session, method) == form_fields(plain, method)
+    assert id(copy) not in session._markup_json
@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import SendMessage
+
+from delivery import CircuitBreaker, CircuitOpen, DeliveryGuard, RecipientUnavailable
+from storage import NS_DEAD, MemoryStateStore
+
+
+def test_breaker_opens_after_threshold_and_doubles_backoff_on_failed_probe():
+    breaker = CircuitBreaker(threshold=2, backoff=1.0, max_backoff=3.0)
+    breaker.failure(0.0)
+    assert breaker.allow(0.0)
+    breaker.failure(0.0)
+    assert breaker.is_open
+    assert not breaker.allow(0.5)
+
+    # После паузы проходит одна проба
+    assert breaker.allow(1.0)
+    assert not breaker.allow(1.0)
+    breaker.failure(1.0)
+    assert breaker.backoff == 2.0
+    assert not breaker.allow(2.5)
+
+    assert breaker.allow(3.0)
+    breaker.success()
+    assert not breaker.is_open
+    assert breaker.backoff == 1.0
+    assert breaker.rejected == 3
+
+
+def test_guard_skips_dead_recipients_and_rejects_while_open():
+    async def scenario():
+        store = MemoryStateStore()
+        dead = []
+
+        async def on_dead(chat_id):
+            dead.append(chat_id)
+
+        guard = DeliveryGuard(store, NS_DEAD, CircuitBreaker(threshold=1, backoff=60), on_dead=on_dead)
+        calls = []
+
+        async def blocked(bot, method):
+            calls.append(method.chat_id)
+            raise TelegramForbiddenError(method, "Forbidden: bot was blocked by the user")
+
+        with pytest.raises(TelegramForbiddenError):
+            await guard(blocked, None, SendMessage(chat_id=1, text="x"))
+        # Повторная отправка заблокировавшему бота не доходит до API
+        with pytest.raises(RecipientUnavailable):
+            await guard(blocked, None, SendMessage(chat_id=1, text="x"))
+        assert calls == [1]
+        assert dead == [1]
+        assert guard.skipped == 1
+        assert await store.get(NS_DEAD, 1) is not None
+
+        async def offline(bot, method):
+            raise TelegramNetworkError(method, "timeout")
+
+        with pytest.raises(TelegramNetworkError):
+            await guard(offline, None, SendMessage(chat_id=2, text="x"))
+        with pytest.raises(CircuitOpen):
+            await guard(offline, None, SendMessage(chat_id=2, text="x"))
+
+        assert guard.revive(1)
+        assert await store.get(NS_DEAD, 1) is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+import time
+
+from duo_registry import DuoLinkRegistry
+from storage import NS_DUO, MemoryStateStore
+
+
+def test_restoring_twice_does_not_duplicate_links():
+    registry = DuoLinkRegistry(MemoryStateStore(), NS_DUO, max_per_creator=3)
+    stored = {"a": [7, time.time() + 3600], "b": [7, time.time() + 3600]}
+    for _ in range(2):
+        for token, value in stored.items():
+            registry.restore(token, value)
+
+    assert len(registry) == 2
+    assert list(registry._by_creator[7]) == ["a", "b"]
+    # Без дубликатов удаление не падает на уже удалённом токене
+    assert registry.revoke_creator(7) == ["a", "b"]
+    assert registry.redeem("a") is None
+    assert len(registry) == 0
+
+
+def test_creator_limit_replaces_oldest_link():
+    registry = DuoLinkRegistry(MemoryStateStore(), NS_DUO, max_per_creator=2)
+    tokens = [registry.create(1) for _ in range(3)]
+    assert registry.get(tokens[0]) is None
+    assert registry.get(tokens[2]) == 1
+    assert registry.replaced == 1
+
+
+def test_expired_links_are_swept():
+    registry = DuoLinkRegistry(MemoryStateStore(), NS_DUO, ttl=-1)
+    token = registry.create(1)
+    assert registry.get(token) is None
+    assert registry.sweep() == 1
+    assert len(registry) == 0
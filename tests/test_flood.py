@@ -0,0 +1,69 @@
+import asyncio
+from types import SimpleNamespace
+
+from flood import KIND_MEDIA, KIND_TEXT, FloodControl
+
+
+def test_text_and_media_have_separate_buckets_and_album_counts_once():
+    flood = FloodControl(text_rate=1.0, text_burst=2, media_rate=0.5, media_burst=1, mute_after=100)
+    assert flood.admit(1, KIND_TEXT, now=0) is None
+    assert flood.admit(1, KIND_TEXT, now=0) is None
+    assert flood.admit(1, KIND_TEXT, now=0) == 0.0
+
+    # Части альбома расходуют один токен медиа на всех
+    for _ in range(5):
+        assert flood.admit(1, KIND_MEDIA, album="a", now=0) is None
+    assert flood.admit(1, KIND_MEDIA, album="b", now=0) == 0.0
+    assert flood.admit(1, KIND_MEDIA, now=2) is None
+    assert flood.admit(1, KIND_TEXT, now=2) is None
+    assert flood.dropped == {KIND_TEXT: 1, KIND_MEDIA: 1}
+
+
+def test_repeated_flood_mutes_with_doubling_duration():
+    flood = FloodControl(text_rate=0.0, text_burst=1, mute_after=2, mute_base=10, mute_max=25, strike_reset=100)
+    assert flood.admit(1, KIND_TEXT, now=0) is None
+    assert flood.admit(1, KIND_TEXT, now=0) == 0.0
+    assert flood.admit(1, KIND_TEXT, now=0) == 10
+    assert flood.admit(1, KIND_TEXT, now=5) == 0.0
+    assert flood.dropped_muted == 1
+
+    flood.admit(1, KIND_TEXT, now=10)
+    assert flood.admit(1, KIND_TEXT, now=10) == 20
+    flood.admit(1, KIND_TEXT, now=30)
+    assert flood.admit(1, KIND_TEXT, now=30) == 25
+    assert flood.mutes == 3
+
+
+def test_cap_evicts_least_recent_user_but_keeps_recent_mutes():
+    flood = FloodControl(text_rate=0.0, text_burst=1, mute_after=1, mute_base=10, strike_reset=100, max_users=3)
+    flood.admit(1, KIND_TEXT, now=0)
+    assert flood.admit(1, KIND_TEXT, now=0) == 10
+    flood.admit(2, KIND_TEXT, now=0)
+    flood.admit(3, KIND_TEXT, now=0)
+
+    flood.admit(4, KIND_TEXT, now=1)
+    assert len(flood) == 3
+    assert list(flood._slots) == [3, 1, 4]
+    # Заглушённый не получил свежее ведро
+    assert flood.admit(1, KIND_TEXT, now=2) == 0.0
+
+
+def test_middleware_drops_silently_and_notifies_on_mute():
+    async def scenario():
+        mutes = []
+
+        async def on_mute(user_id, seconds):
+            mutes.append((user_id, seconds))
+
+        async def handler(event, data):
+            return "handled"
+
+        flood = FloodControl(text_rate=0.0, text_burst=1, mute_after=1, mute_base=30, on_mute=on_mute, exempt={9})
+        event = SimpleNamespace(message=SimpleNamespace(text="hi", media_group_id=None))
+        assert await flood(handler, event, {"event_from_user": SimpleNamespace(id=1)}) == "handled"
+        assert await flood(handler, event, {"event_from_user": SimpleNamespace(id=1)}) is None
+        assert mutes == [(1, 30)]
+        for _ in range(3):
+            assert await flood(handler, event, {"event_from_user": SimpleNamespace(id=9)}) == "handled"
+
+    asyncio.run(scenario())
@@ -0,0 +1,52 @@
+import asyncio
+
+from aiogram import Bot
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from catalog import ResponseCatalog
+from http_session import DEFAULT_METHOD_TIMEOUTS, create_api_session, parse_method_timeouts
+
+ME = {"id": 42, "is_bot": True, "first_name": "bot"}
+
+
+def test_method_timeouts_override_defaults_and_skip_bad_items():
+    timeouts = parse_method_timeouts("sendMessage=5, getMe=2,bad=x,,")
+    assert timeouts["sendMessage"] == 5
+    assert timeouts["getMe"] == 2
+    assert timeouts["sendMediaGroup"] == DEFAULT_METHOD_TIMEOUTS["sendMediaGroup"]
+    assert "bad" not in timeouts
+
+
+def test_connections_are_reused_and_limited():
+    async def scenario():
+        gate = asyncio.Event()
+        gate.set()
+
+        async def handle(request):
+            await gate.wait()
+            return web.json_response({"ok": True, "result": ME})
+
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", handle)
+        async with TestServer(app) as server:
+            session = create_api_session(ResponseCatalog(), api_url=str(server.make_url("")).rstrip("/"), limit=1)
+            bot = Bot("42:TEST", session=session)
+            for _ in range(3):
+                assert (await bot.get_me()).id == 42
+            assert session.pool_stats() == {"in_use": 0, "waiting": 0, "created": 1, "reused": 2}
+
+            # Одно соединение занято долгим запросом: следующий ждёт в очереди пула
+            gate.clear()
+            requests = asyncio.gather(bot.get_me(), bot.get_me())
+            while session.waiting == 0:
+                await asyncio.sleep(0.01)
+            assert session.pool_stats()["in_use"] == 1
+            gate.set()
+            await requests
+            assert session.pool_stats()["waiting"] == 0
+            assert session.sessions == 1
+            await session.close()
+
+    asyncio.run(scenario())
+
@@ -0,0 +1,19 @@
+import json
+import subprocess
+import sys
+
+from tests.conftest import ROOT
+
+
+def test_cli_writes_results_to_output(tmp_path):
+    output = tmp_path / "results.json"
+    subprocess.run(
+        [sys.executable, "-m", "bench.loadtest", "--users", "20", "--messages", "2",
+         "--scenarios", "find_storm", "chatty_pairs", "--output", str(output)],
+        cwd=ROOT, check=True, capture_output=True, timeout=120,
+    )
+
+    results = json.loads(output.read_text(encoding="utf-8"))
+    assert results["params"]["users"] == 20
+    assert "output" not in results["params"]
+    assert results["find_storm"]["paired"] == 20
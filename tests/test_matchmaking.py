@@ -0,0 +1,46 @@
+import time
+
+from matchmaking import MatchQueue
+
+
+def test_vip_users_are_matched_first():
+    queue = MatchQueue()
+    queue.push(1)
+    queue.push(2, vip=True)
+    queue.push(3)
+
+    assert queue.pop(10) == 2
+    assert queue.pop(11) == 1
+    assert list(queue) == [3]
+
+
+def test_regular_user_is_served_after_vip_burst():
+    queue = MatchQueue(vip_burst=2)
+    queue.push(1)
+    for user_id in (2, 3, 4):
+        queue.push(user_id, vip=True)
+
+    assert [queue.pop(10), queue.pop(11), queue.pop(12)] == [2, 3, 1]
+    assert queue.pop(13) == 4
+
+
+def test_regular_user_waiting_too_long_is_served_before_vip():
+    queue = MatchQueue(max_regular_wait=30)
+    queue.push(1, enqueued_at=time.monotonic() - 60)
+    queue.push(2, vip=True)
+
+    assert queue.pop(10) == 1
+
+
+def test_push_and_discard_keep_queue_consistent():
+    queue = MatchQueue()
+    assert queue.push(1)
+    assert not queue.push(1)
+    assert 1 in queue
+    assert queue.discard(1)
+    assert not queue.discard(1)
+    assert len(queue) == 0
+    assert queue.pop(10) is None
+    # Себя из очереди не получить
+    queue.push(10)
+    assert queue.pop(10) is None
@@ -0,0 +1,42 @@
+import re
+
+from metrics import MetricsRegistry
+
+
+def test_render_uses_prometheus_text_format():
+    registry = MetricsRegistry()
+    errors = registry.counter("api_errors", "Ошибки", ("method",))
+    errors.labels("sendMessage").inc(2)
+    registry.histogram("latency", "Задержка", bounds=(0.1, 1.0)).labels().observe(0.5)
+    registry.gauge("queue", "Очередь", lambda: {("vip",): 1, ("regular",): 3}, ("tier",))
+    registry.callback_counter("dropped", "Отброшено", lambda: 7)
+
+    assert registry.render().splitlines() == [
+        "# HELP api_errors_total Ошибки",
+        "# TYPE api_errors_total counter",
+        'api_errors_total{method="sendMessage"} 2',
+        "# HELP latency Задержка",
+        "# TYPE latency histogram",
+        'latency_bucket{le="0.1"} 0',
+        'latency_bucket{le="1.0"} 1',
+        'latency_bucket{le="+Inf"} 1',
+        "latency_sum 0.5",
+        "latency_count 1",
+        "# HELP queue Очередь",
+        "# TYPE queue gauge",
+        'queue{tier="vip"} 1',
+        'queue{tier="regular"} 3',
+        "# HELP dropped_total Отброшено",
+        "# TYPE dropped_total counter",
+        "dropped_total 7",
+    ]
+
+
+def test_bot_exports_monotonic_totals_as_counters():
+    import bot
+
+    types = dict(re.findall(r"^# TYPE (\S+) (\S+)$", bot.metrics.render(), re.MULTILINE))
+    for name in ("bot_send_rejected", "bot_flood_dropped", "bot_admin_mirror_dropped",
+                 "bot_admin_mirror_failed", "bot_vip_expired", "bot_http_connections"):
+        assert types.pop(f"{name}_total") == "counter"
+    assert types["bot_queue_depth"] == "gauge"
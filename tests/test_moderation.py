@@ -0,0 +1,52 @@
+import os
+
+from moderation import RULE_DOMAIN, RULE_MENTION, RULE_TLD, RULE_URL, RULE_WORD, Moderator, parse_rules
+
+
+def test_rules_of_every_kind_are_matched_by_one_pattern():
+    moderator = Moderator()
+    moderator.load_rules(parse_rules([
+        "# комментарий",
+        "domain t.me",
+        "tld xyz",
+        "mention @spam_bot",
+        "word казин*",
+        "bogus rule",
+    ]))
+    assert moderator.rule_count == 4
+
+    assert moderator.check("пиши в t.me/chan") == (RULE_DOMAIN, "t.me")
+    assert moderator.check("зайди на sub.T.ME") == (RULE_DOMAIN, "sub.T.ME")
+    assert moderator.check("сайт promo.xyz") == (RULE_TLD, "promo.xyz")
+    assert moderator.check("это @spam_bot") == (RULE_MENTION, "@spam_bot")
+    assert moderator.check("лучшие казино тут") == (RULE_WORD, "казино")
+    assert moderator.check("привет, @friend, как дела? about.me") is None
+    assert moderator.check("мы купили казан") is None
+    assert moderator.check(None) is None
+
+
+def test_default_rules_block_links():
+    moderator = Moderator()
+    assert moderator.check("https://example.com") == (RULE_URL, "https://example.com")
+    assert moderator.check("без ссылок") is None
+
+
+def test_reload_picks_up_changes_and_keeps_rules_on_error(tmp_path):
+    path = tmp_path / "rules.txt"
+    moderator = Moderator(str(path))
+    assert not moderator.reload()
+    assert moderator.check("www.example.com") is not None
+
+    path.write_text("word спам\n", encoding="utf-8")
+    assert moderator.reload()
+    assert not moderator.reload()
+    assert moderator.check("www.example.com") is None
+    assert moderator.check("это спам") == (RULE_WORD, "спам")
+
+    # Нечитаемый файл: остаются прежние правила, ошибка не повторяется до изменения
+    path.write_bytes(b"word \xff\xfe\n")
+    os.utime(path, (1, 1))
+    assert not moderator.reload()
+    assert not moderator.reload()
+    assert moderator.check("это спам") is not None
+    assert moderator.reloads == 1
@@ -0,0 +1,51 @@
+import asyncio
+
+from reaper import ActivityReaper
+from session_backend import create_session_backend
+from storage import MemoryStateStore
+
+
+def test_idle_waiting_user_and_silent_chat_are_reclaimed():
+    async def scenario():
+        sessions = create_session_backend(MemoryStateStore(), "local://")
+        notified = []
+
+        async def on_queue_timeout(user_id):
+            notified.append(("queue", user_id))
+
+        async def on_idle_chat(user_id, partner_id):
+            notified.append(("chat", user_id, partner_id))
+
+        reaper = ActivityReaper(sessions, queue_timeout=60, idle_timeout=100,
+                                on_queue_timeout=on_queue_timeout, on_idle_chat=on_idle_chat)
+        await sessions.pair(1, 2)
+        await sessions.match(3)
+        for user_id in (1, 2, 3):
+            reaper.touch(user_id, now=0)
+
+        # Собеседник писал недавно: чат живёт, проверка переносится
+        reaper.touch(2, now=50)
+        assert await reaper.sweep(now=70) == 1
+        assert notified == [("queue", 3)]
+        assert not await sessions.is_waiting(3)
+
+        assert await reaper.sweep(now=120) == 0
+        assert await reaper.sweep(now=151) == 1
+        assert notified[-1] == ("chat", 1, 2)
+        assert await sessions.partner_of(2) is None
+        assert (reaper.reclaimed_waiting, reaper.reclaimed_sessions) == (1, 1)
+
+    asyncio.run(scenario())
+
+
+def test_user_outside_chat_and_queue_stops_being_tracked():
+    async def scenario():
+        reaper = ActivityReaper(create_session_backend(MemoryStateStore(), "local://"), queue_timeout=10)
+        reaper.touch(1, now=0)
+        assert await reaper.sweep(now=5) == 0
+        assert len(reaper) == 1
+        assert await reaper.sweep(now=20) == 0
+        assert len(reaper) == 0
+        assert not reaper._heap
+
+    asyncio.run(scenario())
@@ -0,0 +1,56 @@
+import asyncio
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from send_scheduler import LANE_BULK, LANE_RELAY, SendScheduler, send_lane
+
+
+def test_relay_lane_is_served_before_bulk():
+    async def scenario():
+        scheduler = SendScheduler(global_rate=20)
+        scheduler.global_bucket.tokens = 0
+        sent = []
+
+        async def make_request(bot, method):
+            sent.append(method.chat_id)
+
+        async def send(chat_id, lane):
+            with send_lane(lane):
+                await scheduler(make_request, None, SendMessage(chat_id=chat_id, text="x"))
+
+        bulk = [asyncio.create_task(send(chat_id, LANE_BULK)) for chat_id in (1, 2)]
+        await asyncio.sleep(0)
+        await send(3, LANE_RELAY)
+        await asyncio.gather(*bulk)
+        assert sent == [3, 1, 2]
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_pauses_chat_and_repeats_request():
+    async def scenario():
+        scheduler = SendScheduler()
+        calls = []
+
+        async def make_request(bot, method):
+            calls.append(asyncio.get_running_loop().time())
+            if len(calls) == 1:
+                raise TelegramRetryAfter(method, "Too Many Requests", 0.2)
+            return True
+
+        assert await scheduler(make_request, None, SendMessage(chat_id=1, text="x"))
+        assert scheduler.retried == 1
+        assert calls[1] - calls[0] >= 0.15
+
+    asyncio.run(scenario())
+
+
+def test_chat_buckets_are_capped_in_lru_order():
+    scheduler = SendScheduler(max_chat_buckets=3)
+    for chat_id in (1, 2, 3):
+        scheduler._bucket(chat_id, 0.0)
+    scheduler._bucket(1, 0.0)
+    scheduler._bucket(4, 0.0)
+
+    assert list(scheduler._chats) == [3, 1, 4]
@@ -0,0 +1,135 @@
+import asyncio
+import itertools
+import os
+import uuid
+
+import pytest
+
+from matchmaking import LANGUAGES, SCAN_LIMIT, SearchRequest, parse_search_request
+from session_backend import create_session_backend
+from storage import MemoryStateStore
+
+BACKENDS = ("local", "sqlite", "redis")
+
+
+def make_backend(kind, tmp_path, **kwargs):
+    """Бэкенд чатов для теста. Redis проверяется, только если задан TEST_REDIS_URL"""
+    if kind == "local":
+        return create_session_backend(MemoryStateStore(), "local://", **kwargs)
+    if kind == "sqlite":
+        return create_session_backend(MemoryStateStore(), f"sqlite:///{tmp_path / 'sessions.db'}", **kwargs)
+    url = os.getenv("TEST_REDIS_URL")
+    if not url:
+        pytest.skip("TEST_REDIS_URL не задан")
+    return create_session_backend(MemoryStateStore(), url, prefix=f"test-{uuid.uuid4().hex}:", **kwargs)
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_pair_and_unpair_are_atomic(kind, tmp_path):
+    async def scenario():
+        backend = make_backend(kind, tmp_path)
+        assert await backend.pair(1, 2)
+        assert not await backend.pair(1, 3)
+        assert not await backend.pair(3, 3)
+        assert await backend.partner_of(1) == 2
+        assert await backend.partner_of(3) is None
+
+        assert await backend.unpair(2) == 1
+        assert await backend.partner_of(1) is None
+        assert await backend.unpair(1) is None
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_match_pairs_with_waiting_user_or_queues(kind, tmp_path):
+    async def scenario():
+        backend = make_backend(kind, tmp_path)
+        assert await backend.match(1) is None
+        assert await backend.is_waiting(1)
+
+        assert await backend.match(2) == 1
+        assert await backend.partner_of(1) == 2
+        assert not await backend.is_waiting(1)
+        # В чате поиск не начинается
+        assert await backend.match(1) is None
+        assert not await backend.is_waiting(1)
+
+        assert await backend.match(3) is None
+        assert await backend.cancel_search(3)
+        assert await backend.waiting_user_ids() == []
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+def test_two_workers_never_pair_one_user_twice(tmp_path):
+    async def scenario():
+        workers = [make_backend("sqlite", tmp_path) for _ in range(2)]
+        await asyncio.gather(*(
+            workers[user_id % 2].match(user_id) for user_id in range(1, 41)
+        ))
+
+        reader = workers[0]
+        active = await reader.active_user_ids()
+        for user_id in active:
+            partner_id = await reader._fetch_partner(user_id)
+            assert await reader._fetch_partner(partner_id) == user_id
+        assert len(active) + len(await reader.waiting_user_ids()) == 40
+        for worker in workers:
+            await worker.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_other_language_heads_do_not_hide_a_match(kind, tmp_path):
+    async def scenario():
+        backend = make_backend(kind, tmp_path)
+        # У каждого в голове корзины свой язык: друг другу и ищущему они не подходят
+        languages = sorted(LANGUAGES - {"ru"})
+        assert len(languages) > SCAN_LIMIT
+        for user_id, lang in enumerate(languages, 1):
+            assert await backend.match(user_id, request=parse_search_request([lang, "music"])) is None
+        assert await backend.match(100, request=parse_search_request(["ru", "music"])) is None
+
+        assert await backend.match(200, request=parse_search_request(["ru", "music"])) == 100
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_vip_only_heads_do_not_hide_a_match(kind, tmp_path):
+    async def scenario():
+        backend = make_backend(kind, tmp_path)
+        for user_id in range(1, SCAN_LIMIT + 3):
+            assert await backend.match(user_id, request=SearchRequest(vip_only=True)) is None
+        assert await backend.match(100) is None
+
+        assert await backend.match(200) == 100
+        await backend.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("kind", BACKENDS)
+def test_recent_partner_heads_do_not_hide_a_match(kind, tmp_path):
+    async def scenario():
+        backend = make_backend(kind, tmp_path, recent_size=SCAN_LIMIT + 4)
+        heads = list(range(1, SCAN_LIMIT + 3))
+        # Все ожидающие — недавние собеседники друг друга, а головы корзины — ещё и ищущего
+        for user_id, partner_id in itertools.combinations([*heads, 100], 2):
+            assert await backend.pair(user_id, partner_id)
+            await backend.unpair(user_id)
+        for user_id in heads:
+            assert await backend.pair(200, user_id)
+            await backend.unpair(200)
+        for user_id in [*heads, 100]:
+            assert await backend.match(user_id) is None
+
+        assert await backend.match(200) == 100
+        await backend.close()
+
+    asyncio.run(scenario())
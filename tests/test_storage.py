@@ -0,0 +1,62 @@
+import asyncio
+
+from storage import NS_USERS, NS_VIP, MemoryStateStore, SQLiteStateStore
+
+
+def test_get_sees_pending_and_flushed_values(tmp_path):
+    async def scenario():
+        for store in (SQLiteStateStore(str(tmp_path / "state.db")), MemoryStateStore()):
+            store.put(NS_USERS, 1, {"username": "a"})
+            store.put(NS_USERS, 2, {"username": "b"})
+            assert await store.get(NS_USERS, 1) == {"username": "a"}
+            await store.flush()
+            store.delete(NS_USERS, 1)
+            store.put(NS_VIP, 9, 1.0)
+
+            assert await store.get(NS_USERS, 1) is None
+            assert await store.get(NS_USERS, "2") == {"username": "b"}
+            assert await store.get(NS_VIP, 9) == 1.0
+            await store.flush()
+            assert await store.get(NS_USERS, 1) is None
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_keys_merge_pending_writes_with_stored_keys(tmp_path):
+    async def scenario():
+        for store in (SQLiteStateStore(str(tmp_path / "state.db")), MemoryStateStore()):
+            store.put(NS_USERS, 1, {"username": "a"})
+            store.put(NS_USERS, 2, {"username": "b"})
+            await store.flush()
+            store.delete(NS_USERS, 1)
+            store.put(NS_USERS, 3, {"username": "c"})
+            store.put(NS_VIP, 9, 1.0)
+            assert sorted(await store.keys(NS_USERS)) == ["2", "3"]
+            await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_snapshot_is_ignored_after_a_write_from_another_process(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "state.db")
+        first = SQLiteStateStore(path)
+        second = SQLiteStateStore(path)
+
+        first.put(NS_VIP, 1, 1.0)
+        await first.close()
+        fresh = SQLiteStateStore(path)
+        assert fresh._read_snapshot() is not None
+
+        # Другой воркер пишет в ту же базу после снимка
+        second.put(NS_VIP, 2, 2.0)
+        await second.flush()
+        assert fresh._read_snapshot() is None
+        assert await fresh.load() == {NS_VIP: {"1": 1.0, "2": 2.0}}
+
+        await second.close()
+        assert await fresh.load() == {NS_VIP: {"1": 1.0, "2": 2.0}}
+        await fresh.close()
+
+    asyncio.run(scenario())
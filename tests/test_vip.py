@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+from session_backend import create_session_backend
+from storage import NS_VIP, MemoryStateStore
+from vip import DAY, VipRegistry
+
+
+def test_subscription_expires_on_time():
+    async def scenario():
+        registry = VipRegistry(MemoryStateStore(), NS_VIP)
+        expires_at = await registry.grant(1, days=1)
+        assert 1 in registry
+        assert registry.expires_at(1) == expires_at
+
+        assert registry.sweep(now=expires_at - 1) == []
+        assert registry.sweep(now=expires_at) == [1]
+        assert len(registry) == 0
+
+        # Истёкшая подписка перестаёт действовать ещё до очистки
+        await registry.grant(2, days=-1 / DAY)
+        assert 2 not in registry
+        assert registry.sweep() == [2]
+        assert registry.expired == 2
+
+    asyncio.run(scenario())
+
+
+def test_extend_adds_to_current_expiry_and_sweep_skips_stale_heap_entries():
+    async def scenario():
+        store = MemoryStateStore()
+        registry = VipRegistry(store, NS_VIP)
+        first = await registry.grant(1, days=1)
+        extended = await registry.extend(1, days=2)
+        assert abs(extended - first - 2 * DAY) < 1e-6
+
+        # Старый срок остался в куче, но подписка продлена
+        assert registry.sweep(now=first + 1) == []
+        assert 1 in registry
+        assert registry.sweep(now=extended) == [1]
+        assert store._pending[(NS_VIP, "1")] is not None
+
+    asyncio.run(scenario())
+
+
+def test_restore_grants_legacy_entries_and_drops_expired():
+    registry = VipRegistry(MemoryStateStore(), NS_VIP, default_days=30)
+    registry.restore("1", True)
+    registry.restore("2", time.time() - 10)
+    registry.restore("3", time.time() + 100)
+    assert 1 in registry and registry.expires_at(1) > time.time() + 29 * DAY
+    assert 2 not in registry
+    assert 3 in registry
+
+
+def test_revoke():
+    async def scenario():
+        registry = VipRegistry(MemoryStateStore(), NS_VIP)
+        await registry.grant(1)
+        assert await registry.revoke(1)
+        assert not await registry.revoke(1)
+        assert 1 not in registry
+
+    asyncio.run(scenario())
+
+
+def test_shared_backend_keeps_workers_in_agreement(tmp_path):
+    async def scenario():
+        notified = []
+        workers = []
+        backends = []
+        for worker in range(2):
+            store = MemoryStateStore()
+            backend = create_session_backend(store, url=f"sqlite:///{tmp_path / 'sessions.db'}")
+            backends.append(backend)
+
+            async def on_expire(user_id, worker=worker):
+                notified.append((worker, user_id))
+
+            workers.append(VipRegistry(store, NS_VIP, backend=backend, on_expire=on_expire, sweep_interval=0.02))
+        first, second = workers
+
+        # Подписка, известная только из хранилища процесса, публикуется при запуске
+        first.restore("9", True)
+        await first.sync(publish_missing=True)
+
+        expires_at = await first.grant(1, days=1)
+        await second.sync()
+        assert second.expires_at(1) == expires_at
+        assert 9 in second
+
+        extended = await second.extend(1, days=1)
+        await first.sync()
+        assert first.expires_at(1) == extended
+
+        assert await second.revoke(9)
+        await first.sync()
+        assert 9 not in first
+
+        # Об истечении уведомляет ровно один воркер
+        await first.grant(5, days=0.05 / DAY)
+        await second.sync()
+        for registry in workers:
+            registry.start()
+        await asyncio.sleep(0.3)
+        for registry in workers:
+            await registry.stop()
+        assert [user_id for _, user_id in notified] == [5]
+        assert 5 not in first and 5 not in second
+
+        for backend in backends:
+            await backend.close()
+
+    asyncio.run(scenario())
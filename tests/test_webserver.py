@@ -0,0 +1,46 @@
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+
+from metrics import MetricsRegistry
+from webserver import STATUS_KEY, create_app
+
+UPDATE = {"update_id": 1}
+
+
+def test_webhook_health_and_metrics_share_one_server():
+    async def scenario():
+        metrics = MetricsRegistry()
+        metrics.gauge("bot_up", "Бот запущен", lambda: 1)
+        app = create_app(Dispatcher(), Bot("42:TEST"), "/webhook", max_in_flight=0,
+                         secret_token="secret", metrics=metrics)
+        async with TestServer(app) as server, ClientSession() as client:
+            async def request(method, path, **kwargs):
+                async with client.request(method, server.make_url(path), **kwargs) as response:
+                    return response.status, await response.text()
+
+            assert await request("GET", "/health") == (200, "Bot is running")
+            assert await request("GET", "/ready") == (200, "Ready")
+            assert "bot_up 1" in (await request("GET", "/metrics"))[1]
+
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "secret"}
+            # Все места для обновлений заняты: Telegram повторит позже
+            assert (await request("POST", "/webhook", json=UPDATE, headers=headers))[0] == 429
+            app[STATUS_KEY]["ready"] = False
+            assert (await request("POST", "/webhook", json=UPDATE, headers=headers))[0] == 503
+            assert (await request("GET", "/ready"))[0] == 503
+
+    asyncio.run(scenario())
+
+
+def test_webhook_rejects_wrong_secret():
+    async def scenario():
+        app = create_app(Dispatcher(), Bot("42:TEST"), "/webhook", secret_token="secret")
+        async with TestServer(app) as server, ClientSession() as client:
+            async with client.post(server.make_url("/webhook"), json=UPDATE,
+                                   headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+                assert response.status == 401
+
+    asyncio.run(scenario())
@@ -0,0 +1,125 @@
+import sys
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Callable, Iterator, Optional
+
+# Сколько записей просматривать при оценке занимаемой памяти
+FOOTPRINT_SAMPLE = 256
+
+
+class UserRecord:
+    """Компактная запись о пользователе"""
+
+    __slots__ = ("username", "first_name", "last_name", "search")
+
+    def __init__(self, username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> None:
+        self.username = username
+        self.first_name = first_name
+        self.last_name = last_name
+        self.search: Any = None  # Параметры последнего /find, не сохраняются
+
+    def matches(self, username: Optional[str], first_name: Optional[str], last_name: Optional[str]) -> bool:
+        return self.username == username and self.first_name == first_name and self.last_name == last_name
+
+    def size(self) -> int:
+        fields = (self.username, self.first_name, self.last_name)
+        return sys.getsizeof(self) + sum(sys.getsizeof(value) for value in fields if value is not None)
+
+    def as_dict(self) -> dict:
+        return {"username": self.username, "first_name": self.first_name, "last_name": self.last_name}
+
+
+class UserCache:
+    """Ограниченный кэш данных пользователей с вытеснением давно неактивных (LRU).
+
+    Пользователи, для которых ``is_pinned`` возвращает True (в чате, в
+    очереди, VIP), не вытесняются. Вытеснение только освобождает память:
+    запись остаётся в хранилище состояния, а вернувшийся пользователь
+    записывается в кэш заново.
+    """
+
+    # Сколько закреплённых записей пропустить за одно вытеснение
+    MAX_PINNED_SKIPS = 64
+
+    def __init__(
+        self,
+        max_size: int,
+        is_pinned: Callable[[int], bool] = lambda user_id: False,
+    ) -> None:
+        self.max_size = max_size
+        self.is_pinned = is_pinned
+        self._records: "OrderedDict[int, UserRecord]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __contains__(self, user_id: object) -> bool:
+        return user_id in self._records
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._records)
+
+    def get(self, user_id: int) -> Optional[UserRecord]:
+        record = self._records.get(user_id)
+        if record is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return record
+
+    def peek(self, user_id: int) -> Optional[UserRecord]:
+        """Запись без учёта в статистике и без продвижения в LRU (для логов и служебных чтений)"""
+        return self._records.get(user_id)
+
+    def username(self, user_id: int) -> Optional[str]:
+        record = self._records.get(user_id)
+        return record.username if record is not None else None
+
+    def update(
+        self,
+        user_id: int,
+        username: Optional[str],
+        first_name: Optional[str],
+        last_name: Optional[str],
+    ) -> bool:
+        """Обновление записи. Возвращает True, если данные изменились"""
+        record = self._records.get(user_id)
+        if record is not None:
+            self._records.move_to_end(user_id)
+            if record.matches(username, first_name, last_name):
+                return False
+            record.username, record.first_name, record.last_name = username, first_name, last_name
+        else:
+            self._records[user_id] = UserRecord(username, first_name, last_name)
+            if len(self._records) > self.max_size:
+                self._evict()
+        self.writes += 1
+        return True
+
+    def _evict(self) -> None:
+        for _ in range(self.MAX_PINNED_SKIPS):
+            user_id, record = self._records.popitem(last=False)
+            if not self.is_pinned(user_id):
+                self.evictions += 1
+                return
+            # Закреплённую запись возвращаем в конец очереди
+            self._records[user_id] = record
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def footprint(self) -> int:
+        """Оценка занимаемой памяти в байтах по выборке записей"""
+        if not self._records:
+            return sys.getsizeof(self._records)
+        sample = list(islice(self._records.values(), FOOTPRINT_SAMPLE))
+        per_record = sum(record.size() for record in sample) / len(sample)
+        # Узел OrderedDict и ключ int на каждую запись
+        per_entry = per_record + 100 + sys.getsizeof(0)
+        return int(sys.getsizeof(self._records) + per_entry * len(self._records))
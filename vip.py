@@ -0,0 +1,191 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+ExpireCallback = Callable[[int], Awaitable[None]]
+
+
+class VipRegistry:
+    """Подписки VIP со сроком действия.
+
+    Проверка ``user_id in vip_users`` — O(1) по словарю с учётом срока, так
+    что истёкшая подписка перестаёт действовать сразу, ещё до очистки.
+    Истечение обрабатывается через min-кучу по времени окончания: фоновая
+    очистка извлекает только истёкшие подписки, O(log n) на каждую, и
+    вызывает ``on_expire``. Продление не ищет старую запись в куче — она
+    отбрасывается при извлечении, если срок уже другой. Все изменения
+    записываются в хранилище состояния.
+
+    С общим бэкендом чатов (``backend.shared``) подписки записываются и в
+    него: выдача и продление сначала идут в бэкенд, а словарь и куча раз в
+    ``sweep_interval`` секунд сверяются с ним, так что изменения других
+    воркеров видны с этой задержкой. Об окончании подписки уведомляет тот
+    воркер, который удалил её из бэкенда.
+    """
+
+    def __init__(
+        self,
+        store: Any,
+        ns: str,
+        default_days: float = 30,
+        sweep_interval: float = 60.0,
+        on_expire: Optional[ExpireCallback] = None,
+        backend: Any = None,
+    ) -> None:
+        self.store = store
+        self.ns = ns
+        self.default_days = default_days
+        self.sweep_interval = sweep_interval
+        self.on_expire = on_expire
+        self.backend = backend
+        self._expires: Dict[int, float] = {}
+        self._expiry: List[Tuple[float, int]] = []
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def __contains__(self, user_id: object) -> bool:
+        expires_at = self._expires.get(user_id)
+        return expires_at is not None and expires_at > time.time()
+
+    def __iter__(self) -> Iterator[Tuple[int, float]]:
+        """Подписки (user_id, expires_at) в порядке окончания"""
+        return iter(sorted(self._expires.items(), key=lambda item: item[1]))
+
+    @property
+    def shared(self) -> bool:
+        return self.backend is not None and self.backend.shared
+
+    def expires_at(self, user_id: int) -> Optional[float]:
+        """Время окончания действующей подписки или None"""
+        return self._expires.get(user_id) if user_id in self else None
+
+    async def grant(self, user_id: int, days: Optional[float] = None) -> float:
+        """Выдача подписки на ``days`` дней от текущего момента, заменяя прежний срок"""
+        expires_at = time.time() + self._period(days)
+        if self.shared:
+            await self.backend.publish_vip(user_id, expires_at)
+        return self._set(user_id, expires_at)
+
+    async def extend(self, user_id: int, days: Optional[float] = None) -> float:
+        """Продление действующей подписки (или выдача новой) на ``days`` дней"""
+        expires_at = await self.backend.extend_vip(user_id, self._period(days)) if self.shared else None
+        if expires_at is None:
+            expires_at = max(time.time(), self._expires.get(user_id, 0.0)) + self._period(days)
+        return self._set(user_id, expires_at)
+
+    async def revoke(self, user_id: int) -> bool:
+        """Отзыв подписки. Возвращает False, если её не было"""
+        dropped = await self.backend.drop_vip(user_id) if self.shared else False
+        if self._expires.pop(user_id, None) is None and not dropped:
+            return False
+        self.store.delete(self.ns, user_id)
+        return True
+
+    def restore(self, user_id: Any, value: Any) -> None:
+        """Загрузка подписки из хранилища"""
+        user_id = int(user_id)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            # Записи без срока, сохранённые до появления подписок
+            self._set(user_id, time.time() + self._period(None))
+        elif value > time.time():
+            self._expires[user_id] = value
+            heapq.heappush(self._expiry, (value, user_id))
+        else:
+            self.store.delete(self.ns, user_id)
+
+    async def sync(self, publish_missing: bool = False) -> None:
+        """Сверка с общим бэкендом: подписки, выданные, продлённые и отозванные другими воркерами.
+
+        При запуске (``publish_missing``) подписки, известные только из
+        хранилища процесса, записываются в бэкенд, а не удаляются.
+        """
+        if not self.shared:
+            return
+        known = dict(self._expires)
+        subscriptions = await self.backend.vip_subscriptions()
+        for user_id, expires_at in known.items():
+            if user_id in subscriptions:
+                continue
+            if publish_missing:
+                await self.backend.publish_vip(user_id, expires_at)
+            elif self._expires.get(user_id) == expires_at:
+                # Отозвана или удалена при истечении другим воркером
+                del self._expires[user_id]
+                self.store.delete(self.ns, user_id)
+        for user_id, expires_at in subscriptions.items():
+            if known.get(user_id) != expires_at and expires_at > time.time():
+                self._set(user_id, expires_at)
+
+    def sweep(self, now: Optional[float] = None) -> List[int]:
+        """Удаление истёкших подписок. Стоимость пропорциональна их числу"""
+        now = time.time() if now is None else now
+        expired = []
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, user_id = heapq.heappop(self._expiry)
+            # Подписку могли продлить или отозвать
+            if self._expires.get(user_id) == expires_at:
+                del self._expires[user_id]
+                self.store.delete(self.ns, user_id)
+                expired.append(user_id)
+        self.expired += len(expired)
+        return expired
+
+    def _period(self, days: Optional[float]) -> float:
+        return (self.default_days if days is None else days) * DAY
+
+    def _set(self, user_id: int, expires_at: float) -> float:
+        self._expires[user_id] = expires_at
+        heapq.heappush(self._expiry, (expires_at, user_id))
+        self.store.put(self.ns, user_id, expires_at)
+        return expires_at
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sync()
+                expired = await self._claim(self.sweep())
+            except Exception as e:
+                logger.warning("Ошибка сверки VIP подписок с общим бэкендом: %s", e)
+                continue
+            if expired:
+                logger.info("Истекло VIP подписок: %d", len(expired))
+            if self.on_expire is not None:
+                for user_id in expired:
+                    try:
+                        await self.on_expire(user_id)
+                    except Exception as e:
+                        logger.warning("Ошибка уведомления об окончании VIP %s: %s", user_id, e)
+
+    async def _claim(self, expired: List[int]) -> List[int]:
+        """Истёкшие подписки, удалённые из общего бэкенда этим воркером: о них уведомляет он"""
+        if not self.shared or not expired:
+            return expired
+        now = time.time()
+        claimed = [user_id for user_id in expired if await self.backend.drop_vip(user_id, expired_before=now)]
+        if len(claimed) < len(expired):
+            # Остальные продлены другим воркером или уже удалены им
+            await self.sync()
+        return claimed
@@ -0,0 +1,119 @@
+import logging
+from typing import Any, Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+STATUS_KEY = web.AppKey("status", dict)
+METRICS_KEY = web.AppKey("metrics", MetricsRegistry)
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Обработчик webhook с ограничением числа обновлений в обработке.
+
+    Обновления обрабатываются в фоне, Telegram сразу получает ответ. Если в
+    обработке уже ``max_in_flight`` обновлений, запрос отклоняется с 429 и
+    Telegram повторит его позже.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_in_flight: int = 1000, **kwargs: Any) -> None:
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self.max_in_flight = max_in_flight
+        self.rejected = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._background_feed_update_tasks)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not request.app[STATUS_KEY]["ready"]:
+            return web.Response(status=503, text="Not ready", headers={"Retry-After": "1"})
+        if self.in_flight >= self.max_in_flight:
+            self.rejected += 1
+            if self.rejected % 100 == 1:
+                logger.warning("Webhook перегружен: в обработке %d, отклонено %d", self.in_flight, self.rejected)
+            return web.Response(status=429, text="Too many updates in flight", headers={"Retry-After": "1"})
+        return await super().handle(request)
+
+    __call__ = handle
+
+
+async def health_check(request: web.Request) -> web.Response:
+    """Проверка, что процесс жив"""
+    return web.Response(text="Bot is running")
+
+
+async def readiness_check(request: web.Request) -> web.Response:
+    """Проверка, что бот запущен и принимает обновления"""
+    if request.app[STATUS_KEY]["ready"]:
+        return web.Response(text="Ready")
+    return web.Response(status=503, text="Not ready")
+
+
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Метрики в текстовом формате Prometheus"""
+    return web.Response(
+        text=request.app[METRICS_KEY].render(),
+        content_type="text/plain",
+        headers={"X-Content-Type-Options": "nosniff"}
+    )
+
+
+def add_metrics_route(app: web.Application, metrics: MetricsRegistry) -> None:
+    app[METRICS_KEY] = metrics
+    app.router.add_get("/metrics", metrics_endpoint)
+
+
+async def start_status_server(metrics: MetricsRegistry, port: int) -> web.AppRunner:
+    """Отдельный сервер проверки состояния и метрик для режима polling"""
+    app = web.Application()
+    app.router.add_get("/", health_check)
+    app.router.add_get("/health", health_check)
+    add_metrics_route(app, metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    return runner
+
+
+def create_app(
+    dispatcher: Dispatcher,
+    bot: Bot,
+    webhook_path: str,
+    max_in_flight: int = 1000,
+    secret_token: Optional[str] = None,
+    metrics: Optional[MetricsRegistry] = None,
+) -> web.Application:
+    """Приложение aiohttp с webhook и проверками состояния"""
+    app = web.Application()
+    app[STATUS_KEY] = {"ready": False}
+
+    BoundedRequestHandler(
+        dispatcher=dispatcher,
+        bot=bot,
+        max_in_flight=max_in_flight,
+        secret_token=secret_token,
+    ).register(app, path=webhook_path)
+    app.router.add_get("/", health_check)
+    app.router.add_get("/health", health_check)
+    app.router.add_get("/ready", readiness_check)
+    if metrics is not None:
+        add_metrics_route(app, metrics)
+
+    setup_application(app, dispatcher, bot=bot)
+
+    async def mark_ready(app: web.Application) -> None:
+        app[STATUS_KEY]["ready"] = True
+
+    async def mark_not_ready(app: web.Application) -> None:
+        app[STATUS_KEY]["ready"] = False
+
+    # Запускается после startup диспетчера и до его shutdown
+    app.on_startup.append(mark_ready)
+    app.on_shutdown.insert(0, mark_not_ready)
+    return app